@@ -0,0 +1,11 @@
+"""python -m tools 入口"""
+
+import os
+import sys
+
+# tools 內的腳本以同目錄模組互相匯入
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cli import main
+
+sys.exit(main())
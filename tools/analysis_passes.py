@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+可組合的分析 pass
+所有 pass 共用同一份已載入的像素陣列與延遲計算的中間結果 (逐格統計、積分圖等)，
+讓多種分析只需載入與解碼一次
+"""
+
+import os
+
+import numpy as np
+from PIL import Image
+
+import analyze_npc_assets
+import analyze_office_furniture
+import analyze_office_layout
+import reanalyze_npc_in
+import verify_desk_content
+from cell_stats import cell_view, compute_cell_stats, content_cells
+from color_classifier import SKIN, frame_label_histograms, label_fraction
+from color_histogram import color_histogram, frame_color_counts, palette_stats
+from frame_records import frame_records_from_stats
+from grid_inference import infer_grid
+from pixel_cache import load_pixels
+from sprite_islands import detect_sprites
+from stage_timer import stage
+from summed_area import build_alpha_index
+
+
+def create_sheet_context(image_path, grid=(13, 11)):
+    """建立分析用的 sheet 上下文，像素只在這裡載入一次
+
+    原始色彩模式就是 RGBA 時，原始模式的像素 (見 _native_pixels) 直接共用同一個陣列
+    """
+    pixels = load_pixels(image_path)
+    height, width = pixels.shape[:2]
+    with Image.open(image_path) as img:
+        mode = img.mode
+
+    return {
+        'path': image_path,
+        'name': os.path.basename(image_path),
+        'pixels': pixels,
+        'mode': mode,
+        'width': width,
+        'height': height,
+        'grid': grid,
+        'cache': {'native_pixels': pixels} if mode == 'RGBA' else {},
+    }
+
+
+def _cached(sheet, key, compute):
+    """在 sheet 上下文中快取共用的中間結果"""
+    if key not in sheet['cache']:
+        sheet['cache'][key] = compute()
+    return sheet['cache'][key]
+
+
+def _native_pixels(sheet):
+    """原始色彩模式的像素 (例如調色盤圖片的索引值)，與 RGBA 不同時才另外解碼一次"""
+    return _cached(sheet, 'native_pixels', lambda: load_pixels(sheet['path'], mode=None))
+
+
+def _cell_stats(sheet):
+    return _cached(sheet, 'cell_stats', lambda: compute_cell_stats(sheet['pixels'], *sheet['grid']))
+
+
+def _label_histograms(sheet):
+    """整張 sheet 查表分類一次，供 skin/furniture/desk pass 共用"""
+    return _cached(sheet, 'label_histograms', lambda: frame_label_histograms(sheet['pixels'], *sheet['grid']))
+
+
+def _content_rgb(sheet):
+    def compute():
+        pixels = sheet['pixels']
+        return pixels[pixels[:, :, 3] > 0][:, :3]
+    return _cached(sheet, 'content_rgb', compute)
+
+
+def coverage_pass(sheet):
+    """逐格內容覆蓋率與邊界"""
+    stats = _cell_stats(sheet)
+    cols = sheet['grid'][0]
+
+    return {
+        'cell_size': list(stats['cell_size']),
+        'cells': [
+            {
+                'index': index,
+                'position': [col, row],
+                'coverage': coverage,
+                'bbox': stats['bbox'][row, col].tolist(),
+                'mean_color': [round(float(c), 1) for c in stats['mean_color'][row, col]],
+            }
+            for col, row, index, coverage in content_cells(stats, 0.0)
+        ],
+        'empty_cells': int(np.count_nonzero(stats['content_pixels'] == 0)),
+        'total_cells': int(stats['coverage'].size),
+        'grid': f"{cols}x{sheet['grid'][1]}",
+    }
+
+
+def transparency_pass(sheet):
+    """整張圖的透明度分佈"""
+    alpha = sheet['pixels'][:, :, 3]
+    total_pixels = alpha.size
+
+    return {
+        'transparent': float(np.count_nonzero(alpha == 0) / total_pixels),
+        'semi_transparent': float(np.count_nonzero((alpha > 0) & (alpha < 255)) / total_pixels),
+        'opaque': float(np.count_nonzero(alpha == 255) / total_pixels),
+    }
+
+
+def grid_pass(sheet):
+    """以積分圖評分網格假設"""
+    alpha_index = _cached(sheet, 'alpha_index', lambda: build_alpha_index(sheet['pixels']))
+    best_grids = reanalyze_npc_in.test_different_grid_assumptions(
+        sheet['pixels'], sheet['width'], sheet['height'], alpha_index=alpha_index
+    )
+    return {'inferred': infer_grid(sheet['pixels']), 'best_grids': best_grids}
+
+
+def edges_pass(sheet):
+    """透明度投影的分割點"""
+    transparent = sheet['pixels'][:, :, 3] == 0
+    h_edges = reanalyze_npc_in.find_edges(np.mean(transparent, axis=0))
+    v_edges = reanalyze_npc_in.find_edges(np.mean(transparent, axis=1))
+
+    return {
+        'vertical_splits': h_edges,
+        'horizontal_splits': v_edges,
+        'estimated_grid': [len(h_edges) + 1, len(v_edges) + 1],
+    }
+
+
+def skin_pass(sheet):
+    """膚色比例 (整張與逐格)"""
+    histograms = _label_histograms(sheet)
+    frames = [
+        {'index': index, 'skin_ratio': label_fraction(histograms[index], SKIN)}
+        for _, _, index, _ in content_cells(_cell_stats(sheet), 0.1)
+    ]
+    return {
+        'skin_ratio': float(analyze_npc_assets.detect_skin_tones(_content_rgb(sheet))),
+        'frames': frames,
+    }
+
+
+def furniture_pass(sheet):
+    """家具/人物顏色評分與內容分類"""
+    histograms = _label_histograms(sheet)
+    frames = []
+    for col, row, index, coverage in content_cells(_cell_stats(sheet), 0.2):
+        furniture_score = analyze_office_furniture.furniture_color_score(histograms[index])
+        character_score = analyze_office_furniture.character_color_score(histograms[index])
+        frames.append({
+            'index': index,
+            'position': [col, row],
+            'coverage': coverage,
+            'furniture_score': float(furniture_score),
+            'character_score': float(character_score),
+            'type': analyze_office_furniture.classify_content_type(furniture_score, character_score),
+        })
+    return {'frames': frames}
+
+
+def desk_pass(sheet):
+    """逐格辦公桌/人物判斷"""
+    stats = _cell_stats(sheet)
+    cols, rows = sheet['grid']
+    cells = cell_view(sheet['pixels'], cols, rows)
+    histograms = _label_histograms(sheet)
+
+    frames = []
+    for analysis in verify_desk_content.analyze_all_frames(cells, stats, histograms):
+        if analysis['has_content']:
+            analysis['coverage'] = float(analysis['coverage'])
+            frames.append(analysis)
+
+    return {
+        'frames': frames,
+        'desk_frames': [a['frame_index'] for a in frames if a['likely_desk']],
+    }
+
+
+def palette_pass(sheet):
+    """精確調色盤與每幀用色數"""
+    stats = palette_stats(color_histogram(sheet['pixels']))
+    frames = frame_color_counts(sheet['pixels'], *sheet['grid'])
+
+    return {
+        **stats,
+        'frame_colors': frames['frame_colors'].tolist(),
+        'single_frame_colors': int(np.count_nonzero(frames['color_frames'] == 1)),
+    }
+
+
+def islands_pass(sheet):
+    """連通區塊偵測的 sprite 矩形 (不依賴網格)"""
+    result = detect_sprites(sheet['pixels'])
+    return {
+        'islands': result['islands'],
+        'sprites': len(result['rects']),
+        'rects': result['rects'].tolist(),
+    }
+
+
+def floor_pass(sheet):
+    """背景圖的地板區域與適合放置 NPC 的位置"""
+    return analyze_office_layout.analyze_background_pixels(_native_pixels(sheet)) or {}
+
+
+PASSES = {
+    'coverage': (coverage_pass, '逐格內容覆蓋率與邊界'),
+    'transparency': (transparency_pass, '整張圖的透明度分佈'),
+    'grid': (grid_pass, '網格假設評分'),
+    'edges': (edges_pass, '透明度投影分割點'),
+    'skin': (skin_pass, '膚色比例'),
+    'furniture': (furniture_pass, '家具/人物顏色評分'),
+    'desk': (desk_pass, '逐格辦公桌判斷'),
+    'palette': (palette_pass, '精確調色盤與每幀用色數'),
+    'islands': (islands_pass, '連通區塊 sprite 偵測'),
+    'floor': (floor_pass, '背景地板區域與 NPC 位置'),
+}
+
+DEFAULT_PASSES = ['coverage', 'transparency', 'grid']
+
+
+def run_passes(sheet, pass_names):
+    """對同一份 sheet 依序執行多個 pass，回傳合併報告"""
+    unknown = [name for name in pass_names if name not in PASSES]
+    if unknown:
+        raise ValueError(f"未知的分析 pass: {', '.join(unknown)} (可用: {', '.join(PASSES)})")
+
+    report = {
+        'file': sheet['name'],
+        'size': [sheet['width'], sheet['height']],
+        'grid': list(sheet['grid']),
+        'passes': {},
+    }
+    for name in pass_names:
+        with stage(f'pass.{name}', image=sheet['name']):
+            report['passes'][name] = PASSES[name][0](sheet)
+
+    return report
+
+
+def sheet_frame_records(sheet, report=None):
+    """整理 sheet 的逐幀欄式記錄 (見 frame_records)
+
+    覆蓋率、邊界與家具/人物評分一律以整張 sheet 一次計算；
+    辦公桌評分需要逐格結構分析，只有報告中含 desk pass 時才填入
+    """
+    records = frame_records_from_stats(_cell_stats(sheet))
+    histograms = _label_histograms(sheet)
+    scored = records['has_content']
+    records['furniture_score'][scored] = analyze_office_furniture.furniture_color_score(histograms)[scored]
+    records['character_score'][scored] = analyze_office_furniture.character_color_score(histograms)[scored]
+
+    desk = (report or {}).get('passes', {}).get('desk')
+    if desk:
+        for frame in desk['frames']:
+            record = records[frame['frame_index']]
+            record['likely_desk'] = frame['likely_desk']
+            record['likely_character'] = frame['likely_character']
+            if 'desk_score' in frame:
+                record['desk_score'] = frame['desk_score']
+
+    return records
@@ -7,6 +7,14 @@ from PIL import Image
 import numpy as np
 import json
 
+from build_manifest import is_up_to_date, load_manifest, record_output, save_manifest
+from color_classifier import SKIN, classify_pixels, label_fraction, label_histogram
+from color_histogram import color_histogram, palette_stats, unpack_colors
+from grid_inference import infer_grid
+from pixel_cache import load_pixels
+from stage_timer import profiled_run, stage
+from summed_area import build_alpha_index, grid_coverage
+
 def analyze_npc_in_image():
     """分析 npc-in.png 的內容"""
     
@@ -18,11 +26,8 @@ def analyze_npc_in_image():
         print(f"圖片尺寸: {width}x{height}")
         print(f"色彩模式: {img.mode}")
         
-        # 轉換為RGBA確保有透明度信息
-        if img.mode != 'RGBA':
-            img = img.convert('RGBA')
-        
-        img_array = np.array(img)
+        # 轉換為RGBA確保有透明度信息 (解碼結果走快取)
+        img_array = load_pixels("../static/assets/tilesets/npc-in.png")
         
         # 分析透明度
         alpha_channel = img_array[:, :, 3]
@@ -40,7 +45,7 @@ def analyze_npc_in_image():
         
         return {
             'size': [width, height],
-            'mode': img.mode,
+            'mode': 'RGBA',
             'content_coverage': float(content_coverage),
             'analysis_complete': True
         }
@@ -66,7 +71,15 @@ def detect_grid_patterns(img_array, width, height):
         (16, 16), # 16x16
     ]
     
-    alpha_channel = img_array[:, :, 3]
+    # 自動推測的網格優先檢查
+    inferred = infer_grid(img_array)
+    print(f"  📐 自動推測網格: {inferred['grid'][0]}x{inferred['grid'][1]} "
+          f"({inferred['cell_size'][0]}x{inferred['cell_size'][1]} 每格, 信心 {inferred['confidence']:.2f})")
+    if inferred['grid'] not in common_grids:
+        common_grids.insert(0, inferred['grid'])
+    
+    # 積分圖只建一次，供所有網格假設查詢
+    alpha_index = build_alpha_index(img_array)
     
     for cols, rows in common_grids:
         cell_width = width // cols
@@ -76,23 +89,16 @@ def detect_grid_patterns(img_array, width, height):
             continue
             
         # 檢查每個格子的內容
-        grid_analysis = []
-        for row in range(rows):
-            for col in range(cols):
-                x1 = col * cell_width
-                y1 = row * cell_height
-                x2 = x1 + cell_width
-                y2 = y1 + cell_height
-                
-                cell_alpha = alpha_channel[y1:y2, x1:x2]
-                cell_coverage = np.sum(cell_alpha > 0) / (cell_width * cell_height)
-                
-                if cell_coverage > 0.1:  # 10%以上有內容
-                    grid_analysis.append({
-                        'grid': (col, row),
-                        'coverage': cell_coverage,
-                        'index': row * cols + col
-                    })
+        coverage = grid_coverage(alpha_index, cols, rows)
+        content_rows, content_cols = np.nonzero(coverage > 0.1)  # 10%以上有內容
+        grid_analysis = [
+            {
+                'grid': (int(col), int(row)),
+                'coverage': float(coverage[row, col]),
+                'index': int(row * cols + col)
+            }
+            for row, col in zip(content_rows, content_cols)
+        ]
         
         if len(grid_analysis) > 0:
             print(f"  網格 {cols}x{rows}: 找到{len(grid_analysis)}個有內容的格子")
@@ -101,43 +107,40 @@ def detect_grid_patterns(img_array, width, height):
                     print(f"    格子({cell['grid'][0]}, {cell['grid'][1]}): 覆蓋率{cell['coverage']:.1%}")
 
 def analyze_color_distribution(img_array):
-    """分析顏色分佈"""
+    """分析顏色分佈 (精確調色盤統計)"""
     
     print("\n🎨 分析顏色分佈...")
     
-    # 只分析非透明像素
-    alpha_mask = img_array[:, :, 3] > 0
-    rgb_pixels = img_array[alpha_mask][:, :3]
+    # 只分析非透明像素，打包成整數後一次統計
+    histogram = color_histogram(img_array)
     
-    if len(rgb_pixels) == 0:
+    if histogram['total'] == 0:
         print("  沒有找到非透明內容")
-        return
+        return None
     
-    # 計算主要顏色
-    mean_color = np.mean(rgb_pixels, axis=0)
-    print(f"  平均顏色: RGB({mean_color[0]:.0f}, {mean_color[1]:.0f}, {mean_color[2]:.0f})")
+    stats = palette_stats(histogram, top=5)
+    print(f"  不同顏色數: {stats['color_count']}"
+          f" ({'可無損轉為 8-bit 調色盤' if stats['fits_8bit_palette'] else '需要量化才能轉為 8-bit 調色盤'})")
+    print("  主要顏色:")
+    for color in stats['dominant']:
+        print(f"    {color['color']}: {color['ratio']:.1%}")
     
-    # 檢測是否可能是角色圖像（膚色檢測）
-    skin_tones = detect_skin_tones(rgb_pixels)
+    # 檢測是否可能是角色圖像（膚色檢測）: 只分類調色盤中的顏色，以像素數加權
+    labels = classify_pixels(unpack_colors(histogram['colors'])[:, :3])
+    skin_tones = label_fraction(np.bincount(labels, weights=histogram['counts'], minlength=256), SKIN)
     if skin_tones:
         print(f"  🧑 檢測到可能的膚色區域: {skin_tones:.1%}")
+    
+    stats['skin_ratio'] = skin_tones
+    return stats
 
 def detect_skin_tones(rgb_pixels):
-    """檢測膚色"""
-    
-    # 簡單的膚色檢測範圍
-    skin_conditions = (
-        (rgb_pixels[:, 0] > 95) &   # R > 95
-        (rgb_pixels[:, 1] > 40) &   # G > 40  
-        (rgb_pixels[:, 2] > 20) &   # B > 20
-        (rgb_pixels[:, 0] > rgb_pixels[:, 1]) &  # R > G
-        (rgb_pixels[:, 0] > rgb_pixels[:, 2])    # R > B
-    )
+    """檢測膚色 (規則見 color_classifier.SKIN)"""
     
-    skin_pixel_count = np.sum(skin_conditions)
-    total_pixels = len(rgb_pixels)
+    if len(rgb_pixels) == 0:
+        return 0
     
-    return skin_pixel_count / total_pixels if total_pixels > 0 else 0
+    return label_fraction(label_histogram(classify_pixels(rgb_pixels)), SKIN)
 
 def compare_with_reference_game():
     """與參考遊戲畫面對比分析"""
@@ -202,6 +205,13 @@ def main():
     
     print("🔍 開始分析 NPC 資源...")
     
+    output_path = "../static/assets/data/npc_in_analysis.json"
+    inputs = ["../static/assets/tilesets/npc-in.png", __file__]
+    manifest = load_manifest()
+    if is_up_to_date(manifest, output_path, inputs):
+        print(f"⏭️ 輸入未變更，略過: {output_path}")
+        return
+    
     # 分析 npc-in.png
     result = analyze_npc_in_image()
     
@@ -213,9 +223,12 @@ def main():
     
     # 保存分析結果
     if result:
-        with open("../static/assets/data/npc_in_analysis.json", "w", encoding="utf-8") as f:
+        with stage('json_dump'), open(output_path, "w", encoding="utf-8") as f:
             json.dump(result, f, indent=2, ensure_ascii=False)
-        print(f"\n💾 分析結果已保存到: ../static/assets/data/npc_in_analysis.json")
+        record_output(manifest, output_path, inputs)
+        save_manifest(manifest)
+        print(f"\n💾 分析結果已保存到: {output_path}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with profiled_run('analyze_npc_assets'):
+        main()
\ No newline at end of file
@@ -6,9 +6,23 @@
 from PIL import Image
 import numpy as np
 import json
+import sys
 
-def analyze_furniture_with_npcs():
-    """分析包含辦公桌與人物的 npc-in.png"""
+from build_manifest import is_up_to_date, load_manifest, record_output, save_manifest
+from cell_stats import compute_cell_stats, content_cells
+from color_classifier import (
+    CHARACTER_CLOTHING, CHARACTER_SKIN, FURNITURE_METAL, FURNITURE_WOOD,
+    classify_pixels, frame_label_histograms, label_fraction, label_histogram,
+)
+from frame_records import frame_records_from_stats, records_path, save_frame_records
+from pixel_cache import load_pixels
+from stage_timer import profiled_run, stage
+
+def analyze_furniture_with_npcs(npz_path=None):
+    """分析包含辦公桌與人物的 npc-in.png
+
+    指定 npz_path 時另外輸出欄式的逐格評分 (見 frame_records)
+    """
     
     try:
         print("🔍 重新分析去背後的 npc-in.png...")
@@ -18,11 +32,8 @@ def analyze_furniture_with_npcs():
         print(f"圖片尺寸: {width}x{height}")
         print(f"色彩模式: {img.mode}")
         
-        # 轉換為RGBA確保有透明度信息
-        if img.mode != 'RGBA':
-            img = img.convert('RGBA')
-        
-        img_array = np.array(img)
+        # 轉換為RGBA確保有透明度信息 (解碼結果走快取)
+        img_array = load_pixels("../static/assets/tilesets/npc-in.png")
         
         # 分析透明度 - 去背後應該有透明區域
         alpha_channel = img_array[:, :, 3]
@@ -38,7 +49,7 @@ def analyze_furniture_with_npcs():
         print("✅ 確認是去背圖片" if transparency_ratio > 0.1 else "⚠️ 可能未完全去背")
         
         # 分析網格中的辦公桌+人物組合
-        analyze_desk_npc_combinations(img_array, width, height)
+        analyze_desk_npc_combinations(img_array, width, height, npz_path=npz_path)
         
         # 與純NPC圖片對比
         compare_with_pure_npc()
@@ -54,53 +65,43 @@ def analyze_furniture_with_npcs():
         print(f"分析時出錯: {e}")
         return None
 
-def analyze_desk_npc_combinations(img_array, width, height):
+def analyze_desk_npc_combinations(img_array, width, height, npz_path=None):
     """分析辦公桌+人物的組合"""
     
     print("\n🏢 分析辦公桌+人物組合...")
     
     # 使用13x11網格分析
     cols, rows = 13, 11
-    cell_width = width // cols
-    cell_height = height // rows
     
-    alpha_channel = img_array[:, :, 3]
+    stats = compute_cell_stats(img_array, cols, rows)
+    # 整張 sheet 只查表分類一次，得到每格的顏色旗標直方圖
+    histograms = frame_label_histograms(img_array, cols, rows)
     combinations = []
     
-    for row in range(rows):
-        for col in range(cols):
-            x1 = col * cell_width
-            y1 = row * cell_height
-            x2 = x1 + cell_width
-            y2 = y1 + cell_height
-            
-            # 提取格子內容
-            cell_alpha = alpha_channel[y1:y2, x1:x2]
-            cell_rgb = img_array[y1:y2, x1:x2, :3]
-            
-            # 計算內容覆蓋率
-            content_pixels = np.sum(cell_alpha > 0)
-            coverage = content_pixels / (cell_width * cell_height)
-            
-            if coverage > 0.2:  # 20%以上有內容
-                # 分析顏色分佈來判斷內容類型
-                content_mask = cell_alpha > 0
-                if np.sum(content_mask) > 0:
-                    rgb_content = cell_rgb[content_mask]
-                    
-                    # 檢測家具色調（通常是木色、金屬色）
-                    furniture_score = detect_furniture_colors(rgb_content)
-                    # 檢測人物色調（膚色、衣服色）
-                    character_score = detect_character_colors(rgb_content)
-                    
-                    combinations.append({
-                        'position': (col, row),
-                        'index': row * cols + col,
-                        'coverage': coverage,
-                        'furniture_score': furniture_score,
-                        'character_score': character_score,
-                        'type': classify_content_type(furniture_score, character_score)
-                    })
+    with stage('furniture.per_cell_loop'):
+        # 只對覆蓋率 20% 以上的格子做顏色分析
+        for col, row, index, coverage in content_cells(stats, 0.2):
+            # 檢測家具色調（通常是木色、金屬色）
+            furniture_score = furniture_color_score(histograms[index])
+            # 檢測人物色調（膚色、衣服色）
+            character_score = character_color_score(histograms[index])
+        
+            combinations.append({
+                'position': (col, row),
+                'index': index,
+                'coverage': coverage,
+                'furniture_score': furniture_score,
+                'character_score': character_score,
+                'type': classify_content_type(furniture_score, character_score)
+            })
+    
+    if npz_path:
+        records = frame_records_from_stats(stats)
+        # 評分以整個直方圖陣列一次計算，只保留有做顏色分析的格子
+        scored = np.array([combo['index'] for combo in combinations], dtype=np.intp)
+        records['furniture_score'][scored] = furniture_color_score(histograms)[scored]
+        records['character_score'][scored] = character_color_score(histograms)[scored]
+        save_frame_records(npz_path, records, grid=np.array([cols, rows]))
     
     # 按內容覆蓋率排序
     combinations.sort(key=lambda x: x['coverage'], reverse=True)
@@ -116,66 +117,31 @@ def analyze_desk_npc_combinations(img_array, width, height):
     
     return combinations
 
+def furniture_color_score(histogram):
+    """由旗標直方圖計算家具顏色比例 (木色或金屬/灰色)"""
+    return label_fraction(histogram, FURNITURE_WOOD | FURNITURE_METAL)
+
+def character_color_score(histogram):
+    """由旗標直方圖計算人物顏色比例 (膚色或衣服色彩)"""
+    return label_fraction(histogram, CHARACTER_SKIN | CHARACTER_CLOTHING)
+
 def detect_furniture_colors(rgb_pixels):
-    """檢測家具顏色特徵"""
+    """檢測家具顏色特徵
+    
+    家具通常是木色 (棕色系)、金屬色 (灰色系)，規則見 color_classifier
+    """
     if len(rgb_pixels) == 0:
         return 0.0
-    
-    # 家具通常是：
-    # - 木色 (棕色系)
-    # - 金屬色 (灰色系)
-    # - 黑色/白色 (辦公設備)
-    
-    # 檢測木色
-    wood_conditions = (
-        (rgb_pixels[:, 0] > 100) &  # R > 100
-        (rgb_pixels[:, 1] > 50) &   # G > 50
-        (rgb_pixels[:, 2] < 100) &  # B < 100
-        (rgb_pixels[:, 0] > rgb_pixels[:, 2])  # R > B (偏紅棕色)
-    )
-    
-    # 檢測金屬/灰色
-    metal_conditions = (
-        (np.abs(rgb_pixels[:, 0] - rgb_pixels[:, 1]) < 30) &  # R ≈ G
-        (np.abs(rgb_pixels[:, 1] - rgb_pixels[:, 2]) < 30) &  # G ≈ B
-        (rgb_pixels[:, 0] > 50) & (rgb_pixels[:, 0] < 200)    # 中等亮度
-    )
-    
-    furniture_pixels = np.sum(wood_conditions | metal_conditions)
-    return furniture_pixels / len(rgb_pixels)
+    return furniture_color_score(label_histogram(classify_pixels(rgb_pixels)))
 
 def detect_character_colors(rgb_pixels):
-    """檢測人物顏色特徵"""
+    """檢測人物顏色特徵
+    
+    人物通常有膚色與衣服色彩 (藍、白、黑)，規則見 color_classifier
+    """
     if len(rgb_pixels) == 0:
         return 0.0
-    
-    # 人物通常有：
-    # - 膚色
-    # - 衣服色彩 (多樣化)
-    # - 頭髮色 (黑、棕、金等)
-    
-    # 膚色檢測 (改進版)
-    skin_conditions = (
-        (rgb_pixels[:, 0] > 95) &   # R > 95
-        (rgb_pixels[:, 1] > 40) &   # G > 40  
-        (rgb_pixels[:, 2] > 20) &   # B > 20
-        (rgb_pixels[:, 0] > rgb_pixels[:, 1]) &  # R > G
-        (rgb_pixels[:, 0] > rgb_pixels[:, 2]) &  # R > B
-        (rgb_pixels[:, 1] > rgb_pixels[:, 2])    # G > B
-    )
-    
-    # 衣服色彩檢測 (高飽和度或特殊顏色)
-    clothing_conditions = (
-        # 藍色系 (襯衫、西裝)
-        (rgb_pixels[:, 2] > rgb_pixels[:, 0] + 30) |
-        # 白色系 (襯衫)
-        ((rgb_pixels[:, 0] > 200) & (rgb_pixels[:, 1] > 200) & (rgb_pixels[:, 2] > 200)) |
-        # 黑色系 (正裝)
-        ((rgb_pixels[:, 0] < 50) & (rgb_pixels[:, 1] < 50) & (rgb_pixels[:, 2] < 50))
-    )
-    
-    character_pixels = np.sum(skin_conditions | clothing_conditions)
-    return character_pixels / len(rgb_pixels)
+    return character_color_score(label_histogram(classify_pixels(rgb_pixels)))
 
 def classify_content_type(furniture_score, character_score):
     """分類內容類型"""
@@ -256,17 +222,33 @@ def main():
     
     print("🔍 重新分析辦公桌+人物組合資源...")
     
+    output_path = "../static/assets/data/furniture_npc_analysis.json"
+    npz_path = records_path(output_path)
+    # 欄式 .npz 一定輸出，JSON 摘要可用 --no-json 略過
+    write_json = '--no-json' not in sys.argv
+    outputs = [npz_path, output_path] if write_json else [npz_path]
+    inputs = ["../static/assets/tilesets/npc-in.png", __file__]
+    manifest = load_manifest()
+    if all(is_up_to_date(manifest, path, inputs) for path in outputs):
+        print(f"⏭️ 輸入未變更，略過: {', '.join(outputs)}")
+        return
+    
     # 分析組合內容
-    result = analyze_furniture_with_npcs()
+    result = analyze_furniture_with_npcs(npz_path=npz_path)
     
     # 生成應用創意
     generate_usage_ideas()
     
     # 保存分析結果
     if result:
-        with open("../static/assets/data/furniture_npc_analysis.json", "w", encoding="utf-8") as f:
-            json.dump(result, f, indent=2, ensure_ascii=False)
-        print(f"\n💾 分析結果已保存到: ../static/assets/data/furniture_npc_analysis.json")
+        if write_json:
+            with stage('json_dump'), open(output_path, "w", encoding="utf-8") as f:
+                json.dump(result, f, indent=2, ensure_ascii=False)
+        for path in outputs:
+            record_output(manifest, path, inputs)
+        save_manifest(manifest)
+        print(f"\n💾 分析結果已保存到: {', '.join(outputs)}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with profiled_run('analyze_office_furniture'):
+        main()
\ No newline at end of file
@@ -3,112 +3,287 @@
 分析辦公室底圖布局，識別地板區域和可放置NPC的位置
 """
 
-from PIL import Image
 import json
+import math
+import sys
 import numpy as np
 
-def analyze_office_background():
-    """分析辦公室背景圖像"""
-    
-    bg_files = [
-        "../static/assets/tilesets/office_bg.png",
-        "../static/assets/tilesets/office_bg2.png"
-    ]
+from build_manifest import is_up_to_date, load_manifest, record_output, save_manifest
+from pixel_cache import load_pixels
+from stage_timer import profiled_run, stage
+from summed_area import block_sums, build_summed_area_table, window_sums
+
+BG_FILES = [
+    "../static/assets/tilesets/office_bg.png",
+    "../static/assets/tilesets/office_bg2.png"
+]
+
+# 串流模式每次處理的列數，需為區塊大小的倍數
+STRIP_HEIGHT = 512
+# 地板遮罩縮減成區塊計數時的區塊大小，視窗大小與步長都必須是它的倍數
+FLOOR_BLOCK_SIZE = 16
+
+def analyze_office_background(bg_files=BG_FILES, streaming=False, strip_height=STRIP_HEIGHT):
+    """分析辦公室背景圖像
+
+    streaming=True 時以水平條帶分兩次掃描，記憶體用量只與條帶大小有關
+    """
     
     results = {}
     
     for bg_file in bg_files:
         try:
             print(f"\n=== 分析 {bg_file} ===")
-            img = Image.open(bg_file)
-            width, height = img.size
-            print(f"圖片尺寸: {width}x{height}")
             
-            # 轉換為numpy數組進行分析
-            img_array = np.array(img)
+            # 轉換為numpy數組進行分析 (保留原始色彩模式，解碼結果走快取)
+            img_array = load_pixels(bg_file, mode=None)
             
-            # 分析顏色分佈，識別地板區域
-            # 通常地板是較深的顏色，家具/牆壁是較亮的顏色
-            if len(img_array.shape) == 3:
-                # RGB圖片
-                gray = np.mean(img_array, axis=2)
+            if streaming:
+                result = analyze_background_streaming(img_array, strip_height)
             else:
-                # 灰度圖片
-                gray = img_array
-            
-            # 分析亮度分佈
-            mean_brightness = np.mean(gray)
-            std_brightness = np.std(gray)
-            
-            print(f"平均亮度: {mean_brightness:.1f}")
-            print(f"亮度標準差: {std_brightness:.1f}")
-            
-            # 識別可能的地板區域（較暗的區域）
-            floor_threshold = mean_brightness - 0.5 * std_brightness
-            floor_mask = gray < floor_threshold
-            
-            # 找出地板區域的座標
-            floor_coords = np.where(floor_mask)
-            
-            if len(floor_coords[0]) > 0:
-                # 計算地板區域的邊界
-                min_y, max_y = np.min(floor_coords[0]), np.max(floor_coords[0])
-                min_x, max_x = np.min(floor_coords[1]), np.max(floor_coords[1])
-                
-                print(f"地板區域邊界:")
-                print(f"  X範圍: {min_x} - {max_x}")
-                print(f"  Y範圍: {min_y} - {max_y}")
-                
-                # 分析地板區域密度，找出適合放置NPC的位置
-                floor_regions = analyze_floor_regions(floor_mask, width, height)
-                
-                results[bg_file] = {
-                    'size': [width, height],
-                    'floor_bounds': {
-                        'x_min': int(min_x), 'x_max': int(max_x),
-                        'y_min': int(min_y), 'y_max': int(max_y)
-                    },
-                    'suitable_positions': floor_regions,
-                    'mean_brightness': float(mean_brightness),
-                    'floor_threshold': float(floor_threshold)
-                }
+                result = analyze_background_pixels(img_array)
+            if result:
+                results[bg_file] = result
             
         except Exception as e:
             print(f"分析 {bg_file} 時出錯: {e}")
     
     return results
 
+def compute_floor_mask(img_array):
+    """依亮度識別地板區域，回傳 {'mask', 'mean_brightness', 'std_brightness', 'floor_threshold'}"""
+    
+    # 分析顏色分佈，識別地板區域
+    # 通常地板是較深的顏色，家具/牆壁是較亮的顏色
+    if len(img_array.shape) == 3:
+        # RGB圖片
+        gray = np.mean(img_array, axis=2)
+    else:
+        # 灰度圖片
+        gray = img_array
+    
+    # 分析亮度分佈
+    mean_brightness = np.mean(gray)
+    std_brightness = np.std(gray)
+    
+    # 識別可能的地板區域（較暗的區域）
+    floor_threshold = mean_brightness - 0.5 * std_brightness
+    
+    return {
+        'mask': gray < floor_threshold,
+        'mean_brightness': mean_brightness,
+        'std_brightness': std_brightness,
+        'floor_threshold': floor_threshold
+    }
+
+def analyze_background_pixels(img_array):
+    """分析單張背景的像素陣列，識別地板區域與適合放置NPC的位置"""
+    
+    height, width = img_array.shape[:2]
+    print(f"圖片尺寸: {width}x{height}")
+    
+    floor = compute_floor_mask(img_array)
+    floor_mask = floor['mask']
+    mean_brightness = floor['mean_brightness']
+    floor_threshold = floor['floor_threshold']
+    
+    print(f"平均亮度: {mean_brightness:.1f}")
+    print(f"亮度標準差: {floor['std_brightness']:.1f}")
+    
+    # 找出地板區域的座標
+    floor_coords = np.where(floor_mask)
+    
+    if len(floor_coords[0]) == 0:
+        return None
+    
+    # 計算地板區域的邊界
+    min_y, max_y = np.min(floor_coords[0]), np.max(floor_coords[0])
+    min_x, max_x = np.min(floor_coords[1]), np.max(floor_coords[1])
+    
+    print(f"地板區域邊界:")
+    print(f"  X範圍: {min_x} - {max_x}")
+    print(f"  Y範圍: {min_y} - {max_y}")
+    
+    # 分析地板區域密度，找出適合放置NPC的位置
+    floor_regions = analyze_floor_regions(floor_mask, width, height)
+    
+    return {
+        'size': [width, height],
+        'floor_bounds': {
+            'x_min': int(min_x), 'x_max': int(max_x),
+            'y_min': int(min_y), 'y_max': int(max_y)
+        },
+        'suitable_positions': floor_regions,
+        'mean_brightness': float(mean_brightness),
+        'floor_threshold': float(floor_threshold)
+    }
+
+def _iter_gray_strips(img_array, strip_height):
+    """逐條產生 (起始列, 灰度條帶)，灰度計算方式與整張分析相同"""
+    height = img_array.shape[0]
+    for top in range(0, height, strip_height):
+        strip = img_array[top:top + strip_height]
+        if strip.ndim == 3:
+            yield top, np.mean(strip, axis=2)
+        else:
+            yield top, strip.astype(np.float64)
+
+def analyze_background_streaming(img_array, strip_height=STRIP_HEIGHT, block_size=FLOOR_BLOCK_SIZE):
+    """以水平條帶分析背景，結果與 analyze_background_pixels 相同
+
+    第一次掃描累計亮度平均與變異數 (逐條合併，避免大數相減的精度損失)，
+    第二次掃描建立地板遮罩、邊界與區塊地板像素數，再交給 floor_candidates_from_block_counts；
+    不會建立整張的灰度或遮罩陣列，img_array 可以是 load_pixels 的 memory-map
+    """
+    if strip_height % block_size:
+        raise ValueError(f"條帶高度 {strip_height} 必須是區塊大小 {block_size} 的倍數")
+    
+    height, width = img_array.shape[:2]
+    print(f"圖片尺寸: {width}x{height} (串流模式，每條 {strip_height} 列)")
+    
+    # 第一次掃描: 以 Chan 的平行演算法合併各條帶的平均與平方差和
+    count, mean_brightness, m2 = 0, 0.0, 0.0
+    for _, gray in _iter_gray_strips(img_array, strip_height):
+        strip_count = gray.size
+        strip_mean = float(np.mean(gray))
+        strip_m2 = float(np.sum(np.square(gray - strip_mean)))
+        
+        delta = strip_mean - mean_brightness
+        total = count + strip_count
+        mean_brightness += delta * strip_count / total
+        m2 += strip_m2 + delta * delta * count * strip_count / total
+        count = total
+    std_brightness = np.sqrt(m2 / count)
+    
+    print(f"平均亮度: {mean_brightness:.1f}")
+    print(f"亮度標準差: {std_brightness:.1f}")
+    
+    # 第二次掃描: 地板遮罩只在條帶內存在
+    floor_threshold = mean_brightness - 0.5 * std_brightness
+    min_x, max_x, min_y, max_y = width, -1, height, -1
+    block_counts = []
+    
+    for top, gray in _iter_gray_strips(img_array, strip_height):
+        floor_mask = gray < floor_threshold
+        
+        floor_rows = np.flatnonzero(floor_mask.any(axis=1))
+        if len(floor_rows):
+            floor_cols = np.flatnonzero(floor_mask.any(axis=0))
+            min_y = min(min_y, top + int(floor_rows[0]))
+            max_y = max(max_y, top + int(floor_rows[-1]))
+            min_x = min(min_x, int(floor_cols[0]))
+            max_x = max(max_x, int(floor_cols[-1]))
+        
+        block_counts.append(block_sums(floor_mask, block_size))
+    
+    if max_y < 0:
+        return None
+    
+    print(f"地板區域邊界:")
+    print(f"  X範圍: {min_x} - {max_x}")
+    print(f"  Y範圍: {min_y} - {max_y}")
+    
+    block_counts = np.concatenate(block_counts)
+    # 與 analyze_floor_regions 相同，不含貼齊右/下邊的網格
+    block_counts = block_counts[:(height - 1) // block_size, :(width - 1) // block_size]
+    candidates = floor_candidates_from_block_counts(block_counts, block_size, (64,), stride=64, top_k=20)
+    floor_regions = candidates_to_regions(candidates)
+    
+    return {
+        'size': [width, height],
+        'floor_bounds': {
+            'x_min': min_x, 'x_max': max_x,
+            'y_min': min_y, 'y_max': max_y
+        },
+        'suitable_positions': floor_regions,
+        'mean_brightness': float(mean_brightness),
+        'floor_threshold': float(floor_threshold)
+    }
+
+def _top_k_descending(values, top_k):
+    """回傳由大到小前 top_k 個值的索引，同值時保留原本順序 (與穩定排序相同)
+
+    只對入選的值排序，不需要排序全部候選
+    """
+    count = len(values)
+    if top_k is None or count <= top_k:
+        selected = np.arange(count)
+    else:
+        kth = np.partition(values, count - top_k)[count - top_k]
+        above = np.flatnonzero(values > kth)
+        ties = np.flatnonzero(values == kth)[:top_k - len(above)]
+        selected = np.concatenate([above, ties])
+    
+    return selected[np.lexsort((selected, -values[selected]))]
+
+def floor_candidates_from_block_counts(block_counts, block_size, window_sizes=(64,), stride=None,
+                                       min_ratio=0.6, top_k=20):
+    """由區塊地板像素數找出地板比例高於 min_ratio 的視窗
+
+    window_sizes 可同時指定多種視窗大小；stride 為 None 時各尺寸以視窗大小為步長 (不重疊)
+    回傳 dict of arrays: x, y (視窗中心)、window、floor_ratio、bounds (N, 4)，
+    依地板比例由高到低排序，只保留前 top_k 個 (None 表示全部)
+    """
+    sat = build_summed_area_table(block_counts)
+    found = {'x': [], 'y': [], 'window': [], 'floor_ratio': []}
+    
+    for window in window_sizes:
+        window_stride = stride or window
+        if window % block_size or window_stride % block_size:
+            raise ValueError(f"視窗 {window} 與步長 {window_stride} 必須是區塊大小 {block_size} 的倍數")
+        
+        sums = window_sums(sat, window // block_size, window_stride // block_size)
+        ratios = sums / (window * window)
+        rows, cols = np.nonzero(ratios > min_ratio)
+        
+        found['x'].append(cols * window_stride)
+        found['y'].append(rows * window_stride)
+        found['window'].append(np.full(len(rows), window))
+        found['floor_ratio'].append(ratios[rows, cols])
+    
+    found = {key: np.concatenate(values) for key, values in found.items()}
+    order = _top_k_descending(found['floor_ratio'], top_k)
+    x, y, window = found['x'][order], found['y'][order], found['window'][order]
+    
+    return {
+        'x': x + window // 2,
+        'y': y + window // 2,
+        'window': window,
+        'floor_ratio': found['floor_ratio'][order],
+        'bounds': np.stack([x, y, x + window, y + window], axis=1),
+    }
+
+def find_floor_candidates(floor_mask, window_sizes=(64,), stride=None, min_ratio=0.6, top_k=20):
+    """向量化的地板視窗搜尋，支援任意步長、重疊視窗與多種視窗大小
+
+    先以所有視窗大小與步長的最大公因數將遮罩縮減成區塊計數，再以積分圖一次算出所有視窗
+    """
+    block_size = math.gcd(*window_sizes, *([stride] if stride else []))
+    block_counts = block_sums(floor_mask, block_size)
+    return floor_candidates_from_block_counts(block_counts, block_size, window_sizes, stride,
+                                              min_ratio, top_k)
+
+def candidates_to_regions(candidates):
+    """將候選陣列轉為 suitable_positions 使用的 dict 列表"""
+    return [
+        {
+            'x': int(x),
+            'y': int(y),
+            'floor_ratio': float(ratio),
+            'grid_bounds': [int(v) for v in bounds]
+        }
+        for x, y, ratio, bounds in zip(candidates['x'], candidates['y'],
+                                       candidates['floor_ratio'], candidates['bounds'])
+    ]
+
 def analyze_floor_regions(floor_mask, width, height):
     """分析地板區域，找出適合放置NPC的位置"""
     
-    # 將圖片分成網格，分析每個區域的地板密度
-    grid_size = 64  # 64x64像素的網格
-    regions = []
-    
-    for y in range(0, height - grid_size, grid_size):
-        for x in range(0, width - grid_size, grid_size):
-            # 提取網格區域
-            region = floor_mask[y:y+grid_size, x:x+grid_size]
-            
-            # 計算地板像素比例
-            floor_ratio = np.sum(region) / (grid_size * grid_size)
-            
-            # 如果地板比例高於某個閾值，認為適合放置NPC
-            if floor_ratio > 0.6:  # 60%以上是地板
-                center_x = x + grid_size // 2
-                center_y = y + grid_size // 2
-                
-                regions.append({
-                    'x': center_x,
-                    'y': center_y,
-                    'floor_ratio': float(floor_ratio),
-                    'grid_bounds': [x, y, x+grid_size, y+grid_size]
-                })
-    
-    # 按地板比例排序，優先選擇地板最多的區域
-    regions.sort(key=lambda r: r['floor_ratio'], reverse=True)
-    
-    return regions[:20]  # 返回前20個最適合的位置
+    # 64x64像素的網格，60%以上是地板才列入，返回前20個最適合的位置
+    # 原本的掃描不含貼齊右/下邊的網格，裁掉最後一列/行以保持相同結果
+    candidates = find_floor_candidates(floor_mask[:height - 1, :width - 1], (64,), stride=64,
+                                       min_ratio=0.6, top_k=20)
+    return candidates_to_regions(candidates)
 
 def suggest_npc_positions(analysis_results):
     """基於分析結果建議NPC位置"""
@@ -156,20 +331,33 @@ def main():
     """主函數"""
     print("🔍 開始分析辦公室底圖布局...")
     
+    # 大型地圖 (8k 以上) 使用 --stream 以條帶方式分析
+    streaming = '--stream' in sys.argv
+    
+    output_file = "../static/assets/data/office_layout_analysis.json"
+    inputs = BG_FILES + [__file__]
+    manifest = load_manifest()
+    if is_up_to_date(manifest, output_file, inputs):
+        print(f"⏭️ 輸入未變更，略過: {output_file}")
+        with open(output_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
     # 分析背景圖像
-    results = analyze_office_background()
+    results = analyze_office_background(streaming=streaming)
     
     # 建議NPC位置
     suggest_npc_positions(results)
     
     # 保存分析結果
-    output_file = "../static/assets/data/office_layout_analysis.json"
-    with open(output_file, 'w', encoding='utf-8') as f:
+    with stage('json_dump'), open(output_file, 'w', encoding='utf-8') as f:
         json.dump(results, f, indent=2, ensure_ascii=False)
+    record_output(manifest, output_file, inputs)
+    save_manifest(manifest)
     
     print(f"\n💾 分析結果已保存到: {output_file}")
     
     return results
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with profiled_run('analyze_office_layout'):
+        main()
\ No newline at end of file
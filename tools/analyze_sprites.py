@@ -7,6 +7,12 @@ from PIL import Image
 import os
 import json
 
+from build_manifest import is_up_to_date, load_manifest, record_output, save_manifest
+from grid_inference import infer_grid
+from pixel_cache import load_pixels
+from stage_timer import profiled_run, stage
+from summed_area import build_alpha_index, rect_sum
+
 def analyze_sprite_sheet(image_path, name):
     """分析單個sprite sheet"""
     try:
@@ -26,6 +32,27 @@ def analyze_sprite_sheet(image_path, name):
         ]
         
         results = []
+        
+        # 有透明度的圖片先由 alpha 投影自動推測網格，放在最前面優先檢查
+        if img.mode == 'RGBA':
+            inferred = infer_grid(load_pixels(image_path))
+            cols, rows = inferred['grid']
+            frame_width, frame_height = inferred['cell_size']
+            results.append({
+                'grid': f'{cols}x{rows}',
+                'frame_size': f'{frame_width}x{frame_height}',
+                'total_frames': cols * rows,
+                'cols': cols,
+                'rows': rows,
+                'frame_width': frame_width,
+                'frame_height': frame_height,
+                'offset': inferred['offset'],
+                'confidence': inferred['confidence'],
+                'inferred': True
+            })
+            print(f"自動推測 {cols}x{rows}: {frame_width}x{frame_height} 像素/框架, "
+                  f"偏移{inferred['offset']}, 信心{inferred['confidence']:.2f}")
+        
         for cols, rows in possible_grids:
             frame_width = width // cols
             frame_height = height // rows
@@ -50,12 +77,18 @@ def analyze_sprite_sheet(image_path, name):
         print(f"分析 {name} 時出錯: {e}")
         return []
 
-def extract_sample_frames(image_path, name, grid_config):
-    """提取樣本框架進行視覺檢查"""
+def extract_sample_frames(image_path, name, grid_config, alpha_index=None):
+    """提取樣本框架進行視覺檢查
+
+    alpha_index 為 alpha > 50 的積分圖，提供時覆蓋率直接以 O(1) 查詢
+    """
     try:
         img = Image.open(image_path)
+        if img.mode == 'RGBA' and alpha_index is None:
+            alpha_index = build_alpha_index(load_pixels(image_path), alpha_threshold=50)
         cols, rows = grid_config['cols'], grid_config['rows']
         frame_width, frame_height = grid_config['frame_width'], grid_config['frame_height']
+        offset_x, offset_y = grid_config.get('offset', (0, 0))
         
         # 提取前幾個框架作為樣本
         sample_frames = []
@@ -63,20 +96,19 @@ def extract_sample_frames(image_path, name, grid_config):
             row = i // cols
             col = i % cols
             
-            left = col * frame_width
-            top = row * frame_height
-            right = left + frame_width
-            bottom = top + frame_height
-            
-            frame = img.crop((left, top, right, bottom))
+            # 推測的網格可能有偏移，超出圖片的部分裁掉
+            left = max(offset_x + col * frame_width, 0)
+            top = max(offset_y + row * frame_height, 0)
+            right = min(offset_x + (col + 1) * frame_width, img.width)
+            bottom = min(offset_y + (row + 1) * frame_height, img.height)
             
             # 檢查框架是否主要是透明/空白
-            if frame.mode == 'RGBA':
+            if img.mode == 'RGBA':
                 # 檢查透明度
-                alpha_channel = frame.split()[-1]
-                non_transparent_pixels = sum(1 for pixel in alpha_channel.getdata() if pixel > 50)
-                coverage = non_transparent_pixels / (frame_width * frame_height)
+                non_transparent_pixels = int(rect_sum(alpha_index, left, top, right, bottom))
+                coverage = non_transparent_pixels / ((right - left) * (bottom - top))
             else:
+                frame = img.crop((left, top, right, bottom))
                 # 對於沒有alpha通道的圖片，檢查顏色變化
                 extrema = frame.getextrema()
                 if len(extrema) == 3:  # RGB
@@ -109,6 +141,14 @@ def main():
     base_path = "../static/assets/tilesets"
     analysis_results = {}
     
+    output_path = "../static/assets/data/sprite_analysis.json"
+    inputs = [os.path.join(base_path, filename) for filename, _ in sprite_files] + [__file__]
+    manifest = load_manifest()
+    if is_up_to_date(manifest, output_path, inputs):
+        print(f"⏭️ 輸入未變更，略過: {output_path}")
+        with open(output_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
     print("🔍 分析所有NPC Sprite Sheets...")
     
     for filename, sheet_name in sprite_files:
@@ -116,10 +156,14 @@ def main():
         if os.path.exists(image_path):
             grid_analyses = analyze_sprite_sheet(image_path, sheet_name)
             
+            # 每張 sheet 只建一次積分圖，所有網格配置共用
+            img = Image.open(image_path)
+            alpha_index = build_alpha_index(load_pixels(image_path), alpha_threshold=50) if img.mode == 'RGBA' else None
+            
             # 對每種網格配置提取樣本
             for grid_config in grid_analyses[:2]:  # 只檢查前2個最可能的配置
                 print(f"\n檢查 {sheet_name} 的 {grid_config['grid']} 網格配置...")
-                samples = extract_sample_frames(image_path, sheet_name, grid_config)
+                samples = extract_sample_frames(image_path, sheet_name, grid_config, alpha_index)
                 
                 # 找出內容最豐富的框架
                 best_frames = sorted(samples, key=lambda x: x['coverage'], reverse=True)[:3]
@@ -158,12 +202,14 @@ def main():
                 print(f"  建議嘗試: frames {recommended_frames} (基於內容覆蓋率)")
     
     # 保存分析結果
-    output_path = "../static/assets/data/sprite_analysis.json"
-    with open(output_path, 'w', encoding='utf-8') as f:
+    with stage('json_dump'), open(output_path, 'w', encoding='utf-8') as f:
         json.dump(analysis_results, f, indent=2, ensure_ascii=False)
+    record_output(manifest, output_path, inputs)
+    save_manifest(manifest)
     print(f"\n💾 分析結果已保存到: {output_path}")
     
     return analysis_results
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with profiled_run('analyze_sprites'):
+        main()
\ No newline at end of file
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+MaxRects 矩形裝箱
+將裁切後的 sprite 幀裝進 2 的冪次大小的貼圖頁，頁面不夠時自動開新頁
+"""
+
+
+def next_power_of_two(value):
+    """大於等於 value 的最小 2 的冪次"""
+    return 1 << max(int(value) - 1, 0).bit_length()
+
+
+class MaxRectsBin:
+    """單一貼圖頁的 MaxRects 裝箱器 (Best Short Side Fit)"""
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.free_rects = [(0, 0, width, height)]
+
+    def insert(self, width, height):
+        """放入一個矩形，回傳左上角座標，放不下時回傳 None"""
+        best = None
+        best_score = None
+
+        for fx, fy, fw, fh in self.free_rects:
+            if width <= fw and height <= fh:
+                short_side = min(fw - width, fh - height)
+                long_side = max(fw - width, fh - height)
+                score = (short_side, long_side)
+                if best_score is None or score < best_score:
+                    best = (fx, fy)
+                    best_score = score
+
+        if best is None:
+            return None
+
+        self._split_free_rects((best[0], best[1], width, height))
+        return best
+
+    def _split_free_rects(self, used):
+        """將與已使用矩形重疊的空閒矩形切成最多四塊，再移除被包含的空閒矩形"""
+        ux, uy, uw, uh = used
+        new_rects = []
+
+        for rect in self.free_rects:
+            fx, fy, fw, fh = rect
+            if ux >= fx + fw or ux + uw <= fx or uy >= fy + fh or uy + uh <= fy:
+                new_rects.append(rect)
+                continue
+
+            if ux > fx:
+                new_rects.append((fx, fy, ux - fx, fh))
+            if ux + uw < fx + fw:
+                new_rects.append((ux + uw, fy, fx + fw - ux - uw, fh))
+            if uy > fy:
+                new_rects.append((fx, fy, fw, uy - fy))
+            if uy + uh < fy + fh:
+                new_rects.append((fx, uy + uh, fw, fy + fh - uy - uh))
+
+        self.free_rects = [
+            rect for i, rect in enumerate(new_rects)
+            if not any(
+                i != j and _contains(other, rect) and (other != rect or j < i)
+                for j, other in enumerate(new_rects)
+            )
+        ]
+
+
+def _contains(outer, inner):
+    ox, oy, ow, oh = outer
+    ix, iy, iw, ih = inner
+    return ix >= ox and iy >= oy and ix + iw <= ox + ow and iy + ih <= oy + oh
+
+
+def _page_sizes(max_size):
+    """由小到大列出所有 2 的冪次頁面尺寸"""
+    sizes = []
+    w = 1
+    while w <= max_size:
+        h = 1
+        while h <= max_size:
+            sizes.append((w, h))
+            h *= 2
+        w *= 2
+    return sorted(sizes, key=lambda s: (s[0] * s[1], max(s)))
+
+
+def _try_pack(page_width, page_height, items, padding):
+    """嘗試將 items [(key, w, h)] 依序放入一頁，回傳 {key: (x, y)} (可能只放入部分)"""
+    packer = MaxRectsBin(page_width, page_height)
+    placements = {}
+    for key, w, h in items:
+        position = packer.insert(w + padding, h + padding)
+        if position is not None:
+            placements[key] = position
+    return placements
+
+
+def pack_rects(sizes, max_size=2048, padding=2):
+    """將多個矩形裝進 2 的冪次頁面
+
+    sizes 為 {key: (w, h)}，回傳 (pages, placements)
+    pages 為 [(page_w, page_h)]，placements 為 {key: (page_index, x, y)}
+    """
+    for key, (w, h) in sizes.items():
+        if w + padding > max_size or h + padding > max_size:
+            raise ValueError(f"矩形 {key} ({w}x{h}) 超過頁面上限 {max_size}")
+
+    # 由大到小放入，裝箱率較高
+    remaining = sorted(
+        ((key, w, h) for key, (w, h) in sizes.items()),
+        key=lambda item: (item[2], item[1]),
+        reverse=True,
+    )
+    total_area = sum((w + padding) * (h + padding) for _, w, h in remaining)
+
+    pages = []
+    placements = {}
+
+    while remaining:
+        page_placements = None
+        for page_width, page_height in _page_sizes(max_size):
+            if page_width * page_height < total_area and (page_width, page_height) != (max_size, max_size):
+                continue
+            trial = _try_pack(page_width, page_height, remaining, padding)
+            if len(trial) == len(remaining):
+                page_placements = trial
+                break
+
+        if page_placements is None:
+            # 一頁放不下全部，先填滿最大頁面再開新頁
+            page_width = page_height = max_size
+            page_placements = _try_pack(page_width, page_height, remaining, padding)
+
+        page_index = len(pages)
+        pages.append((page_width, page_height))
+        for key, (x, y) in page_placements.items():
+            placements[key] = (page_index, x, y)
+
+        remaining = [item for item in remaining if item[0] not in page_placements]
+        total_area = sum((w + padding) * (h + padding) for _, w, h in remaining)
+
+    return pages, placements
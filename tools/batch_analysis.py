@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+多張 sheet 的批次分析
+掃描目錄下的 tileset / 背景圖，以行程池平行執行分析 pass (每張圖一個工作，各行程自行載入像素)，
+結果依檔案路徑排序後合併成單一報告，與工作完成的先後無關
+"""
+
+import concurrent.futures
+import contextlib
+import fnmatch
+import multiprocessing
+import os
+import time
+
+from analysis_passes import create_sheet_context, run_passes, sheet_frame_records
+from frame_records import save_frame_records
+from row_shards import default_threads
+
+DEFAULT_PATTERNS = ('*.png',)
+
+
+def find_images(directory, patterns=DEFAULT_PATTERNS, recursive=False):
+    """回傳目錄下符合檔名樣式的圖片路徑，依相對路徑排序 (批次結果的順序由此決定)"""
+    if not os.path.isdir(directory):
+        raise FileNotFoundError(f"找不到目錄: {directory}")
+
+    found = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        found.extend(
+            os.path.join(root, name) for name in files
+            if any(fnmatch.fnmatch(name, pattern) for pattern in patterns)
+        )
+        if not recursive:
+            break
+    return sorted(found, key=lambda path: os.path.relpath(path, directory))
+
+
+def default_workers(job_count):
+    """可用的 CPU 數 (遵守 CPU affinity)，不超過工作數"""
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    return max(1, min(cpus, job_count))
+
+
+def worker_threads(workers):
+    """每個子行程的列帶執行緒數: 執行緒總數 (DTA_THREADS 或 CPU 數) 平均分給各行程，至少 1"""
+    return max(1, default_threads() // workers)
+
+
+def _init_worker(threads):
+    """子行程初始化: 限制列帶執行緒數，避免 N 個行程各開 N 個執行緒"""
+    os.environ['DTA_THREADS'] = str(threads)
+
+
+def records_path_for(records_dir, directory, image_path):
+    """逐幀記錄的 .npz 路徑: 子目錄以 __ 連接，避免不同目錄的同名圖片互相覆蓋"""
+    stem = os.path.splitext(os.path.relpath(image_path, directory))[0].replace(os.sep, '__')
+    return os.path.join(records_dir, f"{stem}_frames.npz")
+
+
+def analyze_image(image_path, pass_names, grid=(13, 11), npz_path=None):
+    """單張圖的分析工作 (在子行程中執行)
+
+    過程輸出全部丟棄；失敗時回傳帶 error 的報告而不是拋出例外，讓其他圖片的結果不受影響
+    """
+    started = time.perf_counter()
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            sheet = create_sheet_context(image_path, grid=grid)
+            report = run_passes(sheet, pass_names)
+
+            if npz_path:
+                save_frame_records(npz_path, sheet_frame_records(sheet, report), grid=list(sheet['grid']))
+                report['records'] = npz_path
+    except Exception as e:
+        report = {'file': os.path.basename(image_path), 'error': f"{type(e).__name__}: {e}"}
+
+    report['elapsed_s'] = round(time.perf_counter() - started, 3)
+    return report
+
+
+def _failed_report(image_path, error, elapsed_s=0.0):
+    """無法取得分析結果時 (子行程崩潰等) 代替的報告，格式與 analyze_image 的失敗報告相同"""
+    return {'file': os.path.basename(image_path), 'error': error, 'elapsed_s': elapsed_s}
+
+
+def _run_pool(jobs, pass_names, grid, workers, on_result):
+    """以一個行程池執行 [(index, image_path, npz_path)]，每完成一張就呼叫 on_result(index, 報告)
+
+    子行程被強制結束 (記憶體不足、原生解碼器 segfault…) 時行程池會整個損壞，
+    所有尚未取得結果的工作都會拋出 BrokenProcessPool；回傳這些工作，由呼叫端決定如何重試
+    """
+    # spawn: 子行程不繼承父行程的執行緒與已載入的大陣列 (與 benchmarks 相同)
+    context = multiprocessing.get_context('spawn')
+    broken = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                                initializer=_init_worker,
+                                                initargs=(worker_threads(workers),)) as executor:
+        futures = {
+            executor.submit(analyze_image, path, pass_names, grid, npz_path): (index, path, npz_path)
+            for index, path, npz_path in jobs
+        }
+        for future in concurrent.futures.as_completed(futures):
+            index, path, npz_path = futures[future]
+            try:
+                report = future.result()
+            except concurrent.futures.process.BrokenProcessPool:
+                broken.append(futures[future])
+                continue
+            except Exception as e:
+                report = _failed_report(path, f"{type(e).__name__}: {e}")
+            on_result(index, report)
+    return sorted(broken)
+
+
+def run_batch(image_paths, pass_names, grid=(13, 11), workers=None, npz_paths=None, on_done=None):
+    """平行分析多張圖片，回傳與 image_paths 順序相同的報告列表
+
+    npz_paths 與 image_paths 一一對應 (見 records_path_for)，為 None 時不輸出逐幀記錄；
+    workers=1 時直接在目前行程依序執行；on_done(報告) 會在每張圖完成時呼叫 (依完成順序)
+    多行程時各子行程的列帶執行緒數以 worker_threads 限制
+
+    子行程崩潰時，受影響的圖片各自在獨立的行程中重試一次，仍然崩潰的才記錄為失敗，
+    其他圖片的結果不受影響
+    """
+    workers = workers or default_workers(len(image_paths))
+    npz_paths = npz_paths or [None] * len(image_paths)
+
+    if workers == 1 or len(image_paths) <= 1:
+        reports = []
+        for path, npz_path in zip(image_paths, npz_paths):
+            reports.append(analyze_image(path, pass_names, grid, npz_path))
+            if on_done:
+                on_done(reports[-1])
+        return reports
+
+    reports = [None] * len(image_paths)
+
+    def on_result(index, report):
+        reports[index] = report
+        if on_done:
+            on_done(report)
+
+    jobs = [(index, path, npz_path) for index, (path, npz_path) in enumerate(zip(image_paths, npz_paths))]
+    broken = _run_pool(jobs, pass_names, grid, workers, on_result)
+
+    # 無法得知是哪張圖讓行程池損壞，逐張隔離重試，只有真正崩潰的圖片會失敗
+    for job in broken:
+        index, path, _ = job
+        started = time.perf_counter()
+        if _run_pool([job], pass_names, grid, 1, on_result):
+            on_result(index, _failed_report(
+                path, "BrokenProcessPool: 分析子行程異常結束 (可能是記憶體不足或原生程式庫崩潰)",
+                round(time.perf_counter() - started, 3)
+            ))
+    return reports
+
+
+def merge_reports(directory, image_paths, reports, pass_names, grid):
+    """合併成單一報告: 各圖片報告以相對路徑為鍵，另附成功/失敗的統計"""
+    files = {}
+    for path, report in zip(image_paths, reports):
+        report = dict(report)
+        # 耗時每次執行都不同，不放進報告內容，讓相同輸入得到相同報告
+        report.pop('elapsed_s', None)
+        files[os.path.relpath(path, directory).replace(os.sep, '/')] = report
+
+    errors = sorted(name for name, report in files.items() if 'error' in report)
+    return {
+        'directory': os.path.abspath(directory),
+        'passes': list(pass_names),
+        'grid': list(grid),
+        'summary': {
+            'total': len(files),
+            'analyzed': len(files) - len(errors),
+            'failed': errors,
+        },
+        'files': files,
+    }
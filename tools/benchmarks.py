@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+"""
+素材工具效能基準測試
+以可重現的合成 sprite sheet 與辦公室背景，量測各階段的執行時間、峰值記憶體與吞吐量，
+並可與 JSON 基準檔比較找出效能退化
+
+用法:
+    python benchmarks.py                      # 快速組合 (1k²/2k², 143/1000 幀)
+    python benchmarks.py --full               # 1k² ~ 8k², 143 ~ 10k 幀
+    python benchmarks.py --save-baseline      # 將結果存為基準
+    python benchmarks.py --baseline benchmarks_baseline.json --fail-on-regression
+
+基準檔記錄機器資訊 (CPU 型號、核心數…)，與目前機器不同時只顯示比較結果，不判定退化
+"""
+
+import argparse
+import contextlib
+import json
+import math
+import multiprocessing
+import os
+import platform
+import queue as queue_module
+import sys
+import tempfile
+import time
+
+from PIL import Image
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows 沒有 resource 模組
+    resource = None
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE_PATH = os.path.join(TOOLS_DIR, 'benchmarks_baseline.json')
+
+QUICK_SIZES = [1024, 2048]
+QUICK_FRAMES = [143, 1000]
+FULL_SIZES = [1024, 2048, 4096, 8192]
+FULL_FRAMES = [143, 1000, 10000]
+
+STAGES = [
+    'sprite_processor.analyze_sprite_sheet',
+    'analyze_sprites.analyze_sprite_sheet',
+    'extract_sprite_frames',
+    'create_sprite_atlas_config',
+    'analyze_floor_regions',
+    'verify_desk_in_all_frames',
+]
+
+# 等待子行程結果時檢查其是否還活著的間隔 (秒)
+POLL_INTERVAL = 1.0
+
+# 比較基準時必須相同的機器資訊 (Python / NumPy 版本不同仍可比較，正是要抓的退化來源之一)
+MACHINE_FIELDS = ('system', 'machine', 'cpu_model', 'cpu_count')
+
+
+def grid_for_frames(frames):
+    """幀數對應的網格，143 幀沿用 npc.png 的 13x11"""
+    if frames == 143:
+        return 13, 11
+    cols = math.ceil(math.sqrt(frames))
+    return cols, math.ceil(frames / cols)
+
+
+def generate_sprite_sheet(size, frames, seed=0):
+    """產生合成 RGBA sprite sheet: 每格一個帶膚色頭部、衣服與辦公桌的角色"""
+    rng = np.random.default_rng(seed)
+    cols, rows = grid_for_frames(frames)
+    cell_width, cell_height = size // cols, size // rows
+    sheet = np.zeros((size, size, 4), dtype=np.uint8)
+
+    yy, xx = np.mgrid[0:cell_height, 0:cell_width]
+    head = ((xx - cell_width / 2) / (cell_width * 0.15)) ** 2 + \
+           ((yy - cell_height * 0.25) / (cell_height * 0.12)) ** 2 <= 1
+    body = (np.abs(xx - cell_width / 2) < cell_width * 0.2) & \
+           (yy > cell_height * 0.37) & (yy < cell_height * 0.75)
+    desk = (yy > cell_height * 0.7) & (yy < cell_height * 0.9) & \
+           (xx > cell_width * 0.1) & (xx < cell_width * 0.9)
+
+    for index in range(frames):
+        row, col = divmod(index, cols)
+        cell = sheet[row * cell_height:(row + 1) * cell_height, col * cell_width:(col + 1) * cell_width]
+        if rng.random() < 0.25:
+            continue  # 保留部分空白格，與真實 sheet 相同
+
+        cell[body] = (*rng.integers(0, 120, 2), rng.integers(120, 255), 255)
+        cell[head] = (rng.integers(190, 240), rng.integers(140, 180), rng.integers(100, 140), 255)
+        if rng.random() < 0.5:
+            cell[desk] = (rng.integers(120, 170), rng.integers(70, 100), rng.integers(20, 60), 255)
+
+    return Image.fromarray(sheet)
+
+
+def generate_office_background(size, seed=0):
+    """產生合成辦公室背景: 深色地板上隨機分佈的亮色家具"""
+    rng = np.random.default_rng(seed)
+    background = np.empty((size, size, 3), dtype=np.uint8)
+    background[:] = (40, 45, 55)
+    background += rng.integers(0, 12, (size, size, 1), dtype=np.uint8)
+
+    furniture_count = max(8, (size // 128) ** 2)
+    for _ in range(furniture_count):
+        w, h = rng.integers(size // 32, size // 8, 2)
+        x, y = rng.integers(0, size - w), rng.integers(0, size - h)
+        background[y:y + h, x:x + w] = rng.integers(150, 230, 3)
+
+    return Image.fromarray(background)
+
+
+def _peak_rss_mb():
+    """目前行程的峰值常駐記憶體 (MB)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 單位為 KB，macOS 為 bytes
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def _run_stage(stage, sheet_path, background_path, frames, work_dir):
+    """在子行程內執行單一階段，回傳 (wall, cpu, peak_rss_mb, stage_rss_mb)
+
+    階段的輸入 (分析結果、地板遮罩…) 都在量測區段之前準備好；
+    stage_rss_mb 是階段本身讓峰值常駐記憶體增加的量，不含準備輸入的部分
+    """
+    import pixel_cache
+    pixel_cache.DEFAULT_CACHE_DIR = os.path.join(work_dir, 'pixel_cache')
+
+    import analyze_office_layout
+    import analyze_sprites
+    import sprite_processor
+    import verify_desk_content
+
+    cols, rows = grid_for_frames(frames)
+    analysis = sprite_processor.analyze_sprite_sheet(sheet_path, cols, rows)
+    atlas_frames = [
+        {
+            'frame_id': i,
+            'grid_pos': [i % cols, i // cols],
+            'crop_box': [(i % cols) * analysis['cell_size'][0], (i // cols) * analysis['cell_size'][1],
+                         (i % cols + 1) * analysis['cell_size'][0], (i // cols + 1) * analysis['cell_size'][1]]
+        }
+        for i in range(analysis['total_frames'])
+    ]
+    if stage == 'analyze_floor_regions':
+        gray = np.asarray(Image.open(background_path), dtype=np.float64).mean(axis=2)
+        floor_mask = gray < gray.mean() - 0.5 * gray.std()
+        del gray
+
+    stages = {
+        'sprite_processor.analyze_sprite_sheet':
+            lambda: sprite_processor.analyze_sprite_sheet(sheet_path, cols, rows),
+        'analyze_sprites.analyze_sprite_sheet':
+            lambda: analyze_sprites.analyze_sprite_sheet(sheet_path, 'bench'),
+        'extract_sprite_frames':
+            lambda: sprite_processor.extract_sprite_frames(sheet_path, os.path.join(work_dir, 'frames'), analysis),
+        'create_sprite_atlas_config':
+            lambda: sprite_processor.create_sprite_atlas_config(atlas_frames, analysis),
+        'analyze_floor_regions':
+            lambda: analyze_office_layout.analyze_floor_regions(floor_mask, *floor_mask.shape[::-1]),
+        'verify_desk_in_all_frames':
+            lambda: verify_desk_content.verify_desk_in_all_frames(sheet_path, (cols, rows)),
+    }
+
+    rss_before = _peak_rss_mb()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    stages[stage]()
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    rss_after = _peak_rss_mb()
+
+    stage_rss = rss_after - rss_before if rss_after is not None else None
+    return wall, cpu, rss_after, stage_rss
+
+
+def _stage_worker(queue, *args):
+    sys.path.insert(0, TOOLS_DIR)
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            queue.put(('ok', _run_stage(*args)))
+    except Exception as e:
+        queue.put(('error', repr(e)))
+
+
+def _wait_for_result(queue, process, stage, timeout=None):
+    """等待子行程的結果；子行程沒有回報就結束 (OOM、segfault…) 或超時時拋出 RuntimeError"""
+    deadline = time.monotonic() + timeout if timeout else None
+    while True:
+        try:
+            return queue.get(timeout=POLL_INTERVAL)
+        except queue_module.Empty:
+            pass
+
+        if not process.is_alive():
+            # 子行程可能在最後一次輪詢後才放入結果
+            try:
+                return queue.get(timeout=POLL_INTERVAL)
+            except queue_module.Empty:
+                raise RuntimeError(f"{stage} 的子行程異常結束 (exit code {process.exitcode})，"
+                                   f"可能是記憶體不足或原生程式庫崩潰") from None
+
+        if deadline is not None and time.monotonic() > deadline:
+            process.kill()
+            process.join()
+            raise RuntimeError(f"{stage} 超過 {timeout:g} 秒仍未完成")
+
+
+def measure_stage(stage, sheet_path, background_path, frames, repeat=3, timeout=None):
+    """每次在全新的子行程執行階段 (冷快取、獨立的峰值記憶體)，取最快的一次
+
+    timeout 為單次執行的秒數上限 (None 表示不限)
+    """
+    context = multiprocessing.get_context('spawn')
+    runs = []
+
+    for i in range(repeat):
+        with tempfile.TemporaryDirectory() as work_dir:
+            queue = context.Queue()
+            process = context.Process(
+                target=_stage_worker,
+                args=(queue, stage, sheet_path, background_path, frames, work_dir)
+            )
+            process.start()
+            try:
+                status, result = _wait_for_result(queue, process, stage, timeout)
+            finally:
+                process.join()
+
+        if status != 'ok':
+            raise RuntimeError(f"{stage} 執行失敗: {result}")
+        runs.append(result)
+
+    wall, cpu, _, _ = min(runs, key=lambda r: r[0])
+    peaks = [r[2] for r in runs if r[2] is not None]
+    stage_peaks = [r[3] for r in runs if r[3] is not None]
+    return {
+        'wall_s': wall,
+        'cpu_s': cpu,
+        'peak_rss_mb': max(peaks) if peaks else None,
+        'stage_rss_mb': max(stage_peaks) if stage_peaks else None,
+    }
+
+
+def run_benchmarks(sizes, frame_counts, stages=STAGES, repeat=3, seed=0, timeout=None):
+    """執行所有 (尺寸, 幀數, 階段) 組合，回傳 {case_key: 結果}"""
+    results = {}
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        for size in sizes:
+            background_path = os.path.join(data_dir, f'office_{size}.png')
+            generate_office_background(size, seed).save(background_path)
+
+            for frames in frame_counts:
+                cols, rows = grid_for_frames(frames)
+                if size // cols < 8 or size // rows < 8:
+                    print(f"⏭️ {size}² 放不下 {frames} 幀，略過")
+                    continue
+
+                sheet_path = os.path.join(data_dir, f'sheet_{size}_{frames}.png')
+                generate_sprite_sheet(size, frames, seed).save(sheet_path)
+
+                for stage in stages:
+                    if stage == 'analyze_floor_regions' and frames != frame_counts[0]:
+                        continue  # 背景分析與幀數無關，每個尺寸只量一次
+
+                    key = f"{stage}@{size}x{size}" + ('' if stage == 'analyze_floor_regions' else f"/{frames}f")
+                    result = measure_stage(stage, sheet_path, background_path, frames, repeat, timeout)
+                    result['megapixels_per_s'] = size * size / 1e6 / result['wall_s'] if result['wall_s'] else None
+                    if stage != 'analyze_floor_regions':
+                        result['frames_per_s'] = frames / result['wall_s'] if result['wall_s'] else None
+
+                    results[key] = result
+                    print_result(key, result)
+
+    return results
+
+
+def print_result(key, result):
+    """一行結果: 時間、階段本身增加的峰值記憶體、吞吐量"""
+    rss = f"{result['stage_rss_mb']:8.1f} MB" if result.get('stage_rss_mb') is not None else '     n/a'
+    fps = f"{result['frames_per_s']:10.0f} f/s" if result.get('frames_per_s') else ' ' * 14
+    print(f"  {key:<58} {result['wall_s'] * 1000:9.1f} ms {rss} {fps} "
+          f"{result['megapixels_per_s']:8.1f} MP/s")
+
+
+def _cpu_model():
+    """CPU 型號 (Linux 讀 /proc/cpuinfo，其他平台用 platform.processor())"""
+    with contextlib.suppress(OSError):
+        with open('/proc/cpuinfo', 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    return platform.processor() or None
+
+
+def machine_environment():
+    """記錄在結果與基準中的執行環境"""
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'system': platform.system(),
+        'machine': platform.machine(),
+        'cpu_model': _cpu_model(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def environment_mismatches(environment, baseline):
+    """回傳與基準不同的機器欄位 [(欄位, 基準值, 目前值)]，基準缺少的欄位也算不同"""
+    recorded = baseline.get('environment', {})
+    return [
+        (field, recorded.get(field), environment.get(field))
+        for field in MACHINE_FIELDS
+        if recorded.get(field) != environment.get(field)
+    ]
+
+
+def compare_with_baseline(results, baseline, threshold=0.10):
+    """與基準比較，回傳變慢超過門檻的案例 [(key, 基準秒數, 目前秒數)]"""
+    regressions = []
+    print("\n📊 與基準比較:")
+    for key, result in results.items():
+        reference = baseline.get('results', {}).get(key)
+        if reference is None:
+            print(f"  {key:<58} (基準中沒有此案例)")
+            continue
+
+        ratio = result['wall_s'] / reference['wall_s'] if reference['wall_s'] else float('inf')
+        marker = '🔴' if ratio > 1 + threshold else '🟢' if ratio < 1 - threshold else '⚪'
+        print(f"  {marker} {key:<56} {ratio:6.2f}x")
+        if ratio > 1 + threshold:
+            regressions.append((key, reference['wall_s'], result['wall_s']))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='素材工具效能基準測試')
+    parser.add_argument('--full', action='store_true', help='執行完整組合 (1k² ~ 8k², 143 ~ 10k 幀)')
+    parser.add_argument('--sizes', help='以逗號分隔的 sheet 邊長，例如 1024,4096')
+    parser.add_argument('--frames', help='以逗號分隔的幀數，例如 143,10000')
+    parser.add_argument('--stages', help=f"以逗號分隔的階段 (預設全部: {', '.join(STAGES)})")
+    parser.add_argument('--repeat', type=int, default=3, help='每個案例重複次數，取最快一次 (預設 3)')
+    parser.add_argument('--seed', type=int, default=0, help='合成資料的亂數種子')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_PATH, help='基準檔路徑')
+    parser.add_argument('--save-baseline', action='store_true', help='將本次結果存為基準')
+    parser.add_argument('--threshold', type=float, default=0.10, help='視為退化的變慢比例 (預設 0.10)')
+    parser.add_argument('--fail-on-regression', action='store_true',
+                        help='有退化時以非零狀態結束 (基準來自不同機器時不會失敗)')
+    parser.add_argument('--timeout', type=float, help='單次執行的秒數上限 (預設不限)')
+    parser.add_argument('-o', '--output', help='本次結果輸出路徑')
+    args = parser.parse_args(argv)
+
+    sizes = [int(v) for v in args.sizes.split(',')] if args.sizes else (FULL_SIZES if args.full else QUICK_SIZES)
+    frame_counts = [int(v) for v in args.frames.split(',')] if args.frames else \
+        (FULL_FRAMES if args.full else QUICK_FRAMES)
+    stages = args.stages.split(',') if args.stages else STAGES
+
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        parser.error(f"未知的階段: {', '.join(unknown)}")
+
+    print(f"⏱️ 素材工具基準測試: 尺寸 {sizes}, 幀數 {frame_counts}, 重複 {args.repeat} 次")
+    results = run_benchmarks(sizes, frame_counts, stages, args.repeat, args.seed, args.timeout)
+
+    report = {
+        'environment': machine_environment(),
+        'seed': args.seed,
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 結果已保存到: {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 基準已保存到: {args.baseline}")
+        return 0
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n🔴 {len(regressions)} 個案例變慢超過 {args.threshold:.0%}")
+
+        # 不同機器的時間不能直接比較，只列出結果而不判定退化
+        mismatches = environment_mismatches(report['environment'], baseline)
+        if mismatches:
+            print(f"\n⚠️ 基準 {args.baseline} 來自不同的機器，比較結果僅供參考:")
+            for field, recorded, current in mismatches:
+                print(f"  {field}: 基準 {recorded!r}，目前 {current!r}")
+            print("  請在這台機器上以 --save-baseline 重新建立基準")
+        elif regressions and args.fail_on_regression:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
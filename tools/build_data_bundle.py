@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+遊戲啟動資料包
+將 npcs.json、characters.json (兩者都只保留允許清單中的欄位) 與圖集的 frame 表合併成單一 JSON，
+檔名帶內容雜湊 (可長期快取)，並預先壓縮成 gzip / brotli；
+另輸出一份很小的 bundle manifest，讓遊戲端只需一次請求就能取得所有啟動資料
+"""
+
+import contextlib
+import gzip
+import hashlib
+import json
+import os
+import sys
+
+from PIL import Image
+
+from build_manifest import is_up_to_date, load_manifest, record_output, save_manifest
+from npc_placement import CHARACTERS_FILE, GAME_CONFIG_FILE, NPCS_FILE
+from remove_sensitive_fields import ALLOWED_FIELDS, project_fields
+from stage_timer import profiled_run
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ASSETS_DIR = "../static/assets"
+ATLAS_FILES = [
+    "../static/assets/data/npc_atlas_packed.json",
+    "../static/assets/data/npc_atlas.json",
+]
+OUTPUT_DIR = "../static/assets/data/bundle"
+MANIFEST_FILE = os.path.join(OUTPUT_DIR, "manifest.json")
+BUNDLE_NAME = "startup"
+
+BUNDLE_VERSION = 2
+# 檔名中的內容雜湊長度 (sha256 的前幾個十六進位字元)
+HASH_LENGTH = 12
+# npcs.json 中前端需要的欄位，其餘欄位 (personality、introduction…) 一律移除，
+# 新增的私有欄位預設不會進入公開的資料包 (characters.json 以 ALLOWED_FIELDS 處理)
+NPC_ALLOWED_FIELDS = ('id', 'name', 'position', 'x', 'y', 'styleId', 'action', 'dialogue', 'npcType')
+# frame 名稱，與 sprite_processor 的圖集及 hit_masks 相同
+FRAME_NAME_FORMAT = "npc_{:03d}"
+
+
+def load_characters(characters_file=CHARACTERS_FILE, fields=ALLOWED_FIELDS):
+    """讀取 characters.json，角色記錄只保留允許的欄位，站立/熱點 NPC 設定原樣保留"""
+    with open(characters_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    data['characters'] = [project_fields(character, fields)[0] for character in data.get('characters', [])]
+    return data
+
+
+def load_npcs(npcs_file=NPCS_FILE, fields=NPC_ALLOWED_FIELDS):
+    """讀取 npcs.json，NPC 記錄只保留允許的欄位"""
+    with open(npcs_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    data['npcs'] = [project_fields(npc, fields)[0] for npc in data.get('npcs', [])]
+    return data
+
+
+def _compact_frame(frame):
+    """[x, y, w, h]；裁切過的 frame 另附 [offset_x, offset_y, source_w, source_h]"""
+    rect = frame['frame']
+    compact = [rect['x'], rect['y'], rect['w'], rect['h']]
+    if frame.get('trimmed'):
+        source = frame['spriteSourceSize']
+        compact += [source['x'], source['y'], frame['sourceSize']['w'], frame['sourceSize']['h']]
+    return compact
+
+
+def atlas_frame_table(atlas_config):
+    """將 Phaser 圖集設定縮減成 frame 表: 每張貼圖的圖片、尺寸與 {frame 名稱: 矩形}
+
+    frame 帶有 sprite_processor 算好的錨點時，另附 {frame 名稱: {pivot, bbox, feet, head}}
+    """
+    table = []
+    for texture in atlas_config['textures']:
+        entry = {
+            'image': texture['image'],
+            'size': [texture['size']['w'], texture['size']['h']],
+            'frames': {name: _compact_frame(frame) for name, frame in texture['frames'].items()},
+        }
+        anchors = {
+            name: {'pivot': [frame['pivot']['x'], frame['pivot']['y']], **frame['anchors']}
+            for name, frame in texture['frames'].items() if 'anchors' in frame
+        }
+        if anchors:
+            entry['anchors'] = anchors
+        table.append(entry)
+    return table
+
+
+def spritesheet_frame_table(game_config, assets_dir=ASSETS_DIR):
+    """沒有圖集設定時，依 gameConfig 的 spritesheet 格子大小產生 frame 表
+
+    frame 順序與 Phaser spritesheet 的索引相同，名稱與圖集一致 (npc_000…)，
+    不論有沒有圖集設定，前端看到的都是同一種命名
+    """
+    sheet = game_config['assets']['npcSpriteSheet']
+    with Image.open(os.path.join(assets_dir, sheet['file'])) as img:
+        width, height = img.size
+
+    frame_width, frame_height = sheet['frameWidth'], sheet['frameHeight']
+    cols, rows = width // frame_width, height // frame_height
+    frames = {
+        FRAME_NAME_FORMAT.format(row * cols + col): [col * frame_width, row * frame_height, frame_width, frame_height]
+        for row in range(rows)
+        for col in range(cols)
+    }
+    return [{'image': os.path.basename(sheet['file']), 'size': [width, height], 'frames': frames}]
+
+
+def find_atlas_file(atlas_files=ATLAS_FILES):
+    """第一個存在的圖集設定 (打包後的優先)，都不存在時回傳 None"""
+    return next((path for path in atlas_files if os.path.exists(path)), None)
+
+
+def build_bundle(game_config, atlas_file=None):
+    """組合啟動資料包的內容"""
+    if atlas_file:
+        with open(atlas_file, 'r', encoding='utf-8') as f:
+            atlas = {'source': os.path.basename(atlas_file), 'textures': atlas_frame_table(json.load(f))}
+    else:
+        atlas = {'source': 'spritesheet', 'textures': spritesheet_frame_table(game_config)}
+
+    return {
+        'version': BUNDLE_VERSION,
+        'npcs': load_npcs()['npcs'],
+        'characters': load_characters(),
+        'atlas': atlas,
+    }
+
+
+def encode_bundle(bundle):
+    """以固定的緊湊格式序列化，相同內容一定得到相同位元組 (雜湊才會穩定)"""
+    return json.dumps(bundle, ensure_ascii=False, separators=(',', ':'), sort_keys=True).encode('utf-8')
+
+
+def content_hash(data, length=HASH_LENGTH):
+    return hashlib.sha256(data).hexdigest()[:length]
+
+
+def compress_variants(data):
+    """回傳 {編碼名稱: (副檔名, 壓縮後位元組)}，brotli 模組不存在時只輸出 gzip"""
+    variants = {
+        # mtime=0 讓壓縮結果可重現
+        'gzip': ('.gz', gzip.compress(data, compresslevel=9, mtime=0)),
+    }
+    if brotli is not None:
+        variants['br'] = ('.br', brotli.compress(data, quality=11))
+    else:
+        print("  ⚠️ 未安裝 brotli 模組，略過 .br 預先壓縮 (pip install brotli)")
+    return variants
+
+
+def _write_atomic(path, content):
+    """以同目錄的暫存檔寫入後改名，中斷時不會在正式檔名下留下不完整的檔案
+
+    暫存檔以 . 開頭，不會被 _prune_stale_bundles 當成舊資料包刪除
+    """
+    directory, name = os.path.split(path)
+    tmp_path = os.path.join(directory, f".{name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
+
+
+def _has_content(path, content):
+    """檔案存在且內容與 content 完全相同"""
+    if not os.path.exists(path) or os.path.getsize(path) != len(content):
+        return False
+    with open(path, 'rb') as f:
+        return f.read() == content
+
+
+def _prune_stale_bundles(output_dir, keep):
+    """刪除舊雜湊的資料包，只保留這次輸出的檔案"""
+    removed = []
+    for name in os.listdir(output_dir):
+        if name.startswith(f"{BUNDLE_NAME}.") and name not in keep:
+            # 同時執行的另一個行程可能已經刪掉
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(output_dir, name))
+            removed.append(name)
+    return removed
+
+
+def write_bundle(bundle, output_dir=OUTPUT_DIR, manifest_file=MANIFEST_FILE):
+    """寫出帶雜湊檔名的資料包、預先壓縮的副本與 bundle manifest，回傳 manifest 內容"""
+    os.makedirs(output_dir, exist_ok=True)
+    data = encode_bundle(bundle)
+    digest = content_hash(data)
+    file_name = f"{BUNDLE_NAME}.{digest}.json"
+
+    files = {file_name: data}
+    encodings = {}
+    for encoding, (suffix, compressed) in compress_variants(data).items():
+        files[file_name + suffix] = compressed
+        encodings[encoding] = {'file': file_name + suffix, 'bytes': len(compressed)}
+
+    # 雜湊檔名的內容不會改變，已存在且內容相同就不必重寫 (先前中斷留下的殘缺檔會被覆寫)
+    for name, content in files.items():
+        path = os.path.join(output_dir, name)
+        if not _has_content(path, content):
+            _write_atomic(path, content)
+    _prune_stale_bundles(output_dir, set(files))
+
+    bundle_manifest = {
+        'version': BUNDLE_VERSION,
+        'file': file_name,
+        'hash': digest,
+        'bytes': len(data),
+        'encodings': encodings,
+    }
+    # manifest 本身不帶雜湊，需以 no-cache 提供
+    _write_atomic(manifest_file, json.dumps(bundle_manifest, indent=2, ensure_ascii=False).encode('utf-8'))
+
+    return bundle_manifest
+
+
+def main():
+    """主函數"""
+    print("📦 建立啟動資料包...")
+
+    with open(GAME_CONFIG_FILE, 'r', encoding='utf-8') as f:
+        game_config = json.load(f)
+
+    atlas_file = find_atlas_file()
+    inputs = [GAME_CONFIG_FILE, NPCS_FILE, CHARACTERS_FILE, __file__] + ([atlas_file] if atlas_file else [])
+    params = {'version': BUNDLE_VERSION, 'brotli': brotli is not None}
+    manifest = load_manifest()
+    if is_up_to_date(manifest, MANIFEST_FILE, inputs, params):
+        print(f"⏭️ 輸入未變更，略過: {MANIFEST_FILE}")
+        return 0
+
+    if not atlas_file:
+        print("  ⚠️ 找不到圖集設定，改用 gameConfig 的 spritesheet 格子產生 frame 表")
+
+    bundle = build_bundle(game_config, atlas_file)
+    result = write_bundle(bundle)
+    record_output(manifest, MANIFEST_FILE, inputs, params)
+    save_manifest(manifest)
+
+    print(f"  NPC {len(bundle['npcs'])} 個、角色 {len(bundle['characters']['characters'])} 個、"
+          f"frame {sum(len(t['frames']) for t in bundle['atlas']['textures'])} 個")
+    print(f"  {result['file']}: {result['bytes'] / 1024:.1f} KB")
+    for encoding, info in result['encodings'].items():
+        print(f"  {info['file']}: {info['bytes'] / 1024:.1f} KB ({encoding})")
+    print(f"💾 bundle manifest 已保存到: {MANIFEST_FILE}")
+    return 0
+
+
+if __name__ == "__main__":
+    with profiled_run('build_data_bundle'):
+        status = main()
+    sys.exit(status)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+素材建置清單 (build manifest)
+記錄每個輸出檔的輸入檔雜湊、工具版本與參數，重建時跳過輸入未變更的輸出；
+tools/*.py 的內容雜湊也一併記錄，任何共用模組改變時所有輸出都會重建；
+輸出檔本身的雜湊也會記錄，被手動修改或刪除的輸出會重建
+
+清單放在輸出旁 (static/assets/data/.build_manifest.json) 並與輸出一起提交，
+全新 checkout 的建置 (例如 CI) 也能沿用上次的建置記錄，而不是每次都全部重建
+"""
+
+import glob
+import hashlib
+import json
+import os
+import sys
+import tempfile
+
+from pixel_cache import TOOLS_DIR
+
+# 建置清單格式或工具程式以外的因素 (例如依賴套件) 改變時需要遞增，讓所有輸出重建；
+# 工具程式本身的修改由 tools_digest() 自動偵測
+TOOL_VERSION = 3
+
+PROJECT_ROOT = os.path.dirname(TOOLS_DIR)
+DEFAULT_MANIFEST_PATH = os.path.join(PROJECT_ROOT, 'static', 'assets', 'data', '.build_manifest.json')
+
+
+def file_digest(path):
+    """計算檔案內容的 sha256，檔案不存在時回傳 None"""
+    if not os.path.exists(path):
+        return None
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+_tools_digest = None
+
+
+def tools_digest():
+    """tools/*.py 所有檔案 (名稱 + 內容) 的 sha256，每個行程只計算一次
+
+    以整組檔案計算而不是只算已匯入的模組: 延遲匯入的模組 (例如 hit_masks) 在檢查與記錄時
+    不一定都已載入，整組計算才能讓同一次執行得到相同的值
+    """
+    global _tools_digest
+    if _tools_digest is None:
+        digest = hashlib.sha256()
+        for path in sorted(glob.glob(os.path.join(TOOLS_DIR, '*.py'))):
+            digest.update(os.path.basename(path).encode('utf-8') + b'\0')
+            digest.update(file_digest(path).encode('ascii'))
+        _tools_digest = digest.hexdigest()
+    return _tools_digest
+
+
+def _manifest_key(path):
+    """清單中的路徑一律相對於專案根目錄，與執行時的工作目錄無關"""
+    return os.path.relpath(os.path.abspath(path), PROJECT_ROOT).replace(os.sep, '/')
+
+
+def load_manifest(manifest_path=None):
+    """讀取建置清單，不存在或損壞時回傳空清單"""
+    manifest_path = manifest_path or DEFAULT_MANIFEST_PATH
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+
+    manifest.setdefault('outputs', {})
+    manifest['path'] = manifest_path
+    return manifest
+
+
+def save_manifest(manifest):
+    """以暫存檔 + 改名的方式寫回建置清單"""
+    manifest_path = manifest['path']
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+
+    data = {key: value for key, value in manifest.items() if key != 'path'}
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(manifest_path), suffix='.json.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def build_entry(inputs, params=None):
+    """建立一筆輸出記錄: 輸入雜湊、工具版本、工具程式雜湊與參數"""
+    return {
+        'tool_version': TOOL_VERSION,
+        'tools': tools_digest(),
+        'inputs': {_manifest_key(path): file_digest(path) for path in inputs},
+        'params': params or {},
+    }
+
+
+def force_rebuild():
+    """命令列帶 --force 或設定 DTA_FORCE_REBUILD=1 時強制重建"""
+    return '--force' in sys.argv or os.environ.get('DTA_FORCE_REBUILD') == '1'
+
+
+def is_up_to_date(manifest, output_path, inputs, params=None):
+    """輸出檔與上次建置寫出的內容相同，且輸入、版本、參數都沒有改變時回傳 True"""
+    if not record_matches(manifest, output_path, inputs, params):
+        return False
+    # 不存在 (file_digest 為 None) 或被修改過的輸出都要重建
+    recorded = get_output_record(manifest, output_path).get('output')
+    return recorded is not None and file_digest(output_path) == recorded
+
+
+def record_matches(manifest, output_path, inputs, params=None):
+    """上次建置記錄的輸入、版本、參數與目前相同時回傳 True (不檢查輸出檔是否存在)
+
+    用於刻意不輸出檔案的結果 (例如比原圖還大而略過的壓縮變體)，讓略過的判斷也能沿用
+    """
+    if force_rebuild():
+        return False
+
+    recorded = manifest['outputs'].get(_manifest_key(output_path))
+    if recorded is None:
+        return False
+
+    current = build_entry(inputs, params)
+    # JSON 往返會把 tuple 轉成 list，比較前先正規化
+    return json.loads(json.dumps(current)) == {key: recorded.get(key) for key in current}
+
+
+def record_output(manifest, output_path, inputs, params=None, **extra):
+    """記錄輸出檔的建置資訊與輸出檔的雜湊 (需在寫出之後呼叫)，extra 可附加額外欄位 (例如檔案大小)"""
+    entry = build_entry(inputs, params)
+    entry['output'] = file_digest(output_path)
+    entry.update(extra)
+    manifest['outputs'][_manifest_key(output_path)] = entry
+    return entry
+
+
+def get_output_record(manifest, output_path):
+    """取得輸出檔上次建置的記錄，沒有記錄時回傳空 dict"""
+    return manifest['outputs'].get(_manifest_key(output_path), {})
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+整張 sprite sheet 的逐格統計引擎
+將 RGBA 陣列重塑為 (rows, cell_h, cols, cell_w, 4) 視圖，一次 NumPy 運算算出所有格子的統計；
+大圖依格子列切成列帶以多執行緒計算 (見 row_shards)
+"""
+
+import numpy as np
+
+from row_shards import map_row_bands
+from stage_timer import timed
+
+# 視為可見內容的最低 alpha；素材常帶有 alpha 1~2 的近乎透明像素 (npc.png 最常見的顏色是 #ffffff01)，
+# 用在錨點、網格推測等需要「看得到的輪廓」的地方 (覆蓋率統計仍以 alpha > 0 計算)
+VISIBLE_ALPHA = 8
+
+# 逐格統計中形狀為 (rows, cols, ...) 的陣列，列帶結果依此沿第一軸合併
+STAT_ARRAYS = ('coverage', 'content_pixels', 'opaque_pixels', 'semi_transparent_pixels', 'bbox', 'mean_color')
+
+
+def cell_view(img_array, cols, rows):
+    """將圖片陣列重塑為 (rows, cell_h, cols, cell_w, channels) 的零拷貝視圖
+
+    無法整除的右側/下方邊緣會被捨棄，與原本 width // cols 的切格方式一致
+    """
+    height, width = img_array.shape[:2]
+    cell_width = width // cols
+    cell_height = height // rows
+
+    if cell_width == 0 or cell_height == 0:
+        raise ValueError(f"網格 {cols}x{rows} 超出圖片尺寸 {width}x{height}")
+
+    cropped = img_array[:rows * cell_height, :cols * cell_width]
+    channels = img_array.shape[2] if img_array.ndim == 3 else 1
+    return cropped.reshape(rows, cell_height, cols, cell_width, channels)
+
+
+def band_pixels(img_array, rows, start, stop):
+    """第 start ~ stop-1 列格子所在的像素列 (零拷貝切片)，以此切片建立的 cell_view 格子大小不變"""
+    cell_height = img_array.shape[0] // rows
+    return img_array[start * cell_height:stop * cell_height]
+
+
+@timed('cell_stats')
+def compute_cell_stats(img_array, cols=13, rows=11, alpha_threshold=0, threads=None):
+    """一次計算所有格子的覆蓋率、透明度統計、內容邊界與平均顏色
+
+    回傳的每個陣列形狀皆為 (rows, cols, ...)，以 [row, col] 索引
+    bbox 為格子內的本地座標 (x_min, y_min, x_max, y_max)，空格子為 -1
+    大圖依列帶平行計算 (threads 預設為可用 CPU 數)，結果與單執行緒完全相同
+    """
+    cell_view(img_array, cols, rows)  # 先檢查網格大小
+    row_pixels = (img_array.shape[0] // rows) * img_array.shape[1]
+
+    bands = map_row_bands(
+        lambda start, stop: _band_cell_stats(band_pixels(img_array, rows, start, stop), cols, stop - start,
+                                             alpha_threshold),
+        rows, row_pixels, threads, name='cell_stats'
+    )
+    if len(bands) == 1:
+        return bands[0]
+
+    stats = {'grid': (cols, rows), 'cell_size': bands[0]['cell_size']}
+    stats.update({key: np.concatenate([band[key] for band in bands]) for key in STAT_ARRAYS})
+    return stats
+
+
+def _band_cell_stats(img_array, cols, rows, alpha_threshold):
+    """compute_cell_stats 的單一列帶計算 (img_array 為該列帶的像素)"""
+    cells = cell_view(img_array, cols, rows)
+    cell_height, cell_width = cells.shape[1], cells.shape[3]
+
+    alpha = cells[..., 3]
+    content_mask = alpha > alpha_threshold
+
+    content_pixels = np.count_nonzero(content_mask, axis=(1, 3))
+    opaque_pixels = np.count_nonzero(alpha == 255, axis=(1, 3))
+    semi_transparent = np.count_nonzero((alpha > 0) & (alpha < 255), axis=(1, 3))
+    coverage = content_pixels / (cell_width * cell_height)
+
+    # 內容邊界: 先投影到行/列，再找第一個與最後一個有內容的位置
+    row_has = content_mask.any(axis=3).transpose(0, 2, 1)  # (rows, cols, cell_h)
+    col_has = content_mask.any(axis=1)                      # (rows, cols, cell_w)
+    has_content = content_pixels > 0
+
+    y_min = np.argmax(row_has, axis=2)
+    y_max = cell_height - 1 - np.argmax(row_has[..., ::-1], axis=2)
+    x_min = np.argmax(col_has, axis=2)
+    x_max = cell_width - 1 - np.argmax(col_has[..., ::-1], axis=2)
+
+    bbox = np.stack([x_min, y_min, x_max, y_max], axis=-1)
+    bbox[~has_content] = -1
+
+    # 平均顏色只計算有內容的像素
+    masked_rgb = np.where(content_mask[..., None], cells[..., :3], 0)
+    rgb_sum = masked_rgb.sum(axis=(1, 3), dtype=np.uint64).astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_color = rgb_sum / content_pixels[..., None]
+    mean_color[~has_content] = 0.0
+
+    return {
+        'grid': (cols, rows),
+        'cell_size': (cell_width, cell_height),
+        'coverage': coverage,
+        'content_pixels': content_pixels,
+        'opaque_pixels': opaque_pixels,
+        'semi_transparent_pixels': semi_transparent,
+        'bbox': bbox,
+        'mean_color': mean_color,
+    }
+
+
+def content_cells(stats, min_coverage):
+    """列出覆蓋率高於門檻的格子 (col, row, index, coverage)，依索引排序"""
+    cols = stats['grid'][0]
+    coverage = stats['coverage']
+    rows_idx, cols_idx = np.nonzero(coverage > min_coverage)
+
+    return [
+        (int(col), int(row), int(row * cols + col), float(coverage[row, col]))
+        for row, col in zip(rows_idx, cols_idx)
+    ]
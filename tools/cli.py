@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+tools 統一命令列入口
+用法: python -m tools analyze npc.png --passes coverage,desk,grid,skin
+      python -m tools batch ../static/assets/tilesets --passes coverage,desk -o report.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+
+import batch_analysis
+from analysis_passes import DEFAULT_PASSES, PASSES, create_sheet_context, run_passes, sheet_frame_records
+from frame_records import save_frame_records
+from pixel_cache import TOOLS_DIR
+from stage_timer import DEFAULT_PROFILE_DIR, profiled_run
+
+PROJECT_ROOT = os.path.dirname(TOOLS_DIR)
+ASSET_SEARCH_DIRS = [
+    os.path.join(PROJECT_ROOT, 'static', 'assets', 'tilesets'),
+    os.path.join(PROJECT_ROOT, 'static', 'assets'),
+]
+
+
+def resolve_asset_path(name):
+    """解析圖片路徑: 先找實際路徑，再到 static/assets 底下尋找"""
+    if os.path.exists(name):
+        return name
+
+    for base in ASSET_SEARCH_DIRS:
+        candidate = os.path.join(base, name)
+        if os.path.exists(candidate):
+            return candidate
+
+    raise FileNotFoundError(f"找不到圖片: {name}")
+
+
+def parse_grid(value):
+    """解析 13x11 格式的網格參數"""
+    try:
+        cols, rows = (int(v) for v in value.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"網格格式應為 COLSxROWS: {value}")
+    return cols, rows
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m tools', description='DTA Office 素材分析工具')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    analyze = subparsers.add_parser('analyze', help='載入圖片一次並執行多個分析 pass')
+    analyze.add_argument('images', nargs='+', help='圖片路徑或 static/assets 底下的檔名')
+    analyze.add_argument('--passes', default=','.join(DEFAULT_PASSES),
+                         help=f"以逗號分隔的 pass 名稱，或 all (預設: {','.join(DEFAULT_PASSES)})")
+    analyze.add_argument('--grid', type=parse_grid, default=(13, 11), help='網格配置 (預設: 13x11)')
+    analyze.add_argument('-o', '--output', help='報告輸出路徑 (預設輸出到 stdout)')
+    analyze.add_argument('--records', metavar='DIR', help='另外將逐幀記錄以欄式 .npz 輸出到此目錄 (<圖片名>_frames.npz)')
+    analyze.add_argument('-v', '--verbose', action='store_true', help='顯示各 pass 的過程輸出')
+    analyze.add_argument('--profile', nargs='?', const=DEFAULT_PROFILE_DIR, metavar='DIR',
+                         help='量測各階段的時間與記憶體，輸出 JSON 與 Chrome trace 到此目錄 (預設: tools/.cache/profiles)')
+
+    batch = subparsers.add_parser('batch', help='以行程池平行分析目錄下的所有圖片並合併報告')
+    batch.add_argument('directory', help='tileset / 背景圖所在的目錄')
+    batch.add_argument('--pattern', action='append', metavar='GLOB',
+                       help='檔名樣式，可重複指定 (預設: *.png)')
+    batch.add_argument('-r', '--recursive', action='store_true', help='包含子目錄')
+    batch.add_argument('--passes', default=','.join(DEFAULT_PASSES),
+                       help=f"以逗號分隔的 pass 名稱，或 all (預設: {','.join(DEFAULT_PASSES)})")
+    batch.add_argument('--grid', type=parse_grid, default=(13, 11), help='網格配置 (預設: 13x11)')
+    batch.add_argument('-j', '--jobs', type=int, help='平行行程數 (預設: 可用 CPU 數)')
+    batch.add_argument('-o', '--output', help='合併報告輸出路徑 (預設輸出到 stdout)')
+    batch.add_argument('--records', metavar='DIR', help='另外將每張圖的逐幀記錄以 .npz 輸出到此目錄')
+    batch.add_argument('--profile', nargs='?', const=DEFAULT_PROFILE_DIR, metavar='DIR',
+                       help='量測批次整體的時間與記憶體 (子行程內的階段不列入)')
+
+    subparsers.add_parser('passes', help='列出可用的分析 pass')
+
+    # bench 的參數直接交給 benchmarks.py 解析 (見 main)
+    subparsers.add_parser('bench', help='執行素材工具效能基準測試 (參數同 benchmarks.py)', add_help=False)
+
+    return parser
+
+
+def parse_pass_names(value):
+    """解析 --passes，未知的名稱在開始分析前就回報"""
+    pass_names = list(PASSES) if value == 'all' else [p.strip() for p in value.split(',') if p.strip()]
+    unknown = [name for name in pass_names if name not in PASSES]
+    if unknown:
+        raise ValueError(f"未知的分析 pass: {', '.join(unknown)} (可用: {', '.join(PASSES)})")
+    return pass_names
+
+
+def write_report(result, output_path):
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+
+    if output_path:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write(output)
+        print(f"💾 分析報告已保存到: {output_path}", file=sys.stderr)
+    else:
+        print(output)
+
+
+def command_analyze(args):
+    pass_names = parse_pass_names(args.passes)
+
+    reports = []
+    for image in args.images:
+        sheet = create_sheet_context(resolve_asset_path(image), grid=args.grid)
+
+        # 各 pass 的過程輸出導向 stderr (或丟棄)，讓 stdout 只有報告
+        sink = sys.stderr if args.verbose else open(os.devnull, 'w')
+        with contextlib.redirect_stdout(sink):
+            reports.append(run_passes(sheet, pass_names))
+        if sink is not sys.stderr:
+            sink.close()
+
+        if args.records:
+            os.makedirs(args.records, exist_ok=True)
+            stem = os.path.splitext(sheet['name'])[0]
+            npz_path = os.path.join(args.records, f"{stem}_frames.npz")
+            save_frame_records(npz_path, sheet_frame_records(sheet, reports[-1]), grid=list(sheet['grid']))
+            print(f"💾 逐幀記錄已保存到: {npz_path}", file=sys.stderr)
+
+    write_report(reports[0] if len(reports) == 1 else {'reports': reports}, args.output)
+    return 0
+
+
+def command_batch(args):
+    pass_names = parse_pass_names(args.passes)
+    image_paths = batch_analysis.find_images(args.directory, args.pattern or batch_analysis.DEFAULT_PATTERNS,
+                                             args.recursive)
+    if not image_paths:
+        raise FileNotFoundError(f"{args.directory} 底下沒有符合的圖片")
+    if args.jobs is not None and args.jobs < 1:
+        raise ValueError(f"--jobs 必須大於 0: {args.jobs}")
+
+    workers = args.jobs or batch_analysis.default_workers(len(image_paths))
+    print(f"🔍 以 {workers} 個行程分析 {len(image_paths)} 張圖片...", file=sys.stderr)
+
+    def report_progress(report):
+        status = f"❌ {report['error']}" if 'error' in report else '✅'
+        print(f"  {report['file']}: {status} ({report['elapsed_s']:.2f}s)", file=sys.stderr)
+
+    npz_paths = None
+    if args.records:
+        os.makedirs(args.records, exist_ok=True)
+        npz_paths = [batch_analysis.records_path_for(args.records, args.directory, path) for path in image_paths]
+
+    reports = batch_analysis.run_batch(image_paths, pass_names, args.grid, workers, npz_paths, report_progress)
+    result = batch_analysis.merge_reports(args.directory, image_paths, reports, pass_names, args.grid)
+    write_report(result, args.output)
+
+    # 有任何圖片失敗時以非零狀態結束，讓素材建置流程能察覺
+    return 1 if result['summary']['failed'] else 0
+
+
+def command_passes(args):
+    for name, (_, description) in PASSES.items():
+        print(f"  {name:<14} {description}")
+    return 0
+
+
+COMMANDS = {
+    'analyze': command_analyze,
+    'batch': command_batch,
+    'passes': command_passes,
+}
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ['bench']:
+        import benchmarks
+        return benchmarks.main(argv[1:])
+
+    args = build_parser().parse_args(argv)
+    try:
+        with profiled_run(args.command, getattr(args, 'profile', None)):
+            return COMMANDS[args.command](args)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+查表式像素顏色分類
+將家具/辦公桌/人物的顏色規則預先算成完整 24-bit RGB 查找表 (每個顏色一個 uint8 位元旗標)，
+分類整張 sheet 只需一次查表，並可一次得到每幀的標籤直方圖；
+analyze_office_furniture 與 verify_desk_content 的顏色偵測都以這份規則為準
+"""
+
+import contextlib
+import glob
+import hashlib
+import inspect
+import os
+
+import numpy as np
+
+from cell_stats import band_pixels, cell_view
+from pixel_cache import TOOLS_DIR
+from row_shards import map_row_bands
+from stage_timer import stage, timed
+
+DEFAULT_LUT_DIR = os.path.join(TOOLS_DIR, '.cache')
+
+# 家具顏色 (analyze_office_furniture)
+FURNITURE_WOOD = 1 << 0
+FURNITURE_METAL = 1 << 1
+# 人物顏色 (analyze_office_furniture，膚色另要求 G > B)
+CHARACTER_SKIN = 1 << 2
+CHARACTER_CLOTHING = 1 << 3
+# 辦公桌顏色 (verify_desk_content，門檻較寬鬆)
+DESK_WOOD = 1 << 4
+DESK_METAL = 1 << 5
+# 一般膚色 (verify_desk_content、analyze_npc_assets)
+SKIN = 1 << 6
+CLOTHING = 1 << 7
+
+FLAG_NAMES = {
+    FURNITURE_WOOD: 'furniture_wood',
+    FURNITURE_METAL: 'furniture_metal',
+    CHARACTER_SKIN: 'character_skin',
+    CHARACTER_CLOTHING: 'character_clothing',
+    DESK_WOOD: 'desk_wood',
+    DESK_METAL: 'desk_metal',
+    SKIN: 'skin',
+    CLOTHING: 'clothing',
+}
+
+_lut = None
+
+
+def classify_rgb_rules(r, g, b):
+    """對 RGB 通道套用所有顏色規則，回傳 uint8 位元旗標
+
+    以 int16 計算，避免 uint8 相減 (R - G) 或相加 (R + 30) 時溢位
+    """
+    r, g, b = (np.asarray(c, dtype=np.int16) for c in (r, g, b))
+    flags = np.zeros(np.broadcast(r, g, b).shape, dtype=np.uint8)
+
+    rules = {
+        # 木色: 偏紅棕色
+        FURNITURE_WOOD: (r > 100) & (g > 50) & (b < 100) & (r > b),
+        # 金屬/灰色: R ≈ G ≈ B，中等亮度
+        FURNITURE_METAL: (np.abs(r - g) < 30) & (np.abs(g - b) < 30) & (r > 50) & (r < 200),
+        CHARACTER_SKIN: (r > 95) & (g > 40) & (b > 20) & (r > g) & (r > b) & (g > b),
+        # 藍色系 (襯衫、西裝)、白色系 (襯衫)、黑色系 (正裝)
+        CHARACTER_CLOTHING: (b > r + 30) | ((r > 200) & (g > 200) & (b > 200)) |
+                            ((r < 50) & (g < 50) & (b < 50)),
+        DESK_WOOD: (r > 80) & (g > 40) & (b < 80) & (r > b),
+        DESK_METAL: (np.abs(r - g) < 25) & (np.abs(g - b) < 25) & (r > 60) & (r < 180),
+        SKIN: (r > 95) & (g > 40) & (b > 20) & (r > g) & (r > b),
+        CLOTHING: (b > r + 20) | ((r > 180) & (g > 180) & (b > 180)) |
+                  ((r < 60) & (g < 60) & (b < 60)),
+    }
+    for flag, matched in rules.items():
+        flags[matched] |= flag
+
+    return flags
+
+
+def build_label_lut(chunk=16):
+    """建立 2^24 項的查找表，索引為 (R << 16) | (G << 8) | B
+
+    每次處理 chunk 個 R 值，避免一次建立 16M 個 int16 的中間陣列
+    """
+    lut = np.empty(1 << 24, dtype=np.uint8)
+    g, b = np.meshgrid(np.arange(256), np.arange(256), indexing='ij')
+
+    for start in range(0, 256, chunk):
+        r = np.arange(start, start + chunk)[:, None, None]
+        lut[start << 16:(start + chunk) << 16] = classify_rgb_rules(r, g, b).ravel()
+
+    return lut
+
+
+def rules_digest():
+    """顏色規則的指紋: 規則與建表函數的原始碼，加上各旗標的值
+
+    查找表快取以此命名，修改規則後自動重建，不需要手動遞增版本號
+    """
+    digest = hashlib.sha256()
+    for func in (classify_rgb_rules, build_label_lut):
+        digest.update(inspect.getsource(func).encode('utf-8'))
+    digest.update(repr(sorted(FLAG_NAMES.items())).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def load_label_lut(cache_dir=None):
+    """載入查找表，第一次建立後存成 .npy 並以 memory-map 重複使用
+
+    快取檔名帶有 rules_digest()，建立新表時一併刪除舊規則留下的表
+    """
+    global _lut
+    if _lut is not None and cache_dir is None:
+        return _lut
+
+    cache_dir = cache_dir or DEFAULT_LUT_DIR
+    cache_path = os.path.join(cache_dir, f'color_lut-{rules_digest()}.npy')
+
+    if not os.path.exists(cache_path):
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = cache_path + f'.{os.getpid()}.tmp'
+        try:
+            with stage('classify.build_lut'), open(tmp_path, 'wb') as f:
+                np.save(f, build_label_lut())
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp_path)
+            raise
+
+        # 其他行程可能同時在清理或仍在使用舊表 (Windows 無法刪除已 memory-map 的檔案)，失敗時略過
+        for stale in glob.glob(os.path.join(cache_dir, 'color_lut-*.npy')):
+            if stale != cache_path:
+                with contextlib.suppress(OSError):
+                    os.remove(stale)
+
+    _lut = np.load(cache_path, mmap_mode='r')
+    return _lut
+
+
+def classify_pixels(rgb):
+    """以一次查表分類 (..., 3) 的 uint8 RGB 陣列，回傳同形狀 (去掉通道維度) 的旗標陣列"""
+    rgb = np.asarray(rgb)
+    index = (rgb[..., 0].astype(np.uint32) << 16) | (rgb[..., 1].astype(np.uint32) << 8) | rgb[..., 2]
+    return load_label_lut()[index]
+
+
+def label_histogram(labels):
+    """旗標值 (0-255) 的直方圖"""
+    return np.bincount(np.asarray(labels).ravel(), minlength=256)
+
+
+@timed('classify.frames')
+def frame_label_histograms(pixels, cols=13, rows=11, threads=None):
+    """一次分類整張 RGBA sheet，回傳每幀內容像素 (alpha > 0) 的旗標直方圖，形狀為 (frames, 256)
+
+    幀的順序與 row * cols + col 相同，切格方式與 cell_view 一致；
+    大圖依格子列帶平行分類，各列帶的直方圖依序接起來即為整張的結果
+    """
+    cell_view(pixels, cols, rows)  # 先檢查網格大小
+    load_label_lut()  # 查找表在分派執行緒前載入，避免多個執行緒同時建立
+    row_pixels = (pixels.shape[0] // rows) * pixels.shape[1]
+
+    bands = map_row_bands(
+        lambda start, stop: _band_label_histograms(band_pixels(pixels, rows, start, stop), cols, stop - start),
+        rows, row_pixels, threads, name='classify'
+    )
+    return bands[0] if len(bands) == 1 else np.concatenate(bands)
+
+
+def _band_label_histograms(pixels, cols, rows):
+    """frame_label_histograms 的單一列帶計算"""
+    cells = cell_view(pixels, cols, rows)
+    cell_height, cell_width = cells.shape[1], cells.shape[3]
+    grid = pixels[:rows * cell_height, :cols * cell_width]
+
+    content = grid[..., 3] > 0
+    labels = classify_pixels(grid[..., :3])[content]
+
+    frame_ids = (np.arange(rows * cell_height) // cell_height)[:, None] * cols + \
+        (np.arange(cols * cell_width) // cell_width)[None, :]
+    keys = frame_ids[content].astype(np.int64) * 256 + labels
+
+    return np.bincount(keys, minlength=rows * cols * 256).reshape(rows * cols, 256)
+
+
+def label_fraction(histogram, flags):
+    """直方圖中帶有任一指定旗標的像素比例，histogram 可為 (256,) 或 (frames, 256)"""
+    histogram = np.asarray(histogram)
+    matching = (np.arange(256) & flags) != 0
+    total = histogram.sum(axis=-1)
+    matched = histogram[..., matching].sum(axis=-1)
+
+    fraction = np.divide(matched, total, out=np.zeros(np.shape(total)), where=total > 0)
+    return float(fraction) if fraction.ndim == 0 else fraction
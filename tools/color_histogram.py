@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+整數打包的顏色直方圖
+將 RGBA 打包成 uint32，以 np.unique / bincount 一次算出整張 sheet 的精確調色盤、
+主要顏色與每幀用色數，作為量化與換色 (palette swap) 的依據
+"""
+
+import numpy as np
+
+from cell_stats import cell_view
+from stage_timer import timed
+
+
+def pack_colors(pixels, include_alpha=True):
+    """將 (..., 4) 或 (..., 3) 的 uint8 陣列打包成 uint32，格式為 0xRRGGBBAA
+
+    include_alpha=False 時 alpha 位元組固定為 0xFF，只依 RGB 區分顏色
+    """
+    pixels = np.asarray(pixels)
+    packed = (pixels[..., 0].astype(np.uint32) << 24) | \
+        (pixels[..., 1].astype(np.uint32) << 16) | \
+        (pixels[..., 2].astype(np.uint32) << 8)
+    if include_alpha and pixels.shape[-1] == 4:
+        return packed | pixels[..., 3]
+    return packed | np.uint32(0xFF)
+
+
+def unpack_colors(packed):
+    """pack_colors 的反向操作，回傳 (N, 4) 的 uint8 RGBA 陣列"""
+    packed = np.asarray(packed, dtype=np.uint32)
+    return np.stack([(packed >> shift) & 0xFF for shift in (24, 16, 8, 0)], axis=-1).astype(np.uint8)
+
+
+def color_hex(packed):
+    """0xRRGGBBAA 轉為 #rrggbb (不透明) 或 #rrggbbaa"""
+    packed = int(packed)
+    return f"#{packed >> 8:06x}" if packed & 0xFF == 0xFF else f"#{packed:08x}"
+
+
+@timed('palette.histogram')
+def color_histogram(pixels, include_alpha=True, mask=None):
+    """計算精確的顏色直方圖
+
+    預設只統計內容像素 (alpha > 0)，mask 可另外指定要統計的像素
+    回傳 {'colors': 打包後的顏色 (遞增排序), 'counts': 每色像素數, 'total': 像素總數}
+    """
+    if mask is None:
+        mask = pixels[..., 3] > 0
+    colors, counts = np.unique(pack_colors(pixels[mask], include_alpha), return_counts=True)
+    return {'colors': colors, 'counts': counts, 'total': int(counts.sum())}
+
+
+def palette_stats(histogram, top=8):
+    """由直方圖整理調色盤統計: 顏色數、主要顏色與精確的平均/標準差
+
+    平均與標準差以整數加權和計算，不需要建立逐像素的浮點副本
+    """
+    colors, counts, total = histogram['colors'], histogram['counts'], histogram['total']
+    if total == 0:
+        return {'color_count': 0, 'fits_8bit_palette': True, 'dominant': [], 'mean_rgb': None, 'std_rgb': None}
+
+    rgb = unpack_colors(colors)[:, :3].astype(np.int64)
+    weighted = rgb * counts[:, None]
+    mean = weighted.sum(axis=0) / total
+    variance = (weighted * rgb).sum(axis=0) / total - mean ** 2
+
+    order = np.argsort(counts, kind='stable')[::-1][:top]
+    dominant = [
+        {'color': color_hex(colors[i]), 'count': int(counts[i]), 'ratio': float(counts[i] / total)}
+        for i in order
+    ]
+
+    return {
+        'color_count': int(len(colors)),
+        'fits_8bit_palette': bool(len(colors) <= 256),
+        'dominant': dominant,
+        'mean_rgb': [float(v) for v in mean],
+        'std_rgb': [float(v) for v in np.sqrt(np.maximum(variance, 0))],
+    }
+
+
+@timed('palette.frames')
+def frame_color_counts(pixels, cols=13, rows=11, include_alpha=True):
+    """一次統計整張 sheet 的調色盤與每幀的用色
+
+    回傳 dict:
+      palette       整張 sheet 的顏色 (打包後，遞增排序)
+      counts        每色像素數
+      frame_colors  每幀使用的不同顏色數，形狀為 (frames,)
+      frame_pixels  每幀的內容像素數
+      color_frames  每個顏色出現在幾個幀中 (只出現在一幀的顏色是換色的候選)
+    幀的順序與 row * cols + col 相同，切格方式與 cell_view 一致
+    """
+    cells = cell_view(pixels, cols, rows)
+    cell_height, cell_width = cells.shape[1], cells.shape[3]
+    grid = pixels[:rows * cell_height, :cols * cell_width]
+    frames = rows * cols
+
+    content = grid[..., 3] > 0
+    palette, inverse, counts = np.unique(pack_colors(grid[content], include_alpha),
+                                         return_inverse=True, return_counts=True)
+
+    frame_ids = (np.arange(rows * cell_height) // cell_height)[:, None] * cols + \
+        (np.arange(cols * cell_width) // cell_width)[None, :]
+    frame_of_pixel = frame_ids[content].astype(np.int64)
+
+    # (幀, 顏色) 配對去重後，分別依幀與依顏色計數
+    pairs = np.unique(frame_of_pixel * len(palette) + inverse.ravel())
+    frame_colors = np.bincount(pairs // max(len(palette), 1), minlength=frames)
+    color_frames = np.bincount(pairs % max(len(palette), 1), minlength=len(palette))
+
+    return {
+        'palette': palette,
+        'counts': counts,
+        'frame_colors': frame_colors,
+        'frame_pixels': np.bincount(frame_of_pixel, minlength=frames),
+        'color_frames': color_frames,
+    }
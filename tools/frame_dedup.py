@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Sprite 幀去重
+一次向量化計算所有幀的精確像素雜湊與感知雜湊 (dHash)，將重複幀分群，
+讓圖集中重複的幀名稱共用同一塊貼圖區域
+"""
+
+import numpy as np
+
+from cell_stats import cell_view
+from stage_timer import timed
+
+HASH_SIZE = 8
+
+
+def frame_stack(pixels, cols, rows):
+    """將 sheet 切成 (frames, cell_h, cell_w, 4) 的幀陣列，索引順序與 row * cols + col 相同"""
+    cells = cell_view(pixels, cols, rows)
+    frames = cells.transpose(0, 2, 1, 3, 4)
+    return frames.reshape(rows * cols, cells.shape[1], cells.shape[3], cells.shape[4])
+
+
+def _normalize_transparent(frames):
+    """完全透明像素的 RGB 不影響畫面，比對前先歸零"""
+    return np.where(frames[..., 3:4] == 0, 0, frames)
+
+
+def exact_frame_ids(frames):
+    """精確像素比對分群，回傳每幀的群組編號 (frames 需先經 _normalize_transparent)"""
+    flat = np.ascontiguousarray(frames).reshape(len(frames), -1)
+    keys = flat.view(np.dtype((np.void, flat.shape[1]))).ravel()
+    _, inverse = np.unique(keys, return_inverse=True)
+    return inverse.ravel()
+
+
+def _area_resize(values, out_h, out_w):
+    """以區域平均將 (frames, h, w) 縮小為 (frames, out_h, out_w)"""
+    _, h, w = values.shape
+    row_edges = (np.arange(out_h) * h) // out_h
+    col_edges = (np.arange(out_w) * w) // out_w
+    row_counts = np.diff(np.append(row_edges, h))
+    col_counts = np.diff(np.append(col_edges, w))
+
+    summed = np.add.reduceat(values, row_edges, axis=1)
+    summed = np.add.reduceat(summed, col_edges, axis=2)
+    return summed / (row_counts[:, None] * col_counts[None, :])
+
+
+def perceptual_hashes(frames, hash_size=HASH_SIZE):
+    """計算每幀的 dHash (64 位元)，回傳 uint64 陣列
+
+    亮度以 alpha 預乘，讓透明背景與輪廓一併反映在雜湊中
+    """
+    rgb = frames[..., :3].astype(np.float32)
+    alpha = frames[..., 3].astype(np.float32) / 255.0
+    luminance = (rgb[..., 0] * 0.299 + rgb[..., 1] * 0.587 + rgb[..., 2] * 0.114) * alpha
+
+    small = _area_resize(luminance, hash_size, hash_size + 1)
+    bits = small[:, :, 1:] > small[:, :, :-1]
+
+    packed = np.packbits(bits.reshape(len(frames), -1), axis=1)
+    return packed.view('>u8').ravel().astype(np.uint64)
+
+
+def hamming_distances(hashes_a, hashes_b):
+    """兩組 uint64 雜湊之間的漢明距離矩陣"""
+    xor = np.bitwise_xor(hashes_a[:, None], hashes_b[None, :])
+    return np.unpackbits(xor.view(np.uint8).reshape(*xor.shape, 8), axis=-1).sum(axis=-1)
+
+
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def cluster_frames(exact_ids, phashes, frames=None, max_distance=None, max_pixel_error=8, chunk_size=512):
+    """將幀分群，回傳每幀的代表幀 (群組中最小的幀索引)
+
+    精確相同的幀一定同群；max_distance 不為 None 時，感知雜湊漢明距離在門檻內的幀
+    成為候選，再與候選群組的代表幀逐像素比對，最大通道誤差不超過 max_pixel_error 才合併
+    """
+    count = len(exact_ids)
+    parent = np.arange(count)
+
+    # 精確重複: 每個群組的第一幀作為代表
+    order = np.argsort(exact_ids, kind='stable')
+    sorted_ids = exact_ids[order]
+    group_start = np.r_[True, sorted_ids[1:] != sorted_ids[:-1]]
+    representatives = order[np.maximum.accumulate(np.where(group_start, np.arange(count), 0))]
+    parent[order] = representatives
+
+    if max_distance is not None:
+        unique_frames = np.flatnonzero(parent == np.arange(count))
+        unique_hashes = phashes[unique_frames]
+
+        for start in range(0, len(unique_frames), chunk_size):
+            distances = hamming_distances(unique_hashes[start:start + chunk_size], unique_hashes)
+            pairs_a, pairs_b = np.nonzero(distances <= max_distance)
+            for a, b in zip(pairs_a + start, pairs_b):
+                if a >= b:
+                    continue
+                root_a = _find(parent, unique_frames[a])
+                root_b = _find(parent, unique_frames[b])
+                if root_a == root_b:
+                    continue
+                if frames is not None:
+                    error = np.abs(frames[root_a].astype(np.int16) - frames[unique_frames[b]]).max()
+                    if error > max_pixel_error:
+                        continue
+                parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    return np.array([_find(parent, i) for i in range(count)])
+
+
+@timed('atlas.dedup')
+def find_duplicate_frames(pixels, cols=13, rows=11, max_distance=None, max_pixel_error=8):
+    """分析整張 sheet 的重複幀
+
+    預設只合併精確重複的幀；指定 max_distance 時另以感知雜湊找出近似重複幀
+    回傳 {'aliases': {frame_id: canonical_id}, 'clusters': [[frame_ids...]], ...}，
+    aliases 只包含非代表幀
+    """
+    frames = _normalize_transparent(frame_stack(pixels, cols, rows))
+    exact_ids = exact_frame_ids(frames)
+    phashes = perceptual_hashes(frames)
+    canonical = cluster_frames(exact_ids, phashes, frames, max_distance, max_pixel_error)
+
+    clusters = {}
+    for frame_id, root in enumerate(canonical):
+        clusters.setdefault(int(root), []).append(frame_id)
+
+    return {
+        'aliases': {frame_id: int(root) for frame_id, root in enumerate(canonical) if root != frame_id},
+        'clusters': [members for members in clusters.values() if len(members) > 1],
+        'unique_frames': len(clusters),
+        'phashes': [f"{int(h):016x}" for h in phashes],
+    }
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+逐幀分析結果的欄式二進位輸出
+每個欄位 (frame_index、coverage、bbox、各項評分…) 存成未壓縮 .npz 中的一個 .npy 成員，
+讀取時直接依 zip 成員在檔案中的位移做 memory-map，上萬幀的 sheet 也能零拷貝載入單一欄位；
+JSON 報告只保留給人看的摘要
+"""
+
+import io
+import os
+import struct
+import tempfile
+import zipfile
+
+import numpy as np
+
+from stage_timer import stage
+
+FRAME_DTYPE = np.dtype([
+    ('frame_index', np.int32),
+    ('col', np.int16),
+    ('row', np.int16),
+    ('coverage', np.float32),
+    ('content_pixels', np.int32),
+    # 格子內的本地座標 (x_min, y_min, x_max, y_max)，空格子為 -1
+    ('bbox', np.int16, (4,)),
+    # 未評分的幀為 NaN
+    ('desk_score', np.float32),
+    ('character_score', np.float32),
+    ('furniture_score', np.float32),
+    ('has_content', np.bool_),
+    ('likely_desk', np.bool_),
+    ('likely_character', np.bool_),
+])
+
+# zip local file header 的固定長度與檔名/額外欄位長度的位置
+_LOCAL_HEADER_SIZE = 30
+_LOCAL_HEADER_LENGTHS = struct.Struct('<HH')
+
+
+def empty_frame_records(count):
+    """建立 count 幀的記錄，評分為 NaN，其他欄位為 0 / False，bbox 為 -1"""
+    records = np.zeros(count, dtype=FRAME_DTYPE)
+    records['frame_index'] = np.arange(count)
+    records['bbox'] = -1
+    for name in ('desk_score', 'character_score', 'furniture_score'):
+        records[name] = np.nan
+    return records
+
+
+def frame_records_from_stats(stats):
+    """由 compute_cell_stats 的結果建立記錄，幀的順序與 row * cols + col 相同"""
+    cols, rows = stats['grid']
+    records = empty_frame_records(cols * rows)
+
+    records['col'] = np.tile(np.arange(cols), rows)
+    records['row'] = np.repeat(np.arange(rows), cols)
+    records['coverage'] = stats['coverage'].ravel()
+    records['content_pixels'] = stats['content_pixels'].ravel()
+    records['bbox'] = stats['bbox'].reshape(-1, 4)
+    records['has_content'] = records['content_pixels'] > 0
+    return records
+
+
+def save_frame_records(path, records, **extra):
+    """將結構化記錄以欄式寫成未壓縮 .npz，每個欄位一個成員
+
+    extra 可附加其他陣列 (例如網格大小)；以暫存檔 + 改名寫入，中斷時不會留下半個檔案
+    """
+    columns = {name: np.ascontiguousarray(records[name]) for name in records.dtype.names}
+    columns.update({name: np.asarray(value) for name, value in extra.items()})
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.npz.tmp')
+    try:
+        with stage('npz_dump', path=os.path.basename(path)), os.fdopen(fd, 'wb') as f:
+            np.savez(f, **columns)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _member_data_offset(f, info):
+    """zip 成員資料在檔案中的起始位移 (local header 的長度欄位可能與中央目錄不同)"""
+    f.seek(info.header_offset + _LOCAL_HEADER_SIZE - _LOCAL_HEADER_LENGTHS.size)
+    name_length, extra_length = _LOCAL_HEADER_LENGTHS.unpack(f.read(_LOCAL_HEADER_LENGTHS.size))
+    return info.header_offset + _LOCAL_HEADER_SIZE + name_length + extra_length
+
+
+def _read_npy_header(f):
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        return np.lib.format.read_array_header_1_0(f)
+    return np.lib.format.read_array_header_2_0(f)
+
+
+def load_frame_columns(path, mmap_mode='r'):
+    """讀取 save_frame_records 的 .npz，回傳 {欄位名稱: 陣列}
+
+    未壓縮的成員直接 memory-map (mmap_mode=None 時完整讀入)，壓縮的成員退回一般讀取
+    """
+    columns = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as f:
+        for info in archive.infolist():
+            name = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+
+            if mmap_mode is None or info.compress_type != zipfile.ZIP_STORED:
+                columns[name] = np.load(io.BytesIO(archive.read(info)), allow_pickle=False)
+                continue
+
+            f.seek(_member_data_offset(f, info))
+            shape, fortran_order, dtype = _read_npy_header(f)
+            if dtype.hasobject:
+                raise ValueError(f"{path}: 欄位 {name} 含 Python 物件，無法 memory-map")
+            if int(np.prod(shape)) == 0:
+                columns[name] = np.empty(shape, dtype=dtype)
+                continue
+            columns[name] = np.memmap(path, dtype=dtype, mode=mmap_mode, offset=f.tell(),
+                                      shape=shape, order='F' if fortran_order else 'C')
+
+    return columns
+
+
+def load_frame_records(path):
+    """將欄式 .npz 組回 FRAME_DTYPE 結構化陣列 (會複製資料，只需要部分欄位時請用 load_frame_columns)"""
+    columns = load_frame_columns(path)
+    records = empty_frame_records(len(columns['frame_index']))
+    for name in FRAME_DTYPE.names:
+        if name in columns:
+            records[name] = columns[name]
+    return records
+
+
+def records_path(json_path):
+    """JSON 報告對應的 .npz 路徑"""
+    return os.path.splitext(json_path)[0] + '.npz'
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+自動推測 sprite sheet 網格
+由 alpha 通道的列/行投影，以 FFT 自相關找出主要週期 (格子大小)，
+再將投影依週期折疊，由格子之間的透明間隙 (折疊後的最小值) 決定相位 (起始偏移)；
+一次 O(n log n) 計算直接得到網格，不必逐一列舉網格假設，也能處理無法整除的圖片尺寸
+"""
+
+import numpy as np
+
+from cell_stats import VISIBLE_ALPHA
+
+# 候選週期的自相關值達到最高峰的這個比例時，視為基本週期 (避免選到倍數週期)
+HARMONIC_RATIO = 0.85
+# 剩下的長度只差不到這個比例就能再排一格時，視為最後一格被圖片裁掉 (這樣的候選會因超出圖片而被排除)
+COUNT_TOLERANCE = 0.1
+# 擬合週期附近的整數候選範圍 (±像素)
+PITCH_SEARCH = 2
+# 邊界上的內容比例不超過最佳候選 + 此值時，視為同樣沒有切到 sprite
+BOUNDARY_TOLERANCE = 0.02
+# 網格以外 (起點之前、最後一格之後) 的內容超過總內容的這個比例時，視為漏掉了 sprite
+OUTSIDE_TOLERANCE = 0.01
+# 網格結束後剩下的長度不超過此比例的週期時，視為剛好排滿圖片
+FILL_TOLERANCE = 0.25
+# 間隙: 折疊後不超過 最小值 + 此比例 × (最大值 - 最小值) 的位置
+GUTTER_TOLERANCE = 0.1
+# 信心低於此值時不套用推測的偏移 (回傳 0)
+MIN_PHASE_CONFIDENCE = 0.3
+
+
+def alpha_projections(pixels, alpha_threshold=VISIBLE_ALPHA):
+    """回傳 (每欄內容比例, 每列內容比例)，形狀分別為 (W,) 與 (H,)"""
+    content = pixels[:, :, 3] > alpha_threshold
+    return content.mean(axis=0), content.mean(axis=1)
+
+
+def autocorrelation(profile):
+    """以 FFT 計算去平均後投影的自相關，依重疊長度正規化，ac[0] = 1"""
+    values = np.asarray(profile, dtype=np.float64)
+    values = values - values.mean()
+    length = len(values)
+
+    spectrum = np.fft.rfft(values, 2 * length)
+    ac = np.fft.irfft(spectrum * np.conj(spectrum), 2 * length)[:length]
+    if ac[0] <= 0:
+        return np.zeros(length)
+
+    # 不偏估計: 每個位移只有 length - lag 個重疊樣本
+    ac = ac / (length - np.arange(length))
+    return ac / ac[0]
+
+
+def _local_maxima(values):
+    inner = (values[1:-1] >= values[:-2]) & (values[1:-1] > values[2:])
+    return np.flatnonzero(inner) + 1
+
+
+def fold_profile(profile, pitch):
+    """將投影依週期折疊，回傳每個相位的平均值 (形狀為 (pitch,))"""
+    positions = np.arange(len(profile)) % pitch
+    counts = np.bincount(positions, minlength=pitch)
+    return np.bincount(positions, weights=profile, minlength=pitch) / np.maximum(counts, 1)
+
+
+def gutter_run(folded):
+    """折疊投影中最長的一段 (可繞回開頭) 間隙，回傳 (起點, 長度)；沒有明顯起伏時回傳 None"""
+    low, high = folded.min(), folded.max()
+    if high <= low:
+        return None
+
+    gutter = folded <= low + GUTTER_TOLERANCE * (high - low)
+    if gutter.all():
+        return None
+
+    # 從一個非間隙的位置開始掃描，繞回開頭的間隙就不會被切成兩段
+    pitch = len(folded)
+    first = int(np.argmin(gutter))
+    best_start, best_length, run_start, run_length = 0, 0, 0, 0
+    for step in range(1, pitch + 1):
+        position = (first + step) % pitch
+        if gutter[position]:
+            if run_length == 0:
+                run_start = position
+            run_length += 1
+            if run_length > best_length:
+                best_start, best_length = run_start, run_length
+        else:
+            run_length = 0
+    return best_start, best_length
+
+
+def phase_candidates(profile, pitch):
+    """由格子之間的透明間隙找出第一格起點的候選 (0 <= offset < pitch)，較優先的在前
+
+    格子邊界落在間隙中 (含間隙結束後的第一個位置) 的任何位置都不會切到內容；
+    起點 0 落在這個範圍內時優先採用 0 (大多數 sheet 從左上角開始排列，
+    sprite 靠左上對齊時間隙位於格子尾端)，另以間隙中央作為候選
+    """
+    run = gutter_run(fold_profile(profile, pitch))
+    if run is None:
+        return [0]
+
+    start, length = run
+    center = (start + (length + 1) // 2) % pitch
+    if (0 - start) % pitch <= length and center != 0:
+        return [0, center]
+    return [center]
+
+
+def find_phase(profile, pitch):
+    """第一格的起點 (見 phase_candidates)"""
+    return phase_candidates(profile, pitch)[0]
+
+
+def grid_count(length, pitch, offset):
+    """從 offset 起的格子數，最後一格只被裁掉不到 COUNT_TOLERANCE 時也計入 (此時會超出圖片)"""
+    return int((length - offset) / pitch + COUNT_TOLERANCE)
+
+
+def boundary_content(profile, pitch, offset, count):
+    """格子邊界的平均內容 (相對於投影最大值)，邊界切過 sprite 時偏高
+
+    邊界位於兩個像素之間，任一側透明就不會切到 sprite (靠格子邊緣對齊的 sprite 不算)，
+    因此每條邊界取兩側的較小值；圖片邊緣上的邊界不列入
+    """
+    boundaries = offset + np.arange(count + 1) * pitch
+    boundaries = boundaries[(boundaries > 0) & (boundaries < len(profile))]
+    peak = profile.max()
+    if len(boundaries) == 0 or peak <= 0:
+        return 0.0
+    return float(np.minimum(profile[boundaries - 1], profile[boundaries]).mean() / peak)
+
+
+def choose_pitch(profile, exact_pitch, min_pitch):
+    """在擬合週期附近的整數中選出格子大小，回傳 (pitch, offset, count)
+
+    1. 排除 offset + count × pitch 超出圖片，或網格以外還有內容 (漏掉 sprite) 的候選
+    2. 只保留邊界最乾淨 (不切到 sprite) 的候選
+    3. 其中有剛好排滿圖片的候選時只考慮這些 (sprite 不一定置中，擬合週期可能偏離一個像素)
+    4. 取最接近擬合週期的 (同一週期的兩個起點都符合時取優先的)
+    """
+    length = len(profile)
+    center = int(round(exact_pitch))
+    total = profile.sum()
+    candidates = []
+    for pitch in range(max(center - PITCH_SEARCH, min_pitch), center + PITCH_SEARCH + 1):
+        for offset in phase_candidates(profile, pitch):
+            count = grid_count(length, pitch, offset)
+            end = offset + count * pitch
+            if count < 1 or end > length:
+                continue
+            if profile[:offset].sum() + profile[end:].sum() > OUTSIDE_TOLERANCE * total:
+                continue
+            candidates.append({
+                'pitch': pitch,
+                'offset': offset,
+                'count': count,
+                'boundary': boundary_content(profile, pitch, offset, count),
+                'remainder': length - offset - count * pitch,
+            })
+
+    if not candidates:
+        return None
+
+    cleanest = min(c['boundary'] for c in candidates)
+    candidates = [c for c in candidates if c['boundary'] <= cleanest + BOUNDARY_TOLERANCE]
+    filled = [c for c in candidates if c['remainder'] <= FILL_TOLERANCE * c['pitch']]
+    best = min(filled or candidates, key=lambda c: abs(c['pitch'] - exact_pitch))
+    return best['pitch'], best['offset'], best['count']
+
+
+def refine_pitch(ac, pitch, max_lag):
+    """以自相關在週期倍數附近的峰值做最小平方擬合，得到更精確的 (可為小數) 週期
+
+    sprite 內容寬度不一，單一峰值常偏離真實週期幾個像素，倍數越大相對誤差越小
+    """
+    window = max(pitch // 4, 1)
+    multiples, lags = [], []
+    for k in range(1, max_lag // pitch + 1):
+        start = max(k * pitch - window, 1)
+        stop = min(k * pitch + window + 1, max_lag + 1)
+        if stop <= start:
+            break
+        lag = start + int(np.argmax(ac[start:stop]))
+        if ac[lag] <= 0:
+            break
+        multiples.append(k)
+        lags.append(lag)
+        # 以目前的估計值修正下一個倍數的搜尋中心
+        pitch = max(int(round(np.dot(multiples, lags) / np.dot(multiples, multiples))), 1)
+
+    if not multiples:
+        return float(pitch)
+    return float(np.dot(multiples, lags) / np.dot(multiples, multiples))
+
+
+def infer_pitch(profile, min_pitch=8, max_pitch=None):
+    """推測一維投影的週期與相位
+
+    回傳 {'pitch', 'exact_pitch', 'offset', 'count', 'confidence'}，pitch 為四捨五入後的格子大小，
+    exact_pitch 為由多個倍數擬合的小數週期，offset 為第一格的起點 (0 <= offset < pitch，
+    且 offset + count × pitch 不超出投影長度)，
+    confidence 為該週期的正規化自相關 (0-1)；
+    找不到週期時 pitch 為整個長度、count 為 1、confidence 為 0
+    """
+    length = len(profile)
+    max_pitch = min(max_pitch or length // 2, length - 1)
+    fallback = {'pitch': length, 'exact_pitch': float(length), 'offset': 0, 'count': 1, 'confidence': 0.0}
+    if max_pitch < min_pitch:
+        return fallback
+
+    ac = autocorrelation(profile)
+    peaks = _local_maxima(ac[:max_pitch + 2])
+    peaks = peaks[(peaks >= min_pitch) & (peaks <= max_pitch) & (ac[peaks] > 0)]
+    if len(peaks) == 0:
+        return fallback
+
+    # 最高峰可能是基本週期的倍數，取最小且夠高的峰
+    best = ac[peaks].max()
+    peak = int(peaks[np.argmax(ac[peaks] >= HARMONIC_RATIO * best)])
+    exact_pitch = refine_pitch(ac, peak, length // 2)
+    chosen = choose_pitch(profile, exact_pitch, min_pitch)
+    if chosen is None:
+        return fallback
+
+    pitch, offset, count = chosen
+    confidence = float(ac[peak])
+    # 週期不明確時間隙也不可靠，不套用推測的偏移，從 0 起算
+    if confidence < MIN_PHASE_CONFIDENCE and offset:
+        offset, count = 0, length // pitch
+
+    return {
+        'pitch': pitch,
+        'exact_pitch': exact_pitch,
+        'offset': offset,
+        'count': count,
+        'confidence': confidence,
+    }
+
+
+def infer_grid(pixels, alpha_threshold=VISIBLE_ALPHA, min_cell=8):
+    """推測整張 sheet 的網格
+
+    回傳 {'grid': (cols, rows), 'cell_size': (w, h), 'offset': (x, y), 'confidence', 'columns', 'rows'}，
+    confidence 取兩個方向中較低者
+    """
+    col_profile, row_profile = alpha_projections(pixels, alpha_threshold)
+    columns = infer_pitch(col_profile, min_cell)
+    rows = infer_pitch(row_profile, min_cell)
+
+    return {
+        'grid': (columns['count'], rows['count']),
+        'cell_size': (columns['pitch'], rows['pitch']),
+        'offset': (columns['offset'], rows['offset']),
+        'confidence': min(columns['confidence'], rows['confidence']),
+        'columns': columns,
+        'rows': rows,
+    }
+
+
+def find_transitions(profile, threshold=0.3):
+    """投影中相鄰兩點變化超過門檻的位置 (變化後的索引)"""
+    return (np.flatnonzero(np.abs(np.diff(profile)) > threshold) + 1).tolist()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+逐幀點擊判定遮罩
+將每個使用中的 frame 的 alpha 以門檻二值化 (可選 2x 縮小)，裁切到內容邊界後以 np.packbits 壓成位元，
+全部串接成一個二進位檔並輸出以 frame 名稱索引的 JSON；
+遊戲端點擊判定只需查一個位元，不必在執行期讀取貼圖像素
+
+查詢方式 (x, y 為 frame 本地像素座標):
+  mx = floor(x / scale) - entry.x, my = floor(y / scale) - entry.y
+  超出 0 <= mx < entry.w、0 <= my < entry.h 即未命中，否則
+  byte = data[entry.offset + my * entry.stride + (mx >> 3)]
+  hit = (byte >> (7 - (mx & 7))) & 1
+"""
+
+import json
+import os
+import re
+import sys
+
+import numpy as np
+
+from build_manifest import is_up_to_date, load_manifest, record_output, save_manifest
+from cell_stats import cell_view
+from pixel_cache import load_pixels
+from stage_timer import profiled_run, timed
+
+SPRITE_SHEET = "../static/assets/tilesets/npc.png"
+STYLES_FILE = "../src/game/data/npcStyles.ts"
+GAME_CONFIG_FILE = "../src/game/config/gameConfig.json"
+OUTPUT_DIR = "../static/assets/data"
+OUTPUT_NAME = "npc_hitmasks"
+
+# alpha 超過此值才算可點擊 (半透明的邊緣與陰影不算)
+ALPHA_THRESHOLD = 127
+FORMAT_VERSION = 1
+
+
+def load_used_frames(styles_file=STYLES_FILE):
+    """由 npcStyles.ts 讀出所有樣式用到的幀 (各動作的 frames 與 defaultFrame)，檔案不存在時回傳 None"""
+    if not os.path.exists(styles_file):
+        return None
+
+    with open(styles_file, 'r', encoding='utf-8') as f:
+        source = f.read()
+
+    used = set()
+    for block in re.findall(r'frames:\s*\{([^}]*)\}', source):
+        for numbers in re.findall(r'\[([\d,\s]*)\]', block):
+            used.update(int(n) for n in re.findall(r'\d+', numbers))
+    used.update(int(n) for n in re.findall(r'defaultFrame:\s*(\d+)', source))
+    return sorted(used)
+
+
+def frame_alpha_masks(pixels, cols, rows, threshold=ALPHA_THRESHOLD, scale=1):
+    """回傳 (frames, h, w) 的布林遮罩，幀的順序與 row * cols + col 相同
+
+    scale=2 時以 2x2 區塊取「任一像素命中」縮小，寧可多判定命中也不要讓細小的邊緣點不到
+    """
+    cells = cell_view(pixels, cols, rows)
+    _, cell_height, _, cell_width, _ = cells.shape
+    masks = (cells[..., 3] > threshold).transpose(0, 2, 1, 3).reshape(rows * cols, cell_height, cell_width)
+
+    if scale > 1:
+        height, width = -(-cell_height // scale) * scale, -(-cell_width // scale) * scale
+        padded = np.zeros((len(masks), height, width), dtype=bool)
+        padded[:, :cell_height, :cell_width] = masks
+        masks = padded.reshape(len(masks), height // scale, scale, width // scale, scale).any(axis=(2, 4))
+
+    return masks
+
+
+def pack_hit_masks(masks, frame_ids, name_format="npc_{:03d}"):
+    """將指定幀的遮罩裁切到內容邊界並以位元打包 (每列 MSB 在前，列寬補齊到位元組)
+
+    回傳 (二進位資料, {frame 名稱: {frame, offset, x, y, w, h, stride}})，空白幀不列入
+    """
+    rows_any = masks.any(axis=2)
+    cols_any = masks.any(axis=1)
+
+    chunks, index, offset = [], {}, 0
+    for frame_id in frame_ids:
+        if frame_id >= len(masks) or not rows_any[frame_id].any():
+            continue
+
+        ys, xs = np.flatnonzero(rows_any[frame_id]), np.flatnonzero(cols_any[frame_id])
+        y, x = int(ys[0]), int(xs[0])
+        h, w = int(ys[-1]) - y + 1, int(xs[-1]) - x + 1
+
+        packed = np.packbits(masks[frame_id, y:y + h, x:x + w], axis=1)
+        chunks.append(packed.tobytes())
+        index[name_format.format(frame_id)] = {
+            'frame': int(frame_id),
+            'offset': offset,
+            'x': x, 'y': y, 'w': w, 'h': h,
+            'stride': int(packed.shape[1]),
+        }
+        offset += packed.size
+
+    return b''.join(chunks), index
+
+
+def hit_test(data, entry, x, y, scale=1):
+    """以打包後的遮罩判定 frame 本地座標 (x, y) 是否命中 (與遊戲端的查詢方式相同)"""
+    mx, my = int(x) // scale - entry['x'], int(y) // scale - entry['y']
+    if not (0 <= mx < entry['w'] and 0 <= my < entry['h']):
+        return False
+    byte = data[entry['offset'] + my * entry['stride'] + (mx >> 3)]
+    return bool((byte >> (7 - (mx & 7))) & 1)
+
+
+@timed('hit_masks.export')
+def export_hit_masks(image_path, frame_size, used_frames=None, scale=1, threshold=ALPHA_THRESHOLD,
+                     output_dir=OUTPUT_DIR, output_name=OUTPUT_NAME):
+    """輸出 <output_name>.bin 與索引 <output_name>.json，回傳索引內容
+
+    used_frames 為 None 時輸出所有非空白幀；網格由 frame_size (w, h) 與圖片尺寸決定
+    """
+    pixels = load_pixels(image_path)
+    frame_width, frame_height = frame_size
+    cols, rows = pixels.shape[1] // frame_width, pixels.shape[0] // frame_height
+
+    masks = frame_alpha_masks(pixels, cols, rows, threshold, scale)
+    frame_ids = range(cols * rows) if used_frames is None else used_frames
+    data, frames = pack_hit_masks(masks, frame_ids)
+
+    bin_path = os.path.join(output_dir, f"{output_name}.bin")
+    with open(bin_path, 'wb') as f:
+        f.write(data)
+
+    index = {
+        'version': FORMAT_VERSION,
+        'image': os.path.basename(image_path),
+        'file': os.path.basename(bin_path),
+        'frameSize': [frame_width, frame_height],
+        'scale': scale,
+        'threshold': threshold,
+        'bitOrder': 'msb',
+        'bytes': len(data),
+        'frames': frames,
+    }
+    with open(os.path.join(output_dir, f"{output_name}.json"), 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, separators=(',', ':'))
+
+    return index
+
+
+def parse_scale_option(argv):
+    """--downsample 或 --downsample=N (預設 2)，未指定時為 1"""
+    for arg in argv:
+        if arg == '--downsample':
+            return 2
+        if arg.startswith('--downsample='):
+            return int(arg.split('=', 1)[1])
+    return 1
+
+
+def build_hit_masks(manifest, argv=()):
+    """依命令列參數 (--downsample[=N]、--all) 建立點擊遮罩，輸入未變更時略過；回傳索引或 None"""
+    with open(GAME_CONFIG_FILE, 'r', encoding='utf-8') as f:
+        sheet = json.load(f)['assets']['npcSpriteSheet']
+    frame_size = (sheet['frameWidth'], sheet['frameHeight'])
+
+    scale = parse_scale_option(argv)
+    used_frames = None if '--all' in argv else load_used_frames()
+    index_path = os.path.join(OUTPUT_DIR, f"{OUTPUT_NAME}.json")
+    outputs = [index_path, os.path.join(OUTPUT_DIR, f"{OUTPUT_NAME}.bin")]
+    inputs = [SPRITE_SHEET, STYLES_FILE, GAME_CONFIG_FILE, __file__]
+    params = {'scale': scale, 'threshold': ALPHA_THRESHOLD, 'all': used_frames is None}
+
+    if all(is_up_to_date(manifest, path, inputs, params) for path in outputs):
+        print(f"⏭️ 輸入未變更，略過: {index_path}")
+        return None
+
+    if used_frames is None:
+        print("  使用所有非空白幀")
+    else:
+        print(f"  npcStyles.ts 使用 {len(used_frames)} 個幀")
+
+    index = export_hit_masks(SPRITE_SHEET, frame_size, used_frames, scale)
+    for path in outputs:
+        record_output(manifest, path, inputs, params)
+
+    print(f"  {len(index['frames'])} 個幀，{index['bytes']} bytes (縮小 {scale}x)")
+    print(f"💾 點擊遮罩已保存到: {os.path.join(OUTPUT_DIR, index['file'])}、{index_path}")
+    return index
+
+
+def main():
+    """主函數"""
+    print("🎯 建立 NPC 點擊判定遮罩...")
+
+    manifest = load_manifest()
+    build_hit_masks(manifest, sys.argv[1:])
+    save_manifest(manifest)
+    return 0
+
+
+if __name__ == "__main__":
+    with profiled_run('hit_masks'):
+        status = main()
+    sys.exit(status)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+NPC 自動擺放
+由背景的地板遮罩產生候選腳底位置，依地板比例由高到低貪婪擺放名單中的角色；
+以網格空間雜湊只檢查鄰近格子的已擺放角色，確保最小間距與對話氣泡淨空，
+數百個角色也只需線性時間
+"""
+
+import json
+import math
+import os
+import sys
+
+from analyze_office_layout import compute_floor_mask, find_floor_candidates
+from build_manifest import is_up_to_date, load_manifest, record_output, save_manifest
+from pixel_cache import load_pixels
+from stage_timer import profiled_run
+
+GAME_CONFIG_FILE = "../src/game/config/gameConfig.json"
+CHARACTERS_FILE = "../static/assets/data/characters.json"
+NPCS_FILE = "../static/assets/data/npcs.json"
+BACKGROUND_DIR = "../static/assets"
+OUTPUT_FILE = "../static/assets/data/npc_placements.json"
+
+# DialogueBubble 的大約尺寸，用來檢查氣泡是否會蓋住其他角色
+BUBBLE_WIDTH = 240
+BUBBLE_HEIGHT = 80
+
+
+def load_placement_config(config_file=GAME_CONFIG_FILE, min_spacing=64, footprint=32, stride=16):
+    """由 gameConfig.json 讀取精靈尺寸、對話氣泡偏移與邊界，組成擺放參數"""
+    with open(config_file, 'r', encoding='utf-8') as f:
+        game_config = json.load(f)
+
+    sheet = game_config['assets']['npcSpriteSheet']
+    standing = game_config['dialogue']['standing']
+
+    return {
+        'background': game_config['assets']['background']['file'],
+        'sprite_size': (sheet['frameWidth'], sheet['frameHeight']),
+        # 與 NPC.showDialogue + resolveStandingBubbleOffset 相同: 氣泡中心在腳底上方這個距離
+        'bubble_rise': sheet['frameHeight'] - standing['baseOffsetY'] - standing['extraOffsetY'],
+        'bubble_size': (BUBBLE_WIDTH, BUBBLE_HEIGHT),
+        'bounds': game_config['dialogue']['bounds'],
+        'min_spacing': min_spacing,
+        'footprint': footprint,
+        'stride': stride,
+    }
+
+
+def load_roster(characters_file=CHARACTERS_FILE, npcs_file=NPCS_FILE):
+    """合併 characters.json 與 npcs.json 的角色名單，同一 id 只保留一筆
+
+    回傳 [{'id', 'name', 'x', 'y'}]，手動擺放過的角色保留原本座標，否則為 None
+    """
+    roster = {}
+
+    if os.path.exists(characters_file):
+        with open(characters_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        placed = {npc['characterId']: npc for npc in data.get('standingNpcs', []) + data.get('hotspotNpcs', [])}
+        for character in data.get('characters', []):
+            existing = placed.get(character['id'], {})
+            roster[character['id']] = {
+                'id': character['id'],
+                'name': character['name'],
+                'x': existing.get('x'),
+                'y': existing.get('y'),
+            }
+
+    if os.path.exists(npcs_file):
+        with open(npcs_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        for npc in data.get('npcs', []):
+            roster.setdefault(npc['id'], {
+                'id': npc['id'],
+                'name': npc['name'],
+                'x': npc.get('x'),
+                'y': npc.get('y'),
+            })
+
+    return list(roster.values())
+
+
+def candidate_positions(floor_mask, config):
+    """地板遮罩中可作為腳底位置的候選點，依地板比例由高到低排序
+
+    候選點必須讓對話氣泡完全落在 dialogue.bounds 內 (不被 computeBubblePosition 夾住)
+    """
+    candidates = find_floor_candidates(floor_mask, (config['footprint'],), stride=config['stride'], top_k=None)
+    xs, ys = candidates['x'], candidates['y'] + config['footprint'] // 2
+
+    bounds = config['bounds']
+    bubble_top = ys - config['bubble_rise'] - config['bubble_size'][1] // 2
+    keep = (xs >= bounds['minX']) & (xs <= bounds['maxX']) & (bubble_top >= bounds['minY'])
+
+    return {
+        'x': xs[keep],
+        'y': ys[keep],
+        'floor_ratio': candidates['floor_ratio'][keep],
+    }
+
+
+def _rects_overlap(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def _body_rect(x, y, config):
+    width, height = config['sprite_size']
+    return (x - width / 2, y - height, x + width / 2, y)
+
+
+def _bubble_rect(x, y, config):
+    width, height = config['bubble_size']
+    center_y = y - config['bubble_rise']
+    return (x - width / 2, center_y - height / 2, x + width / 2, center_y + height / 2)
+
+
+def _conflicts(x, y, other, config):
+    """兩個角色是否太近，或其中一方的對話氣泡會蓋住另一方"""
+    ox, oy = other
+    if math.hypot(x - ox, y - oy) < config['min_spacing']:
+        return True
+    return (_rects_overlap(_bubble_rect(x, y, config), _body_rect(ox, oy, config)) or
+            _rects_overlap(_bubble_rect(ox, oy, config), _body_rect(x, y, config)))
+
+
+class SpatialHash:
+    """以固定大小格子索引已擺放的位置，查詢只看周圍 3x3 格"""
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}
+
+    def _cell(self, x, y):
+        return int(x // self.cell_size), int(y // self.cell_size)
+
+    def insert(self, x, y):
+        self.cells.setdefault(self._cell(x, y), []).append((x, y))
+
+    def nearby(self, x, y):
+        cx, cy = self._cell(x, y)
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                yield from self.cells.get((cx + dx, cy + dy), ())
+
+
+def _interaction_range(config):
+    """兩個角色可能互相衝突的最大距離，作為空間雜湊的格子大小"""
+    sprite_w, _ = config['sprite_size']
+    bubble_w, bubble_h = config['bubble_size']
+    reach_x = (bubble_w + sprite_w) / 2
+    reach_y = config['bubble_rise'] + bubble_h / 2
+    return math.ceil(max(config['min_spacing'], reach_x, reach_y))
+
+
+def solve_placements(floor_mask, roster, config, keep_existing=False):
+    """為名單中的角色擺放位置
+
+    keep_existing=True 時已有座標的角色維持原位並作為障礙，其餘角色依序取用最佳的可用候選點
+    回傳 {'placements': [{'id', 'name', 'x', 'y', 'floor_ratio'}], 'unplaced': [id, ...]}
+    """
+    index = SpatialHash(_interaction_range(config))
+    placements = []
+    pending = []
+
+    for entry in roster:
+        if keep_existing and entry['x'] is not None and entry['y'] is not None:
+            index.insert(entry['x'], entry['y'])
+            placements.append({'id': entry['id'], 'name': entry['name'],
+                               'x': entry['x'], 'y': entry['y'], 'floor_ratio': None})
+        else:
+            pending.append(entry)
+
+    candidates = candidate_positions(floor_mask, config)
+    pending_iter = iter(pending)
+    entry = next(pending_iter, None)
+
+    for x, y, ratio in zip(candidates['x'].tolist(), candidates['y'].tolist(),
+                           candidates['floor_ratio'].tolist()):
+        if entry is None:
+            break
+        if any(_conflicts(x, y, other, config) for other in index.nearby(x, y)):
+            continue
+
+        index.insert(x, y)
+        placements.append({'id': entry['id'], 'name': entry['name'], 'x': x, 'y': y,
+                           'floor_ratio': round(ratio, 4)})
+        entry = next(pending_iter, None)
+
+    unplaced = ([entry['id']] if entry is not None else []) + [rest['id'] for rest in pending_iter]
+    return {'placements': placements, 'unplaced': unplaced}
+
+
+def main():
+    """主函數"""
+    print("🧭 開始自動擺放 NPC...")
+
+    keep_existing = '--keep-existing' in sys.argv
+    config = load_placement_config()
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    background = args[0] if args else os.path.join(BACKGROUND_DIR, config['background'])
+
+    inputs = [background, GAME_CONFIG_FILE, CHARACTERS_FILE, NPCS_FILE, __file__]
+    params = {'keep_existing': keep_existing}
+    manifest = load_manifest()
+    if is_up_to_date(manifest, OUTPUT_FILE, inputs, params):
+        print(f"⏭️ 輸入未變更，略過: {OUTPUT_FILE}")
+        return
+
+    pixels = load_pixels(background, mode=None)
+    floor_mask = compute_floor_mask(pixels)['mask']
+    roster = load_roster()
+
+    result = solve_placements(floor_mask, roster, config, keep_existing)
+    print(f"✅ 已擺放 {len(result['placements'])}/{len(roster)} 個角色")
+    if result['unplaced']:
+        print(f"⚠️  沒有足夠空間的角色: {', '.join(result['unplaced'])}")
+
+    output = {
+        'background': os.path.basename(background),
+        'size': [int(pixels.shape[1]), int(pixels.shape[0])],
+        'min_spacing': config['min_spacing'],
+        **result,
+    }
+    with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
+        json.dump(output, f, indent=2, ensure_ascii=False)
+    record_output(manifest, OUTPUT_FILE, inputs, params)
+    save_manifest(manifest)
+
+    print(f"💾 擺放結果已保存到: {OUTPUT_FILE}")
+
+
+if __name__ == "__main__":
+    with profiled_run('npc_placement'):
+        main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+解碼後像素快取
+每張圖片只解碼一次，原始像素以 .npy 存在快取目錄，之後以唯讀 memory-map 零拷貝載入
+快取鍵 = 檔案內容雜湊 + mtime，圖片一旦變更就會重新解碼
+"""
+
+import contextlib
+import hashlib
+import os
+import tempfile
+
+from PIL import Image
+import numpy as np
+
+from stage_timer import stage
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CACHE_DIR = os.path.join(TOOLS_DIR, '.cache', 'pixels')
+
+# 寫入快取時每次處理的列數
+STRIP_HEIGHT = 256
+
+
+def _cache_key(image_path, mode):
+    """由檔案內容與 mtime 計算快取鍵"""
+    digest = hashlib.sha256()
+    with open(image_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    digest.update(str(os.stat(image_path).st_mtime_ns).encode())
+    digest.update((mode or 'native').encode())
+    return digest.hexdigest()[:24]
+
+
+def _cache_prefix(image_path, mode):
+    """同一來源檔案的快取檔名前綴，用來清除過期的快取"""
+    path_hash = hashlib.sha1(os.path.abspath(image_path).encode()).hexdigest()[:8]
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    return f"{stem}-{path_hash}-{mode or 'native'}-"
+
+
+def decode_pixels(image_path, mode='RGBA'):
+    """直接解碼圖片為 NumPy 陣列 (不經過快取)
+
+    mode=None 時保留圖片原始色彩模式
+    """
+    with stage('image.open', image=os.path.basename(image_path)), Image.open(image_path) as img:
+        if mode is not None and img.mode != mode:
+            with stage('image.convert', mode=mode):
+                img = img.convert(mode)
+        with stage('image.decode'):
+            return np.asarray(img)
+
+
+def _write_pixels_in_strips(image_path, mode, output_path, strip_height=STRIP_HEIGHT):
+    """將解碼結果逐條寫入 .npy，不在記憶體中另外建立整張陣列的副本"""
+    with stage('image.open', image=os.path.basename(image_path)), Image.open(image_path) as img:
+        if mode is not None and img.mode != mode:
+            with stage('image.convert', mode=mode):
+                img = img.convert(mode)
+
+        width, height = img.size
+        first = np.asarray(img.crop((0, 0, width, min(strip_height, height))))
+        target = np.lib.format.open_memmap(
+            output_path, mode='w+', dtype=first.dtype, shape=(height,) + first.shape[1:]
+        )
+        target[:first.shape[0]] = first
+
+        with stage('image.decode', strips=-(-height // strip_height)):
+            for top in range(strip_height, height, strip_height):
+                bottom = min(top + strip_height, height)
+                target[top:bottom] = np.asarray(img.crop((0, top, width, bottom)))
+
+            target.flush()
+        del target
+
+
+def load_pixels(image_path, mode='RGBA', cache_dir=None):
+    """載入圖片像素，回傳唯讀的 memory-mapped 陣列
+
+    第一次呼叫時解碼並寫入快取，之後直接 memory-map 快取檔
+    mode=None 時保留圖片原始色彩模式 (例如調色盤圖片的索引值)
+    """
+    with stage('pixels.load', image=os.path.basename(image_path)):
+        return _load_pixels(image_path, mode, cache_dir or DEFAULT_CACHE_DIR)
+
+
+def _load_pixels(image_path, mode, cache_dir):
+    prefix = _cache_prefix(image_path, mode)
+    with stage('pixels.cache_key'):
+        cache_path = os.path.join(cache_dir, prefix + _cache_key(image_path, mode) + '.npy')
+
+    if os.path.exists(cache_path):
+        try:
+            return np.load(cache_path, mmap_mode='r')
+        except (OSError, ValueError):
+            # 快取檔損壞，重新解碼 (同時執行的另一個行程可能已經刪掉)
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(cache_path)
+
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # 先寫入暫存檔再改名，避免中斷時留下不完整的快取
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.npy.tmp')
+    os.close(fd)
+    try:
+        _write_pixels_in_strips(image_path, mode, tmp_path)
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    try:
+        pixels = np.load(cache_path, mmap_mode='r')
+    except FileNotFoundError:
+        # 圖片在執行期間被修改時，另一個行程會把這份快取當成舊快取刪除，直接使用解碼結果
+        pixels = decode_pixels(image_path, mode)
+
+    # 清除同一來源的舊快取；其他行程 (同時執行的 CLI / 批次分析) 可能正在清除同一批檔案
+    for name in os.listdir(cache_dir):
+        if name.startswith(prefix) and name.endswith('.npy') and \
+                os.path.join(cache_dir, name) != cache_path:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(cache_dir, name))
+
+    return pixels
+
+
+def clear_cache(cache_dir=None):
+    """清除所有像素快取，回傳刪除的檔案數"""
+    cache_dir = cache_dir or DEFAULT_CACHE_DIR
+    if not os.path.isdir(cache_dir):
+        return 0
+
+    removed = 0
+    for name in os.listdir(cache_dir):
+        if name.endswith('.npy') or name.endswith('.npy.tmp'):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(cache_dir, name))
+                removed += 1
+    return removed
@@ -8,6 +8,12 @@ from PIL import Image
 import numpy as np
 import json
 
+from color_histogram import color_histogram, palette_stats
+from grid_inference import find_transitions, infer_grid
+from pixel_cache import load_pixels
+from stage_timer import profiled_run
+from summed_area import build_alpha_index, divisor_grids, score_grid_hypotheses
+
 def analyze_true_structure():
     """重新分析 npc-in.png 的真實結構"""
     
@@ -20,10 +26,8 @@ def analyze_true_structure():
         print(f"  尺寸: {width}x{height}")
         print(f"  模式: {img.mode}")
         
-        if img.mode != 'RGBA':
-            img = img.convert('RGBA')
-        
-        img_array = np.array(img)
+        # 解碼結果走快取，轉成 RGBA 確保有透明度信息
+        img_array = load_pixels("../static/assets/tilesets/npc-in.png")
         
         # 分析透明度分佈
         alpha_channel = img_array[:, :, 3]
@@ -79,17 +83,14 @@ def analyze_transparency_pattern(alpha_channel, width, height):
 
 def find_edges(transparency_line):
     """找出透明度變化的邊界"""
-    edges = []
-    threshold = 0.3  # 透明度變化閾值
-    
-    for i in range(1, len(transparency_line)):
-        if abs(transparency_line[i] - transparency_line[i-1]) > threshold:
-            edges.append(i)
-    
-    return edges
+    return find_transitions(transparency_line, threshold=0.3)  # 透明度變化閾值
+
+def test_different_grid_assumptions(img_array, width, height, sweep_divisors=False, alpha_index=None):
+    """測試不同的網格假設
 
-def test_different_grid_assumptions(img_array, width, height):
-    """測試不同的網格假設"""
+    sweep_divisors=True 時改為掃描所有能整除圖片尺寸的網格
+    alpha_index 可傳入已建好的積分圖以免重建
+    """
     
     print(f"\n🔍 測試不同網格假設:")
     
@@ -110,48 +111,23 @@ def test_different_grid_assumptions(img_array, width, height):
         (8, 6), (6, 8),  # 8x6 或 6x8
     ]
     
-    alpha_channel = img_array[:, :, 3]
-    best_grids = []
+    if sweep_divisors:
+        possible_grids = divisor_grids(width, height)
     
-    for cols, rows in possible_grids:
-        if width % cols != 0 or height % rows != 0:
-            continue  # 跳過不能整除的網格
-            
-        cell_width = width // cols
-        cell_height = height // rows
-        
-        # 分析這個網格的內容分佈
-        content_cells = 0
-        total_coverage = 0
-        
-        for row in range(rows):
-            for col in range(cols):
-                x1 = col * cell_width
-                y1 = row * cell_height
-                x2 = x1 + cell_width
-                y2 = y1 + cell_height
-                
-                cell_alpha = alpha_channel[y1:y2, x1:x2]
-                coverage = np.sum(cell_alpha > 0) / (cell_width * cell_height)
-                
-                if coverage > 0.1:  # 10%以上有內容
-                    content_cells += 1
-                    total_coverage += coverage
-        
-        if content_cells > 0:
-            avg_coverage = total_coverage / content_cells
-            grid_score = content_cells * avg_coverage  # 綜合評分
-            
-            best_grids.append({
-                'grid': (cols, rows),
-                'cell_size': (cell_width, cell_height),
-                'content_cells': content_cells,
-                'avg_coverage': avg_coverage,
-                'score': grid_score
-            })
-    
-    # 按評分排序
-    best_grids.sort(key=lambda x: x['score'], reverse=True)
+    # 由 alpha 投影的自相關直接推測網格，尺寸不能整除也適用
+    inferred = infer_grid(img_array)
+    print(f"  📐 自動推測網格: {inferred['grid'][0]}x{inferred['grid'][1]} "
+          f"({inferred['cell_size'][0]}x{inferred['cell_size'][1]} 每格, "
+          f"偏移 {inferred['offset']}, 信心 {inferred['confidence']:.2f})")
+    if inferred['grid'] not in possible_grids:
+        possible_grids = [inferred['grid']] + possible_grids
+    
+    # 積分圖只建一次，每個網格假設的評分都是 O(1) 查詢
+    if alpha_index is None:
+        alpha_index = build_alpha_index(img_array)
+    
+    # 不能整除的網格以 width // cols 切格，右側/下方的邊緣不計入
+    best_grids = score_grid_hypotheses(alpha_index, possible_grids, min_coverage=0.1)
     
     print(f"  🏆 最佳網格候選 (前5個):")
     for i, grid_info in enumerate(best_grids[:5]):
@@ -171,23 +147,19 @@ def analyze_content_distribution(img_array, width, height):
     
     print(f"\n🎨 內容分佈分析:")
     
-    rgb_data = img_array[:, :, :3]
     alpha_data = img_array[:, :, 3]
     
     # 只分析有內容的像素
     content_mask = alpha_data > 0
-    if np.sum(content_mask) == 0:
+    histogram = color_histogram(img_array, mask=content_mask)
+    if histogram['total'] == 0:
         print("  ⚠️ 沒有找到有內容的像素")
         return
     
-    content_pixels = rgb_data[content_mask]
-    
-    # 分析顏色分佈
-    mean_color = np.mean(content_pixels, axis=0)
-    color_std = np.std(content_pixels, axis=0)
-    
-    print(f"  平均顏色: RGB({mean_color[0]:.0f}, {mean_color[1]:.0f}, {mean_color[2]:.0f})")
-    print(f"  顏色變異: RGB({color_std[0]:.0f}, {color_std[1]:.0f}, {color_std[2]:.0f})")
+    # 分析顏色分佈 (精確調色盤)
+    stats = palette_stats(histogram, top=3)
+    print(f"  不同顏色數: {stats['color_count']}")
+    print(f"  主要顏色: " + ", ".join(f"{c['color']} ({c['ratio']:.1%})" for c in stats['dominant']))
     
     # 分析內容的空間分佈
     content_y, content_x = np.where(content_mask)
@@ -252,4 +224,5 @@ def main():
         print(f"\n❌ 分析失敗，需要手動檢查圖片內容")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with profiled_run('reanalyze_npc_in'):
+        main()
\ No newline at end of file
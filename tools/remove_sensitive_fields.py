@@ -2,60 +2,225 @@
 """
 移除 characters.json 中的敏感欄位 (personality, introduction)
 避免在前端暴露角色性格設定
+
+以串流方式逐筆讀取角色，只保留允許清單中的欄位，記憶體用量與角色數量無關；
+輸出先寫入同目錄的暫存檔再改名，中途失敗不會留下寫到一半的 characters.json
 """
 
 import json
 import os
+import shutil
+import sys
+import tempfile
+from collections import Counter
+
+# 前端需要的角色欄位，其餘欄位 (personality, introduction…) 一律移除
+ALLOWED_FIELDS = ('id', 'name', 'position', 'dialogue')
+# 需要做欄位投影的頂層陣列
+PROJECTED_KEYS = ('characters',)
+
+READ_SIZE = 1 << 16
+INDENT = 4
+
+
+class JsonStreamReader:
+    """以固定大小的緩衝區逐段讀取 JSON，每次只解碼一個值 (例如陣列中的一筆記錄)"""
+
+    def __init__(self, f, read_size=READ_SIZE):
+        self.f = f
+        self.read_size = read_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        """丟掉已消耗的內容並讀入下一段，已到檔尾時回傳 False"""
+        if self.eof:
+            return False
+        chunk = self.f.read(self.read_size)
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        self.eof = not chunk
+        return bool(chunk)
+
+    def peek(self):
+        """略過空白並回傳下一個字元，檔尾時回傳空字串"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self._fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"JSON 格式錯誤: 預期 {char!r}，實際為 {found or '檔尾'!r}")
+        self.pos += 1
+
+    def read_value(self):
+        """解碼下一個完整的 JSON 值；值跨越緩衝區邊界時補讀後重試"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # 數字停在緩衝區結尾或停在不完整的小數/指數 (例如 "-0." 之後被切斷) 時可能還沒讀完
+            truncated = end == len(self.buffer) or \
+                (isinstance(value, (int, float)) and self.buffer[end] in '.eE+-')
+            if truncated and self._fill():
+                continue
+            self.pos = end
+            return value
+
+
+_encode_scalar = json.JSONEncoder(ensure_ascii=False).encode
+
+
+def _dump(value, level):
+    """與 json.dump(indent=4, ensure_ascii=False) 相同的格式，level 為所在的縮排層級
+
+    縮排由這裡遞迴處理，純量交給 C 實作的編碼器 (json 指定 indent 時會退回較慢的純 Python 編碼器)
+    """
+    if isinstance(value, dict) and value:
+        pad = '\n' + ' ' * (INDENT * (level + 1))
+        items = ','.join(pad + _encode_scalar(key) + ': ' + _dump(item, level + 1) for key, item in value.items())
+        return '{' + items + '\n' + ' ' * (INDENT * level) + '}'
+    if isinstance(value, list) and value:
+        pad = '\n' + ' ' * (INDENT * (level + 1))
+        items = ','.join(pad + _dump(item, level + 1) for item in value)
+        return '[' + items + '\n' + ' ' * (INDENT * level) + ']'
+    return _encode_scalar(value)
+
+
+def project_fields(record, fields=ALLOWED_FIELDS):
+    """只保留允許的欄位 (維持原本的欄位順序)，回傳 (新記錄, 移除的欄位名稱)"""
+    kept = {key: value for key, value in record.items() if key in fields}
+    return kept, [key for key in record if key not in fields]
+
 
-def remove_sensitive_fields(input_file, output_file):
+def _stream_array(reader, out, level, transform=None):
+    """逐筆讀取陣列並寫出，transform 可在寫出前改寫每一筆"""
+    reader.expect('[')
+    if reader.peek() == ']':
+        reader.pos += 1
+        out.write('[]')
+        return 0
+
+    item_indent = '\n' + ' ' * (INDENT * (level + 1))
+    count = 0
+    while True:
+        item = reader.read_value()
+        if transform is not None:
+            item = transform(item)
+        out.write(('[' if count == 0 else ',') + item_indent + _dump(item, level + 1))
+        count += 1
+
+        if reader.peek() == ']':
+            reader.pos += 1
+            break
+        reader.expect(',')
+
+    out.write('\n' + ' ' * (INDENT * level) + ']')
+    return count
+
+
+def stream_project(input_file, output_file, fields=ALLOWED_FIELDS, projected_keys=PROJECTED_KEYS):
+    """串流讀取 characters.json，將指定頂層陣列中的每筆記錄投影到允許的欄位
+
+    其他頂層欄位 (standingNpcs、hotspotNpcs…) 原樣保留，陣列同樣逐筆串流；
+    輸出格式與 json.dump(indent=4, ensure_ascii=False) 相同
+    回傳 {'records': 投影的記錄數, 'removed': Counter(欄位名稱: 移除次數), 'trimmed': 有移除欄位的記錄數}
     """
-    從 characters.json 移除 personality 和 introduction 欄位
+    stats = {'records': 0, 'removed': Counter(), 'trimmed': 0}
+
+    def project(record):
+        if not isinstance(record, dict):
+            return record
+        kept, removed = project_fields(record, fields)
+        stats['records'] += 1
+        if removed:
+            stats['trimmed'] += 1
+            stats['removed'].update(removed)
+        return kept
+
+    output_dir = os.path.dirname(os.path.abspath(output_file))
+    fd, tmp_path = tempfile.mkstemp(dir=output_dir, suffix='.json.tmp')
+    try:
+        with open(input_file, 'r', encoding='utf-8') as f_in, \
+                os.fdopen(fd, 'w', encoding='utf-8') as out:
+            reader = JsonStreamReader(f_in)
+            reader.expect('{')
+            out.write('{')
+
+            first = True
+            while reader.peek() != '}':
+                if not first:
+                    reader.expect(',')
+                key = reader.read_value()
+                reader.expect(':')
+                out.write(('' if first else ',') + '\n' + ' ' * INDENT + json.dumps(key, ensure_ascii=False) + ': ')
+                first = False
+
+                if reader.peek() == '[':
+                    _stream_array(reader, out, 1, project if key in projected_keys else None)
+                else:
+                    out.write(_dump(reader.read_value(), 1))
+
+            reader.expect('}')
+            out.write('}' if first else '\n}')
+
+        # 暫存檔與原檔案權限一致
+        if os.path.exists(output_file):
+            shutil.copymode(output_file, tmp_path)
+        os.replace(tmp_path, output_file)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return stats
+
+
+def remove_sensitive_fields(input_file, output_file, fields=ALLOWED_FIELDS):
+    """
+    從 characters.json 移除允許清單以外的欄位 (personality、introduction…)
     """
     print(f"讀取檔案: {input_file}")
+    print(f"寫入檔案: {output_file}")
+
+    stats = stream_project(input_file, output_file, fields)
+
+    print(f"\n✅ 完成！共處理 {stats['records']} 個角色，其中 {stats['trimmed']} 個移除了欄位")
+    print(f"   保留欄位: {', '.join(fields)}")
+    if stats['removed']:
+        removed = ', '.join(f"{name} ({count})" for name, count in stats['removed'].most_common())
+        print(f"   移除欄位: {removed}")
+
+    return stats
 
-    with open(input_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-
-    # 移除每個角色的 personality 和 introduction 欄位
-    removed_count = 0
-    for character in data.get('characters', []):
-        fields_removed = []
-        if 'personality' in character:
-            del character['personality']
-            fields_removed.append('personality')
-        if 'introduction' in character:
-            del character['introduction']
-            fields_removed.append('introduction')
-
-        if fields_removed:
-            removed_count += 1
-            print(f"  ✓ {character['name']} ({character['id']}): 移除 {', '.join(fields_removed)}")
-
-    # 寫入檔案
-    print(f"\n寫入檔案: {output_file}")
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
-
-    print(f"\n✅ 完成！共處理 {removed_count} 個角色")
-    print(f"   保留欄位: id, name, position, dialogue")
-    print(f"   移除欄位: personality, introduction")
 
 if __name__ == '__main__':
     # 檔案路徑
     script_dir = os.path.dirname(os.path.abspath(__file__))
     project_root = os.path.dirname(script_dir)
 
-    input_file = os.path.join(project_root, 'static/assets/data/characters.json')
-    output_file = input_file  # 直接覆蓋原檔案
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    input_file = args[0] if args else os.path.join(project_root, 'static/assets/data/characters.json')
+    output_file = args[1] if len(args) > 1 else input_file  # 預設直接覆蓋原檔案
 
-    # 備份原檔案
-    backup_file = input_file + '.backup'
-    print(f"📦 建立備份: {backup_file}")
-    with open(input_file, 'r', encoding='utf-8') as f_in:
-        with open(backup_file, 'w', encoding='utf-8') as f_out:
-            f_out.write(f_in.read())
+    # 備份原檔案 (逐段複製，不整個讀入記憶體)
+    backup_file = None
+    if os.path.abspath(output_file) == os.path.abspath(input_file) and '--no-backup' not in sys.argv:
+        backup_file = input_file + '.backup'
+        print(f"📦 建立備份: {backup_file}")
+        shutil.copy2(input_file, backup_file)
 
     # 處理檔案
     remove_sensitive_fields(input_file, output_file)
 
-    print(f"\n💡 提示: 如需還原，備份檔案位於: {backup_file}")
+    if backup_file:
+        print(f"\n💡 提示: 如需還原，備份檔案位於: {backup_file}")
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+單張大 sheet 的列帶 (row band) 平行處理
+將網格依格子列切成連續的列帶，每個列帶以執行緒池處理整張 sheet 的一段零拷貝切片 (唯讀共用)，
+各自產生結果陣列後依列帶順序合併；NumPy 的縮減運算會釋放 GIL，多核心可同時計算
+
+小圖切分的額外成本大於收益，只有每個列帶至少有 MIN_BAND_PIXELS 像素時才會平行
+"""
+
+import concurrent.futures
+import os
+
+from stage_timer import stage
+
+# 每個列帶的最少像素數 (約 1024² RGBA，切得更細時執行緒排程的成本會蓋過計算)
+MIN_BAND_PIXELS = 1 << 20
+
+
+def default_threads():
+    """DTA_THREADS 環境變數，或可用的 CPU 數 (遵守 CPU affinity)"""
+    env = os.environ.get('DTA_THREADS')
+    if env:
+        return max(1, int(env))
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def row_bands(rows, band_count):
+    """將 rows 個格子列盡量平均地切成 band_count 段，回傳 [(start, stop), ...]"""
+    band_count = max(1, min(band_count, rows))
+    bounds = [rows * i // band_count for i in range(band_count + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def plan_bands(rows, row_pixels, threads=None):
+    """依執行緒數與每列像素數決定列帶，row_pixels 為一整列格子的像素數 (cell_h * 圖寬)"""
+    threads = threads or default_threads()
+    by_size = (rows * row_pixels) // MIN_BAND_PIXELS
+    return row_bands(rows, max(1, min(threads, by_size)))
+
+
+def map_row_bands(func, rows, row_pixels, threads=None, name='band'):
+    """對每個列帶呼叫 func(start, stop)，回傳依列帶順序排列的結果列表
+
+    只有一個列帶時直接在目前執行緒執行；每個列帶各記錄一個 stage，方便在 trace 中檢視平行程度
+    """
+    bands = plan_bands(rows, row_pixels, threads)
+
+    def run(band):
+        start, stop = band
+        with stage(f'{name}.band', rows=f'{start}-{stop}'):
+            return func(start, stop)
+
+    if len(bands) == 1:
+        return [run(bands[0])]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(bands)) as executor:
+        return list(executor.map(run, bands))
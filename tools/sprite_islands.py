@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+不規則 sprite sheet 的連通區塊偵測
+以 alpha 通道的水平遊程 (run) 做 8 連通標記: 相鄰列重疊的遊程配對一次以 searchsorted 找出，
+再以 np.minimum.at + 指標跳躍做向量化的 union-find；
+找出每個 sprite 島嶼、合併距離很近的島嶼 (例如分離的頭髮、陰影)，輸出每個 sprite 的矩形圖集
+"""
+
+import json
+import os
+import sys
+
+import numpy as np
+
+from build_manifest import is_up_to_date, load_manifest, record_output, save_manifest
+from pixel_cache import load_pixels
+from stage_timer import profiled_run
+
+OUTPUT_DIR = "../static/assets/data"
+
+
+def find_runs(mask):
+    """回傳每列內容的水平遊程 (rows, starts, ends)，ends 為包含的最後一個像素，依 (row, start) 排序"""
+    height, width = mask.shape
+    padded = np.zeros((height, width + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    change = np.diff(padded, axis=1)
+
+    start_rows, starts = np.nonzero(change == 1)
+    _, ends = np.nonzero(change == -1)
+    return start_rows, starts, ends - 1
+
+
+def _overlapping_run_pairs(rows, starts, ends, width):
+    """找出相鄰兩列中 8 連通 (含斜角) 的遊程配對，回傳 (上方遊程索引, 下方遊程索引)"""
+    stride = width + 2
+    start_keys = rows.astype(np.int64) * stride + starts
+    end_keys = rows.astype(np.int64) * stride + ends
+
+    # 下方遊程 b 與上一列遊程 a 連通: a.end >= b.start - 1 且 a.start <= b.end + 1
+    query_row = (rows.astype(np.int64) - 1) * stride
+    first = np.searchsorted(end_keys, query_row + starts - 1, side='left')
+    last = np.searchsorted(start_keys, query_row + ends + 1, side='right')
+    counts = np.maximum(last - first, 0)
+
+    below = np.repeat(np.arange(len(rows)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    above = np.repeat(first, counts) + offsets
+    return above, below
+
+
+def union_labels(count, pairs_a, pairs_b):
+    """向量化 union-find: 反覆以 np.minimum.at 傳播較小的標籤並做指標跳躍，直到不再變化
+
+    回傳每個元素的根標籤 (群組中最小的索引)
+    """
+    labels = np.arange(count)
+    if len(pairs_a) == 0:
+        return labels
+
+    while True:
+        smaller = np.minimum(labels[pairs_a], labels[pairs_b])
+        before = labels.copy()
+        np.minimum.at(labels, labels[pairs_a], smaller)
+        np.minimum.at(labels, labels[pairs_b], smaller)
+
+        # 指標跳躍直到每個元素都直接指向根
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+
+        if np.array_equal(labels, before):
+            return labels
+
+
+def _boxes_by_label(labels, x_min, y_min, x_max, y_max, pixels):
+    """依標籤彙總邊界框與像素數，回傳 (唯一標籤, boxes (N, 4), 像素數)"""
+    roots, inverse = np.unique(labels, return_inverse=True)
+    count = len(roots)
+    boxes = np.empty((count, 4), dtype=np.int64)
+    boxes[:, 0] = np.iinfo(np.int64).max
+    boxes[:, 1] = np.iinfo(np.int64).max
+    boxes[:, 2] = -1
+    boxes[:, 3] = -1
+    np.minimum.at(boxes[:, 0], inverse, x_min)
+    np.minimum.at(boxes[:, 1], inverse, y_min)
+    np.maximum.at(boxes[:, 2], inverse, x_max)
+    np.maximum.at(boxes[:, 3], inverse, y_max)
+    return roots, boxes, np.bincount(inverse, weights=pixels, minlength=count).astype(np.int64)
+
+
+def label_islands(mask):
+    """標記 8 連通的內容島嶼
+
+    回傳 {'boxes': (N, 4) 的 [x_min, y_min, x_max, y_max] (含端點), 'pixels': 每個島嶼的像素數,
+    'runs': (rows, starts, ends), 'run_labels': 每個遊程所屬的島嶼索引}
+    """
+    rows, starts, ends = find_runs(mask)
+    above, below = _overlapping_run_pairs(rows, starts, ends, mask.shape[1])
+    labels = union_labels(len(rows), above, below)
+
+    roots, boxes, pixels = _boxes_by_label(labels, starts, rows, ends, rows, ends - starts + 1)
+    return {
+        'boxes': boxes,
+        'pixels': pixels,
+        'runs': (rows, starts, ends),
+        'run_labels': np.searchsorted(roots, labels),
+    }
+
+
+def _near_box_pairs(boxes, distance):
+    """找出邊界框間距不超過 distance 的配對 (i < j)
+
+    依 x_min 排序後以 searchsorted 掃描: 每個框只和 x_min 落在自己右緣 + distance 以內的框比較，
+    不需要建立 N^2 的距離矩陣
+    """
+    order = np.argsort(boxes[:, 0], kind='stable')
+    sorted_boxes = boxes[order]
+
+    first = np.arange(1, len(boxes) + 1)
+    last = np.searchsorted(sorted_boxes[:, 0], sorted_boxes[:, 2] + distance + 1, side='right')
+    counts = np.maximum(last - first, 0)
+
+    a = np.repeat(np.arange(len(boxes)), counts)
+    b = np.repeat(first, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    gap_y = np.maximum(sorted_boxes[a, 1] - sorted_boxes[b, 3], sorted_boxes[b, 1] - sorted_boxes[a, 3]) - 1
+    near = gap_y <= distance
+    a, b = order[a[near]], order[b[near]]
+    return np.minimum(a, b), np.maximum(a, b)
+
+
+def merge_near_islands(boxes, pixels, distance):
+    """合併邊界框間距不超過 distance 像素的島嶼，合併後的框可能再碰到其他島嶼，重複到穩定為止
+
+    回傳 (boxes, pixels, groups)，groups 為每個原始島嶼所屬的合併後索引
+    """
+    groups = np.arange(len(boxes))
+    while len(boxes) > 1:
+        pairs_a, pairs_b = _near_box_pairs(boxes, distance)
+        if len(pairs_a) == 0:
+            break
+        labels = union_labels(len(boxes), pairs_a, pairs_b)
+        roots, boxes, pixels = _boxes_by_label(labels, boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3], pixels)
+        groups = np.searchsorted(roots, labels)[groups]
+    return boxes, pixels, groups
+
+
+def detect_sprites(pixels, alpha_threshold=0, merge_distance=2, min_pixels=4):
+    """偵測 RGBA sheet 中的每個 sprite
+
+    回傳 {'rects': (N, 4) 的 [x, y, w, h]，依由上到下、由左到右排序, 'pixels': 每個 sprite 的內容像素數,
+    'islands': 合併前的島嶼數}；合併後仍少於 min_pixels 的雜點會被捨棄
+    """
+    islands = label_islands(pixels[:, :, 3] > alpha_threshold)
+    boxes, counts, _ = merge_near_islands(islands['boxes'], islands['pixels'], merge_distance)
+
+    keep = counts >= min_pixels
+    boxes, counts = boxes[keep], counts[keep]
+
+    # 閱讀順序: 上緣落在同一列高度內的 sprite 視為同一行，再由左到右
+    if len(boxes):
+        line_height = max(int(np.median(boxes[:, 3] - boxes[:, 1] + 1)), 1)
+        order = np.lexsort((boxes[:, 0], boxes[:, 1] // line_height))
+        boxes, counts = boxes[order], counts[order]
+
+    rects = np.column_stack([boxes[:, 0], boxes[:, 1], boxes[:, 2] - boxes[:, 0] + 1, boxes[:, 3] - boxes[:, 1] + 1])
+    return {'rects': rects, 'pixels': counts, 'islands': len(islands['boxes'])}
+
+
+def create_island_atlas(rects, image_name, image_size, prefix="sprite"):
+    """以偵測到的矩形建立 Phaser 圖集設定，每個 sprite 一個 frame，直接引用原 sheet"""
+    frames = {}
+    for index, (x, y, w, h) in enumerate(rects.tolist()):
+        frames[f"{prefix}_{index:03d}"] = {
+            "frame": {"x": x, "y": y, "w": w, "h": h},
+            "rotated": False,
+            "trimmed": False,
+            "spriteSourceSize": {"x": 0, "y": 0, "w": w, "h": h},
+            "sourceSize": {"w": w, "h": h}
+        }
+
+    return {
+        "textures": [{
+            "image": image_name,
+            "format": "RGBA8888",
+            "size": {"w": image_size[0], "h": image_size[1]},
+            "scale": 1,
+            "frames": frames
+        }]
+    }
+
+
+def _option(name, default):
+    for arg in sys.argv[1:]:
+        if arg.startswith(f'--{name}='):
+            return int(arg.split('=', 1)[1])
+    return default
+
+
+def main():
+    """主函數"""
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    if not args:
+        print("用法: python sprite_islands.py <sheet.png> [--merge=2] [--min-pixels=4] [--force]")
+        return 1
+
+    image_path = args[0]
+    merge_distance = _option('merge', 2)
+    min_pixels = _option('min-pixels', 4)
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    output_file = os.path.join(OUTPUT_DIR, f"{stem}_islands.json")
+
+    inputs = [image_path, __file__]
+    params = {'merge': merge_distance, 'min_pixels': min_pixels}
+    manifest = load_manifest()
+    if is_up_to_date(manifest, output_file, inputs, params):
+        print(f"⏭️ 輸入未變更，略過: {output_file}")
+        return 0
+
+    print(f"🧩 偵測 {os.path.basename(image_path)} 中的 sprite 島嶼...")
+    pixels = load_pixels(image_path)
+    result = detect_sprites(pixels, merge_distance=merge_distance, min_pixels=min_pixels)
+    print(f"  島嶼 {result['islands']} 個，合併後 {len(result['rects'])} 個 sprite")
+
+    atlas = create_island_atlas(result['rects'], os.path.basename(image_path),
+                                (pixels.shape[1], pixels.shape[0]), prefix=stem)
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(atlas, f, indent=2)
+    record_output(manifest, output_file, inputs, params)
+    save_manifest(manifest)
+
+    print(f"💾 圖集已保存到: {output_file}")
+    return 0
+
+
+if __name__ == "__main__":
+    with profiled_run('sprite_islands'):
+        status = main()
+    sys.exit(status)
@@ -6,20 +6,28 @@ Analyzes and processes the NPC sprite sheet to create a proper asset library
 
 import json
 from PIL import Image, ImageDraw
+import numpy as np
 import os
 import sys
 
-def analyze_sprite_sheet(image_path):
+from atlas_packer import pack_rects
+from build_manifest import get_output_record, is_up_to_date, load_manifest, record_output, save_manifest
+from cell_stats import VISIBLE_ALPHA, cell_view, compute_cell_stats
+from frame_dedup import find_duplicate_frames
+from hit_masks import build_hit_masks
+from pixel_cache import load_pixels
+from stage_timer import profiled_run, stage, timed
+from texture_variants import build_texture_variants, parse_variant_options, print_variant_report, write_variant_atlases
+
+def analyze_sprite_sheet(image_path, grid_cols=13, grid_rows=11):
     """Analyze the sprite sheet structure"""
     try:
         img = Image.open(image_path)
         print(f"Image size: {img.size}")
         print(f"Image mode: {img.mode}")
         
-        # Basic grid analysis assuming 13x11 as mentioned in code
+        # Basic grid analysis, 13x11 by default as mentioned in code
         width, height = img.size
-        grid_cols = 13
-        grid_rows = 11
         
         cell_width = width // grid_cols
         cell_height = height // grid_rows
@@ -42,7 +50,8 @@ def analyze_sprite_sheet(image_path):
 def extract_sprite_frames(image_path, output_dir, analysis):
     """Extract individual sprite frames from the sheet"""
     try:
-        img = Image.open(image_path)
+        # 整張圖只解碼一次 (走快取)，各幀直接從陣列切片
+        pixels = load_pixels(image_path)
         
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
@@ -61,7 +70,7 @@ def extract_sprite_frames(image_path, output_dir, analysis):
                 bottom = top + cell_height
                 
                 # Extract frame
-                frame = img.crop((left, top, right, bottom))
+                frame = Image.fromarray(np.ascontiguousarray(pixels[top:bottom, left:right]))
                 frame_number = row * grid_cols + col
                 
                 # Save frame
@@ -82,8 +91,83 @@ def extract_sprite_frames(image_path, output_dir, analysis):
         print(f"Error extracting frames: {e}")
         return None
 
-def create_sprite_atlas_config(frames, analysis):
-    """Create a sprite atlas configuration for Phaser"""
+# Rows at the bottom/top of the content used to locate the feet and the head
+ANCHOR_BAND = 4
+
+@timed('atlas.anchors')
+def compute_frame_anchors(pixels, cols, rows, alpha_threshold=VISIBLE_ALPHA, band=ANCHOR_BAND):
+    """Compute layout anchors for every frame in one vectorized pass
+
+    All coordinates are local to the frame (cell) in pixel-edge units:
+      bbox     tight alpha bounding box [x, y, w, h]
+      feet     [x, y] - centre of the bottom `band` content rows, on the
+               bottom edge of the lowest content row (the baseline)
+      head     [x, y] - centre of the top `band` content rows, on the top
+               edge of the highest content row
+      pivot    feet normalized by the cell size, i.e. Phaser's frame pivot
+    Only pixels with alpha > alpha_threshold count as content, so near-invisible
+    fringe pixels (alpha 1-8 in the source art) don't stretch the bbox.
+    Returns a dict of (frames, ...) arrays in row * cols + col order plus
+    an `empty` mask; empty frames have all-zero anchors.
+    """
+    stats = compute_cell_stats(pixels, cols, rows, alpha_threshold)
+    cells = cell_view(pixels, cols, rows)
+    cell_width, cell_height = stats['cell_size']
+    
+    content = cells[..., 3] > alpha_threshold                  # (rows, cell_h, cols, cell_w)
+    x_min, y_min, x_max, y_max = np.moveaxis(stats['bbox'], -1, 0)
+    empty = x_min < 0
+    
+    y = np.arange(cell_height)[None, :, None, None]
+    x = np.arange(cell_width)[None, None, None, :]
+    
+    def band_centre(in_band):
+        """Mean x (pixel centre) of the content pixels inside each frame's band"""
+        selected = content & in_band
+        count = np.count_nonzero(selected, axis=(1, 3))
+        x_sum = np.where(selected, x, 0).sum(axis=(1, 3))
+        return np.divide(x_sum, count, out=np.zeros(count.shape), where=count > 0) + 0.5
+    
+    feet_x = band_centre(y > (y_max - band)[:, None, :, None])
+    head_x = band_centre(y < (y_min + band)[:, None, :, None])
+    
+    bbox = np.stack([x_min, y_min, x_max - x_min + 1, y_max - y_min + 1], axis=-1)
+    feet = np.stack([feet_x, y_max + 1.0], axis=-1)
+    head = np.stack([head_x, y_min.astype(np.float64)], axis=-1)
+    pivot = feet / np.array([cell_width, cell_height], dtype=np.float64)
+    
+    result = {'bbox': bbox, 'feet': feet, 'head': head, 'pivot': pivot}
+    for name in result:
+        result[name][empty] = 0
+        result[name] = result[name].reshape(rows * cols, -1)
+    result['empty'] = empty.ravel()
+    
+    return result
+
+def frame_anchor_fields(anchors, frame_id):
+    """Atlas frame fields for one frame: Phaser `pivot` plus custom `anchors`
+
+    Phaser applies `pivot` as the frame's origin and keeps the whole frame
+    entry (including `anchors`) in frame.customData. Empty frames get no fields.
+    """
+    if anchors is None or anchors['empty'][frame_id]:
+        return {}
+    
+    pivot_x, pivot_y = (round(float(v), 4) for v in anchors['pivot'][frame_id])
+    return {
+        "pivot": {"x": pivot_x, "y": pivot_y},
+        "anchors": {
+            "bbox": [int(v) for v in anchors['bbox'][frame_id]],
+            "feet": [round(float(v), 2) for v in anchors['feet'][frame_id]],
+            "head": [round(float(v), 2) for v in anchors['head'][frame_id]]
+        }
+    }
+
+def create_sprite_atlas_config(frames, analysis, anchors=None):
+    """Create a sprite atlas configuration for Phaser
+
+    anchors (from compute_frame_anchors) adds pivot and anchor fields to each frame.
+    """
     
     atlas_config = {
         "textures": [{
@@ -123,11 +207,86 @@ def create_sprite_atlas_config(frames, analysis):
             "sourceSize": {
                 "w": cell_width,
                 "h": cell_height
-            }
+            },
+            **frame_anchor_fields(anchors, frame['frame_id'])
         }
     
     return atlas_config
 
+@timed('atlas.pack')
+def create_packed_atlas(pixels, analysis, image_prefix="npc_packed", max_page_size=2048, padding=2,
+                        aliases=None, anchors=None):
+    """Trim every frame to its alpha bounding box and bin-pack the results
+
+    Empty frames are dropped. Returns the atlas config plus one RGBA page
+    image per texture; spriteSourceSize/sourceSize keep Phaser's frame
+    placement identical to the untrimmed grid. Frames listed in aliases
+    ({frame_id: canonical_id}) are not packed and reuse their canonical
+    frame's texture region. anchors (from compute_frame_anchors) adds pivot
+    and anchor fields, expressed in the untrimmed frame's coordinates.
+    """
+    aliases = aliases or {}
+    cols, rows = analysis['grid_cols'], analysis['grid_rows']
+    cell_width, cell_height = analysis['cell_size']
+    stats = compute_cell_stats(pixels, cols, rows)
+    cells = cell_view(pixels, cols, rows)
+    
+    # Trimmed size of every non-empty frame
+    trimmed = {}
+    for row in range(rows):
+        for col in range(cols):
+            x_min, y_min, x_max, y_max = (int(v) for v in stats['bbox'][row, col])
+            if x_min < 0:
+                continue
+            trimmed[row * cols + col] = (x_min, y_min, x_max - x_min + 1, y_max - y_min + 1)
+    
+    sizes = {frame_id: (w, h) for frame_id, (_, _, w, h) in trimmed.items() if frame_id not in aliases}
+    pages, placements = pack_rects(sizes, max_size=max_page_size, padding=padding)
+    
+    page_arrays = [np.zeros((h, w, 4), dtype=np.uint8) for w, h in pages]
+    textures = [{
+        "image": f"{image_prefix}_{i}.png",
+        "format": "RGBA8888",
+        "size": {"w": w, "h": h},
+        "scale": 1,
+        "frames": {}
+    } for i, (w, h) in enumerate(pages)]
+    
+    for frame_id in sorted(trimmed):
+        # Duplicate frames point at their canonical frame's region
+        source_id = aliases.get(frame_id, frame_id)
+        if source_id not in placements:
+            continue
+        
+        x_min, y_min, w, h = trimmed[source_id]
+        page_index, x, y = placements[source_id]
+        row, col = divmod(source_id, cols)
+        
+        if source_id == frame_id:
+            page_arrays[page_index][y:y + h, x:x + w] = cells[row, y_min:y_min + h, col, x_min:x_min + w]
+        textures[page_index]["frames"][f"npc_{frame_id:03d}"] = {
+            "frame": {"x": x, "y": y, "w": w, "h": h},
+            "rotated": False,
+            "trimmed": (w, h) != (cell_width, cell_height),
+            "spriteSourceSize": {"x": x_min, "y": y_min, "w": w, "h": h},
+            "sourceSize": {"w": cell_width, "h": cell_height},
+            **frame_anchor_fields(anchors, frame_id)
+        }
+    
+    atlas_config = {"textures": textures}
+    page_images = [Image.fromarray(page) for page in page_arrays]
+    
+    return atlas_config, page_images
+
+def parse_dedup_option(argv):
+    """Parse --dedup (exact duplicates only) or --dedup=N (also perceptual-hash distance <= N)"""
+    for arg in argv:
+        if arg == '--dedup':
+            return {'dedup': True, 'dedup_distance': None}
+        if arg.startswith('--dedup='):
+            return {'dedup': True, 'dedup_distance': int(arg.split('=', 1)[1])}
+    return {'dedup': False, 'dedup_distance': None}
+
 def create_npc_character_definitions():
     """Create NPC character definitions with frame mappings"""
     
@@ -196,43 +355,142 @@ def main():
     # print("\n✂️ Extracting sprite frames...")
     # frames = extract_sprite_frames(sprite_sheet_path, output_dir, analysis)
     
-    # Create atlas configuration
-    print("\n🗺️ Creating sprite atlas configuration...")
-    frames = []
-    for i in range(analysis['total_frames']):
-        row = i // analysis['grid_cols']
-        col = i % analysis['grid_cols']
-        left = col * analysis['cell_size'][0]
-        top = row * analysis['cell_size'][1]
-        right = left + analysis['cell_size'][0]
-        bottom = top + analysis['cell_size'][1]
-        frames.append({
-            'frame_id': i,
-            'grid_pos': [col, row],
-            'crop_box': [left, top, right, bottom]
-        })
-    
-    atlas_config = create_sprite_atlas_config(frames, analysis)
-    
-    # Create character definitions
-    print("\n👥 Creating NPC character definitions...")
-    characters = create_npc_character_definitions()
-    
     # Save configurations
     if not os.path.exists(config_output_dir):
         os.makedirs(config_output_dir)
     
-    # Save atlas configuration
+    # Outputs are skipped when their inputs (source image + this script) are unchanged
+    manifest = load_manifest()
+    code_inputs = [os.path.abspath(__file__)]
+    
+    # Create atlas configuration
     atlas_path = os.path.join(config_output_dir, "npc_atlas.json")
-    with open(atlas_path, 'w', encoding='utf-8') as f:
-        json.dump(atlas_config, f, indent=2, ensure_ascii=False)
-    print(f"💾 Saved atlas configuration to {atlas_path}")
+    atlas_inputs = [sprite_sheet_path] + code_inputs
+    atlas_params = {'grid': [analysis['grid_cols'], analysis['grid_rows']], 'anchor_alpha': VISIBLE_ALPHA}
     
-    # Save character definitions
+    if is_up_to_date(manifest, atlas_path, atlas_inputs, atlas_params):
+        print(f"\n⏭️ Atlas inputs unchanged, skipping {atlas_path}")
+    else:
+        print("\n🗺️ Creating sprite atlas configuration...")
+        frames = []
+        for i in range(analysis['total_frames']):
+            row = i // analysis['grid_cols']
+            col = i % analysis['grid_cols']
+            left = col * analysis['cell_size'][0]
+            top = row * analysis['cell_size'][1]
+            right = left + analysis['cell_size'][0]
+            bottom = top + analysis['cell_size'][1]
+            frames.append({
+                'frame_id': i,
+                'grid_pos': [col, row],
+                'crop_box': [left, top, right, bottom]
+            })
+        
+        # Per-frame bbox / feet / head anchors for runtime layout, one pass over the sheet
+        anchors = compute_frame_anchors(load_pixels(sprite_sheet_path), analysis['grid_cols'], analysis['grid_rows'])
+        atlas_config = create_sprite_atlas_config(frames, analysis, anchors)
+        
+        # Save atlas configuration
+        with open(atlas_path, 'w', encoding='utf-8') as f:
+            json.dump(atlas_config, f, indent=2, ensure_ascii=False)
+        record_output(manifest, atlas_path, atlas_inputs, atlas_params)
+        print(f"💾 Saved atlas configuration to {atlas_path}")
+    
+    # Optional trimmed + bin-packed atlas (python sprite_processor.py --pack [--dedup[=DISTANCE]])
+    if '--pack' in sys.argv:
+        packed_path = os.path.join(config_output_dir, "npc_atlas_packed.json")
+        packed_params = dict(atlas_params, padding=2, max_page_size=2048, **parse_dedup_option(sys.argv))
+        
+        # Each page PNG is an output too: a deleted or stale page forces a rebuild
+        page_dir = os.path.dirname(sprite_sheet_path)
+        page_paths = [os.path.join(page_dir, name)
+                      for name in get_output_record(manifest, packed_path).get('pages', [])]
+        
+        if page_paths and all(is_up_to_date(manifest, path, atlas_inputs, packed_params)
+                              for path in [packed_path] + page_paths):
+            print(f"\n⏭️ Packed atlas inputs unchanged, skipping {packed_path}")
+        else:
+            print("\n📦 Creating trimmed, bin-packed atlas...")
+            pixels = load_pixels(sprite_sheet_path)
+            anchors = compute_frame_anchors(pixels, analysis['grid_cols'], analysis['grid_rows'])
+            
+            aliases = None
+            if packed_params['dedup']:
+                duplicates = find_duplicate_frames(
+                    pixels, analysis['grid_cols'], analysis['grid_rows'],
+                    max_distance=packed_params['dedup_distance']
+                )
+                aliases = duplicates['aliases']
+                print(f"🔁 {analysis['total_frames']} frames -> {duplicates['unique_frames']} unique "
+                      f"({len(duplicates['clusters'])} duplicate clusters)")
+            
+            packed_config, page_images = create_packed_atlas(
+                pixels, analysis,
+                max_page_size=packed_params['max_page_size'], padding=packed_params['padding'],
+                aliases=aliases, anchors=anchors
+            )
+            
+            for texture, page in zip(packed_config["textures"], page_images):
+                page_path = os.path.join(page_dir, texture["image"])
+                with stage('atlas.page_save', page=texture["image"]):
+                    page.save(page_path, optimize=True)
+                record_output(manifest, page_path, atlas_inputs, packed_params)
+                print(f"💾 Saved atlas page {texture['size']['w']}x{texture['size']['h']} "
+                      f"({len(texture['frames'])} frames) to {page_path}")
+            
+            with open(packed_path, 'w', encoding='utf-8') as f:
+                json.dump(packed_config, f, indent=2, ensure_ascii=False)
+            record_output(manifest, packed_path, atlas_inputs, packed_params,
+                          pages=[texture["image"] for texture in packed_config["textures"]])
+            print(f"💾 Saved packed atlas configuration to {packed_path}")
+    
+    # Optional bit-packed click masks for the frames npcStyles.ts uses
+    # (python sprite_processor.py --hitmasks [--downsample[=N]] [--all])
+    if '--hitmasks' in sys.argv:
+        print("\n🎯 Creating per-frame hit-test masks...")
+        build_hit_masks(manifest, sys.argv[1:])
+    
+    # Optional lossless WebP / 8-bit palette PNG variants
+    # (python sprite_processor.py --variants [--webp-method=N] [--png8-max-error=N])
+    if '--variants' in sys.argv:
+        print("\n🗜️ Creating compressed texture variants...")
+        variant_options = parse_variant_options(sys.argv[1:])
+        background_path = "../static/assets/bg6.png"
+        print_variant_report(os.path.basename(background_path),
+                             build_texture_variants(background_path, manifest, **variant_options))
+        
+        atlas_paths = [atlas_path]
+        if '--pack' in sys.argv:
+            atlas_paths.append(os.path.join(config_output_dir, "npc_atlas_packed.json"))
+        
+        for path in atlas_paths:
+            with open(path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            
+            page_variants = {}
+            for texture in config["textures"]:
+                page_path = os.path.join(os.path.dirname(sprite_sheet_path), texture["image"])
+                page_variants[texture["image"]] = build_texture_variants(page_path, manifest, **variant_options)
+                print_variant_report(texture["image"], page_variants[texture["image"]])
+            
+            for variant, variant_atlas in write_variant_atlases(
+                    path, config, page_variants, manifest, [path] + code_inputs).items():
+                print(f"💾 {variant} atlas configuration: {variant_atlas}")
+    
+    # Create character definitions
     characters_path = os.path.join(config_output_dir, "npc_characters.json")
-    with open(characters_path, 'w', encoding='utf-8') as f:
-        json.dump(characters, f, indent=2, ensure_ascii=False)
-    print(f"💾 Saved character definitions to {characters_path}")
+    
+    if is_up_to_date(manifest, characters_path, code_inputs):
+        print(f"\n⏭️ Character definitions unchanged, skipping {characters_path}")
+    else:
+        print("\n👥 Creating NPC character definitions...")
+        characters = create_npc_character_definitions()
+        
+        # Save character definitions
+        with open(characters_path, 'w', encoding='utf-8') as f:
+            json.dump(characters, f, indent=2, ensure_ascii=False)
+        record_output(manifest, characters_path, code_inputs)
+        print(f"💾 Saved character definitions to {characters_path}")
     
     # Create updated NPC data with proper frame references
     updated_npc_data = {
@@ -302,9 +560,15 @@ def main():
     
     # Save updated NPC data
     npc_data_path = os.path.join(config_output_dir, "npcs_updated.json")
-    with open(npc_data_path, 'w', encoding='utf-8') as f:
-        json.dump(updated_npc_data, f, indent=2, ensure_ascii=False)
-    print(f"💾 Saved updated NPC data to {npc_data_path}")
+    if is_up_to_date(manifest, npc_data_path, code_inputs):
+        print(f"⏭️ NPC data unchanged, skipping {npc_data_path}")
+    else:
+        with open(npc_data_path, 'w', encoding='utf-8') as f:
+            json.dump(updated_npc_data, f, indent=2, ensure_ascii=False)
+        record_output(manifest, npc_data_path, code_inputs)
+        print(f"💾 Saved updated NPC data to {npc_data_path}")
+    
+    save_manifest(manifest)
     
     print("\n✅ NPC Sprite Processing Complete!")
     print("\nNext steps:")
@@ -316,4 +580,6 @@ def main():
     return 0
 
 if __name__ == "__main__":
-    sys.exit(main())
\ No newline at end of file
+    with profiled_run('sprite_processor'):
+        status = main()
+    sys.exit(status)
\ No newline at end of file
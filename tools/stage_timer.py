@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+分析階段的計時與記憶體量測
+以 stage() context manager / timed() decorator 包住各階段 (圖片開啟、解碼、逐格統計、分類、JSON 輸出…)，
+記錄 wall time、CPU time 與 tracemalloc 峰值，每次執行輸出 JSON 與 Chrome trace-event 檔
+(可用 chrome://tracing 或 Perfetto 開啟)；沒有啟用量測時 stage() 幾乎沒有額外成本
+
+CPU time 與 tracemalloc 都是整個行程共用的，只有在啟動量測的執行緒上的階段會記錄這兩項
+(包含其間所有工作執行緒的用量)；工作執行緒中的階段 (例如列帶) 只記錄 wall time，
+也不會重設 tracemalloc 峰值而打亂外層階段的量測
+
+啟用方式: 命令列帶 --profile[=目錄]，或設定 DTA_PROFILE=1 / DTA_PROFILE=目錄
+"""
+
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PROFILE_DIR = os.path.join(TOOLS_DIR, '.cache', 'profiles')
+
+# 目前的量測 (None 表示未啟用)
+_profile = None
+_lock = threading.Lock()
+
+
+def start_profile(name, trace_memory=True):
+    """開始一次量測，trace_memory=False 時不啟用 tracemalloc (純 Python 迴圈較多時開銷較大)"""
+    global _profile
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+
+    _profile = {
+        'name': name,
+        'pid': os.getpid(),
+        'started_at': time.time(),
+        'origin': time.perf_counter(),
+        'thread': threading.get_ident(),
+        'trace_memory': trace_memory,
+        'started_tracing': started_tracing,
+        'stages': [],
+        'stacks': {},
+    }
+    return _profile
+
+
+def stop_profile():
+    """結束量測並回傳結果 (不含內部狀態)，沒有進行中的量測時回傳 None"""
+    global _profile
+    profile, _profile = _profile, None
+    if profile is None:
+        return None
+
+    if profile['started_tracing']:
+        tracemalloc.stop()
+
+    return {
+        'name': profile['name'],
+        'pid': profile['pid'],
+        'started_at': profile['started_at'],
+        'wall_s': time.perf_counter() - profile['origin'],
+        'trace_memory': profile['trace_memory'],
+        'stages': profile['stages'],
+    }
+
+
+def is_profiling():
+    return _profile is not None
+
+
+@contextlib.contextmanager
+def stage(name, **args):
+    """量測一個階段；巢狀階段會記錄所屬的深度，args 會附在記錄中 (例如圖片路徑)
+
+    在工作執行緒中只記錄 wall time (見模組說明)
+    """
+    profile = _profile
+    if profile is None:
+        yield
+        return
+
+    thread_id = threading.get_ident()
+    with _lock:
+        stack = profile['stacks'].setdefault(thread_id, [])
+        depth = len(stack)
+
+    measured = thread_id == profile['thread']
+    tracing = measured and profile['trace_memory'] and tracemalloc.is_tracing()
+    if tracing:
+        current, peak = tracemalloc.get_traced_memory()
+        # 重設峰值前先把目前的峰值交給外層階段
+        if stack:
+            stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+        tracemalloc.reset_peak()
+    else:
+        current = 0
+
+    frame = {'peak': current}
+    stack.append(frame)
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield
+    finally:
+        cpu = time.process_time() - cpu_start
+        wall_end = time.perf_counter()
+        stack.pop()
+
+        record = {
+            'name': name,
+            'depth': depth,
+            'thread': thread_id,
+            'start_s': wall_start - profile['origin'],
+            'wall_s': wall_end - wall_start,
+        }
+        if measured:
+            record['cpu_s'] = cpu
+        if tracing:
+            end_current, end_peak = tracemalloc.get_traced_memory()
+            peak = max(frame['peak'], end_peak)
+            record['peak_bytes'] = peak
+            record['peak_delta_bytes'] = peak - current
+            record['retained_bytes'] = end_current - current
+            if stack:
+                stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+        if args:
+            record['args'] = {key: str(value) for key, value in args.items()}
+
+        with _lock:
+            profile['stages'].append(record)
+
+
+def timed(name=None):
+    """將整個函數當作一個階段量測，name 預設為 模組.函數名稱"""
+    def decorator(func):
+        stage_name = name or f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _profile is None:
+                return func(*args, **kwargs)
+            with stage(stage_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def summarize(profile):
+    """依階段名稱彙總次數、總 wall/CPU time 與最大峰值記憶體，依總時間排序
+
+    只在工作執行緒中執行的階段沒有 CPU time 與記憶體量測，cpu_s / peak_bytes 為 None
+    """
+    totals = {}
+    for record in profile['stages']:
+        entry = totals.setdefault(record['name'], {'calls': 0, 'wall_s': 0.0, 'cpu_s': None, 'peak_bytes': None})
+        entry['calls'] += 1
+        entry['wall_s'] += record['wall_s']
+        if 'cpu_s' in record:
+            entry['cpu_s'] = (entry['cpu_s'] or 0.0) + record['cpu_s']
+        if 'peak_bytes' in record:
+            entry['peak_bytes'] = max(entry['peak_bytes'] or 0, record['peak_bytes'])
+    return dict(sorted(totals.items(), key=lambda item: item[1]['wall_s'], reverse=True))
+
+
+def chrome_trace(profile):
+    """轉成 Chrome trace-event 格式 (完整事件 ph=X，時間單位為微秒)"""
+    threads = {thread: index for index, thread in enumerate(dict.fromkeys(r['thread'] for r in profile['stages']))}
+    events = [{
+        'name': profile['name'],
+        'ph': 'M',
+        'pid': profile['pid'],
+        'tid': 0,
+        'args': {'name': profile['name']},
+    }]
+    # 外層階段先結束才記錄，依開始時間與深度排序讓檢視器正確巢狀顯示
+    for record in sorted(profile['stages'], key=lambda r: (r['start_s'], r['depth'])):
+        args = {}
+        if 'cpu_s' in record:
+            args['cpu_ms'] = round(record['cpu_s'] * 1000, 3)
+        if 'peak_bytes' in record:
+            args['peak_kb'] = round(record['peak_bytes'] / 1024, 1)
+            args['peak_delta_kb'] = round(record['peak_delta_bytes'] / 1024, 1)
+        args.update(record.get('args', {}))
+        events.append({
+            'name': record['name'],
+            'cat': 'stage',
+            'ph': 'X',
+            'ts': round(record['start_s'] * 1e6, 1),
+            'dur': round(record['wall_s'] * 1e6, 1),
+            'pid': profile['pid'],
+            'tid': threads[record['thread']],
+            'args': args,
+        })
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def write_profile(profile, output_dir=DEFAULT_PROFILE_DIR):
+    """寫出 <name>-<時間>.json (完整記錄 + 彙總) 與 .trace.json，回傳兩個路徑"""
+    os.makedirs(output_dir, exist_ok=True)
+    stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(profile['started_at']))
+    base = os.path.join(output_dir, f"{profile['name']}-{stamp}")
+
+    json_path, trace_path = base + '.json', base + '.trace.json'
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump({**profile, 'summary': summarize(profile)}, f, indent=2, ensure_ascii=False)
+    with open(trace_path, 'w', encoding='utf-8') as f:
+        json.dump(chrome_trace(profile), f, ensure_ascii=False, separators=(',', ':'))
+    return json_path, trace_path
+
+
+def profile_dir_from_argv(argv=None):
+    """由 --profile[=目錄] 或 DTA_PROFILE 取得輸出目錄，未啟用時回傳 None"""
+    argv = sys.argv[1:] if argv is None else argv
+    for arg in argv:
+        if arg == '--profile':
+            return DEFAULT_PROFILE_DIR
+        if arg.startswith('--profile='):
+            return arg.split('=', 1)[1]
+
+    env = os.environ.get('DTA_PROFILE')
+    if not env or env == '0':
+        return None
+    return DEFAULT_PROFILE_DIR if env == '1' else env
+
+
+@contextlib.contextmanager
+def profiled_run(name, output_dir=None, trace_memory=True):
+    """包住一次工具執行: 啟用量測時結束後寫出 profile 並印出各階段摘要，否則不做任何事
+
+    output_dir 為 None 時依命令列 / 環境變數決定是否啟用
+    """
+    output_dir = output_dir or profile_dir_from_argv()
+    if output_dir is None or is_profiling():
+        yield
+        return
+
+    start_profile(name, trace_memory)
+    try:
+        with stage(name):
+            yield
+    finally:
+        profile = stop_profile()
+        json_path, trace_path = write_profile(profile, output_dir)
+        print_summary(profile, file=sys.stderr)
+        print(f"⏱️ 效能記錄已保存到: {json_path}、{trace_path}", file=sys.stderr)
+
+
+def print_summary(profile, top=15, file=None):
+    print(f"\n⏱️ {profile['name']}: {profile['wall_s']:.3f}s", file=file)
+    for name, entry in list(summarize(profile).items())[:top]:
+        peak = ''
+        if profile['trace_memory'] and entry['peak_bytes'] is not None:
+            peak = f"  峰值 {entry['peak_bytes'] / 1024 / 1024:7.1f} MB"
+        cpu = f"{entry['cpu_s'] * 1000:9.1f}" if entry['cpu_s'] is not None else f"{'-':>9}"
+        print(f"  {name:<40} {entry['calls']:>4}x  wall {entry['wall_s'] * 1000:9.1f} ms  "
+              f"cpu {cpu} ms{peak}", file=file)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+貼圖壓縮變體
+為每張圖集頁面與背景產生無損 WebP 與 8-bit 調色盤 PNG，
+記錄檔案大小與最大逐像素誤差，並輸出指向各變體的圖集 JSON
+
+比原圖還大的變體，以及誤差超過容許值的 png8 不會輸出 (建置清單中記錄略過原因)；
+圖集 JSON 只在所有頁面都有可用的變體時才寫出，確保變體可以直接替換原圖
+"""
+
+import copy
+import json
+import os
+
+from PIL import Image
+import numpy as np
+
+from build_manifest import get_output_record, is_up_to_date, record_matches, record_output
+from stage_timer import stage, timed
+
+VARIANTS = {
+    'webp': {'suffix': '.webp', 'format': 'WEBP'},
+    'png8': {'suffix': '-png8.png', 'format': 'PNG'},
+}
+
+# WebP 壓縮力度 (0-6)；6 每張圖要十幾秒，4 以上的檔案大小差距很小
+WEBP_METHOD = 4
+# png8 容許的最大單通道誤差，預設只接受無損的量化結果
+PNG8_MAX_ERROR = 0
+
+
+def variant_path(image_path, variant):
+    """變體檔案路徑，與原圖放在同一目錄"""
+    stem = os.path.splitext(image_path)[0]
+    return stem + VARIANTS[variant]['suffix']
+
+
+def _rgba_array(img):
+    """轉為 RGBA 陣列，完全透明像素的 RGB 歸零以免影響誤差計算"""
+    rgba = np.asarray(img.convert('RGBA'))
+    return np.where(rgba[..., 3:4] == 0, 0, rgba)
+
+
+@timed('variant.max_error')
+def max_pixel_error(original_path, variant_file):
+    """原圖與變體之間最大的單通道誤差 (0 表示無損)"""
+    with Image.open(original_path) as original, Image.open(variant_file) as variant:
+        diff = np.abs(_rgba_array(original).astype(np.int16) - _rgba_array(variant))
+    return int(diff.max())
+
+
+def quantize_to_palette(img):
+    """量化為 8-bit 調色盤圖片
+
+    顏色數不超過 256 時建立精確調色盤 (無損)，否則以 fast octree 量化
+    """
+    rgba = img.convert('RGBA')
+    if rgba.getcolors(256) is not None:
+        pixels = np.asarray(rgba).reshape(-1, 4)
+        palette, indices = np.unique(pixels, axis=0, return_inverse=True)
+
+        quantized = Image.frombytes('P', rgba.size, indices.astype(np.uint8).tobytes())
+        quantized.putpalette(palette.astype(np.uint8).tobytes(), rawmode='RGBA')
+        return quantized
+
+    return rgba.quantize(colors=256, method=Image.Quantize.FASTOCTREE)
+
+
+def write_variant(image_path, variant, output_file, webp_method=WEBP_METHOD):
+    """寫出單一變體檔"""
+    if variant not in VARIANTS:
+        raise ValueError(f"未知的貼圖變體: {variant}")
+
+    image_format = VARIANTS[variant]['format']
+    with stage(f'variant.{variant}', image=os.path.basename(image_path)), Image.open(image_path) as img:
+        if variant == 'webp':
+            img.convert('RGBA').save(output_file, image_format, lossless=True, method=webp_method, exact=True)
+        else:
+            quantize_to_palette(img).save(output_file, image_format, optimize=True)
+
+
+def parse_variant_options(argv):
+    """--webp-method=N (0-6) 與 --png8-max-error=N，未指定時使用預設值"""
+    options = {'webp_method': WEBP_METHOD, 'png8_max_error': PNG8_MAX_ERROR}
+    for arg in argv:
+        if arg.startswith('--webp-method='):
+            options['webp_method'] = int(arg.split('=', 1)[1])
+        elif arg.startswith('--png8-max-error='):
+            options['png8_max_error'] = int(arg.split('=', 1)[1])
+    if not 0 <= options['webp_method'] <= 6:
+        raise ValueError(f"--webp-method 必須介於 0 到 6: {options['webp_method']}")
+    return options
+
+
+def _skip_reason(variant, size, original_size, max_error, png8_max_error):
+    """變體不應輸出的原因，可以輸出時回傳 None"""
+    if size >= original_size:
+        return 'larger'
+    if variant == 'png8' and max_error > png8_max_error:
+        return 'lossy'
+    return None
+
+
+def build_texture_variants(image_path, manifest, variants=tuple(VARIANTS),
+                           webp_method=WEBP_METHOD, png8_max_error=PNG8_MAX_ERROR):
+    """產生圖片的所有變體並記錄到建置清單，輸入未變更的變體直接略過
+
+    回傳 {variant: {'file', 'bytes', 'max_error', 'lossy', 'skipped'}}，另含 'original' 的大小；
+    skipped 為 'larger' (不比原圖小) 或 'lossy' (png8 誤差超過 png8_max_error) 時不會留下變體檔
+    """
+    inputs = [image_path, os.path.abspath(__file__)]
+    original_size = os.path.getsize(image_path)
+    results = {'original': {'file': os.path.basename(image_path), 'bytes': original_size}}
+
+    for variant in variants:
+        output_file = variant_path(image_path, variant)
+        params = {'variant': variant}
+        if variant == 'webp':
+            params['method'] = webp_method
+        else:
+            params['max_error'] = png8_max_error
+
+        record = get_output_record(manifest, output_file)
+        if is_up_to_date(manifest, output_file, inputs, params) or \
+                (record.get('skipped') and record_matches(manifest, output_file, inputs, params)):
+            size, max_error, skipped = record.get('bytes'), record.get('max_error'), record.get('skipped')
+        else:
+            write_variant(image_path, variant, output_file, webp_method)
+            size = os.path.getsize(output_file)
+            max_error = max_pixel_error(image_path, output_file)
+            skipped = _skip_reason(variant, size, original_size, max_error, png8_max_error)
+            if skipped:
+                os.remove(output_file)
+            record_output(manifest, output_file, inputs, params,
+                          bytes=size, max_error=max_error, lossy=max_error > 0, skipped=skipped)
+
+        results[variant] = {
+            'path': output_file,
+            'file': os.path.basename(output_file),
+            'bytes': size,
+            'max_error': max_error,
+            'lossy': max_error > 0,
+            'skipped': skipped,
+        }
+
+    return results
+
+
+def write_variant_atlases(atlas_path, atlas_config, texture_variants, manifest, inputs):
+    """為每種變體寫出一份圖集 JSON，texture 的 image 改指向變體檔
+
+    texture_variants 為 {原始圖檔名: build_texture_variants 的結果}；
+    任一頁面的變體被略過時，該變體的圖集 JSON 不寫出 (已存在的舊檔一併移除)
+    """
+    written = {}
+    stem = os.path.splitext(atlas_path)[0]
+
+    for variant in VARIANTS:
+        output_file = f"{stem}_{variant}.json"
+        if any(texture_variants[texture['image']][variant]['skipped'] for texture in atlas_config['textures']):
+            if os.path.exists(output_file):
+                os.remove(output_file)
+            continue
+
+        written[variant] = output_file
+        variant_inputs = list(inputs) + [
+            texture_variants[texture['image']][variant]['path'] for texture in atlas_config['textures']
+        ]
+        if is_up_to_date(manifest, output_file, variant_inputs, {'variant': variant}):
+            continue
+
+        variant_config = copy.deepcopy(atlas_config)
+        for texture in variant_config['textures']:
+            info = texture_variants[texture['image']][variant]
+            texture['image'] = info['file']
+            if variant == 'png8':
+                texture['format'] = 'INDEXED8'
+
+        with open(output_file, 'w', encoding='utf-8') as f:
+            json.dump(variant_config, f, indent=2, ensure_ascii=False)
+        record_output(manifest, output_file, variant_inputs, {'variant': variant})
+
+    return written
+
+
+def print_variant_report(name, results):
+    """列印各變體的大小與誤差"""
+    original = results['original']['bytes']
+    print(f"  {name}: 原始 {original / 1024:.0f} KB")
+    for variant in VARIANTS:
+        if variant in results:
+            info = results[variant]
+            ratio = info['bytes'] / original if original else 0
+            lossless = '無損' if info['max_error'] == 0 else f"最大誤差 {info['max_error']}"
+            skipped = {'larger': '，不比原圖小，未輸出', 'lossy': '，超過容許誤差，未輸出'}.get(info['skipped'], '')
+            print(f"    {variant:<5} {info['bytes'] / 1024:7.0f} KB ({ratio:.0%}) {lossless}{skipped}")
@@ -6,67 +6,94 @@
 from PIL import Image
 import numpy as np
 import json
+import os
+import sys
 
-def verify_desk_in_all_frames():
-    """驗證每個框架是否包含辦公桌"""
+from build_manifest import is_up_to_date, load_manifest, record_output, save_manifest
+from cell_stats import cell_view, compute_cell_stats
+from color_classifier import (
+    CLOTHING, DESK_METAL, DESK_WOOD, SKIN,
+    classify_pixels, frame_label_histograms, label_fraction, label_histogram,
+)
+from frame_records import frame_records_from_stats, records_path, save_frame_records
+from pixel_cache import load_pixels
+from stage_timer import profiled_run, stage
+
+def verify_desk_in_all_frames(image_path="../static/assets/tilesets/npc-in.png", grid=(13, 11), npz_path=None):
+    """驗證每個框架是否包含辦公桌
+
+    指定 npz_path 時另外輸出欄式的逐幀記錄 (見 frame_records)
+    """
     
     try:
-        print("🔍 驗證 npc-in.png 每個框架的辦公桌內容...")
-        img = Image.open("../static/assets/tilesets/npc-in.png")
+        print(f"🔍 驗證 {os.path.basename(image_path)} 每個框架的辦公桌內容...")
+        img = Image.open(image_path)
         
-        if img.mode != 'RGBA':
-            img = img.convert('RGBA')
-        
-        img_array = np.array(img)
+        # 解碼結果走快取，轉成 RGBA 確保有透明度信息
+        img_array = load_pixels(image_path)
         width, height = img.size
         
-        # 13x11網格分析
-        cols, rows = 13, 11
-        cell_width = width // cols
-        cell_height = height // rows
+        # 網格分析 (預設 13x11)
+        cols, rows = grid
+        stats = compute_cell_stats(img_array, cols, rows)
+        cells = cell_view(img_array, cols, rows)
+        # 整張 sheet 只查表分類一次，得到每個框架的顏色旗標直方圖
+        histograms = frame_label_histograms(img_array, cols, rows)
+        cell_width, cell_height = stats['cell_size']
         
         print(f"分析網格: {cols}x{rows}, 每格: {cell_width}x{cell_height}")
         print("="*60)
         
-        desk_analysis = []
+        with stage('desk.per_cell_loop', frames=rows * cols):
+            desk_analysis = analyze_all_frames(cells, stats, histograms)
         
-        for row in range(rows):
-            for col in range(cols):
-                frame_index = row * cols + col
-                
-                # 提取框架內容
-                x1 = col * cell_width
-                y1 = row * cell_height
-                x2 = x1 + cell_width
-                y2 = y1 + cell_height
-                
-                cell_data = img_array[y1:y2, x1:x2]
-                
-                # 分析這個框架
-                analysis = analyze_single_frame(cell_data, frame_index, col, row)
-                desk_analysis.append(analysis)
-                
-                # 即時報告重要發現
-                if analysis['has_content']:
-                    status = "🏢✅" if analysis['likely_desk'] else "👤" if analysis['likely_character'] else "❓"
-                    print(f"框架 {frame_index:3d} ({col:2d},{row:2d}): {status} {analysis['description']}")
+        # 報告重要發現 (全部分析完後依框架順序輸出)
+        for analysis in desk_analysis:
+            if analysis['has_content']:
+                col, row = analysis['position']
+                status = "🏢✅" if analysis['likely_desk'] else "👤" if analysis['likely_character'] else "❓"
+                print(f"框架 {analysis['frame_index']:3d} ({col:2d},{row:2d}): {status} {analysis['description']}")
         
         # 總結分析
         summarize_desk_analysis(desk_analysis)
         
+        if npz_path:
+            save_frame_records(npz_path, desk_frame_records(stats, desk_analysis), grid=np.array(grid))
+        
         return desk_analysis
         
     except Exception as e:
         print(f"驗證時出錯: {e}")
         return None
 
-def analyze_single_frame(cell_data, frame_index, col, row):
-    """分析單個框架是否包含辦公桌"""
+def analyze_all_frames(cells, stats, histograms):
+    """對 cell_view 的每個框架執行 analyze_single_frame，回傳依框架索引排序的列表
+
+    逐格的判斷以 Python 為主 (會持有 GIL)，依序執行；較重的統計與顏色分類已在
+    compute_cell_stats / frame_label_histograms 中依列帶平行算好
+    """
+    rows, cols = cells.shape[0], cells.shape[2]
+    return [
+        analyze_single_frame(
+            cells[row, :, col], row * cols + col, col, row,
+            coverage=float(stats['coverage'][row, col]),
+            histogram=histograms[row * cols + col]
+        )
+        for row in range(rows)
+        for col in range(cols)
+    ]
+
+def analyze_single_frame(cell_data, frame_index, col, row, coverage=None, histogram=None):
+    """分析單個框架是否包含辦公桌
+
+    histogram 為 frame_label_histograms 算好的顏色旗標直方圖，未提供時由 cell_data 計算
+    """
     
     alpha = cell_data[:, :, 3]
-    content_pixels = np.sum(alpha > 0)
-    total_pixels = cell_data.shape[0] * cell_data.shape[1]
-    coverage = content_pixels / total_pixels
+    if coverage is None:
+        content_pixels = np.sum(alpha > 0)
+        total_pixels = cell_data.shape[0] * cell_data.shape[1]
+        coverage = content_pixels / total_pixels
     
     analysis = {
         'frame_index': frame_index,
@@ -83,16 +110,20 @@ def analyze_single_frame(cell_data, frame_index, col, row):
     
     # 分析有內容的框架
     content_mask = alpha > 0
-    rgb_content = cell_data[content_mask][:, :3]
+    if histogram is None:
+        histogram = label_histogram(classify_pixels(cell_data[content_mask][:, :3]))
     
-    if len(rgb_content) == 0:
+    if histogram.sum() == 0:
         return analysis
     
     # 檢測辦公桌特徵
-    desk_score = detect_desk_features(rgb_content, cell_data, content_mask)
+    desk_score = detect_desk_features(histogram, cell_data, content_mask)
     
     # 檢測人物特徵  
-    character_score = detect_character_features(rgb_content)
+    character_score = character_feature_score(histogram)
+    
+    analysis['desk_score'] = float(desk_score)
+    analysis['character_score'] = float(character_score)
     
     # 判斷內容類型
     if desk_score > 0.3 and character_score > 0.1:
@@ -110,7 +141,19 @@ def analyze_single_frame(cell_data, frame_index, col, row):
     
     return analysis
 
-def detect_desk_features(rgb_content, cell_data, content_mask):
+def desk_frame_records(stats, desk_analysis):
+    """將逐格分析結果轉成 frame_records 的結構化陣列"""
+    records = frame_records_from_stats(stats)
+    for analysis in desk_analysis:
+        record = records[analysis['frame_index']]
+        record['likely_desk'] = analysis['likely_desk']
+        record['likely_character'] = analysis['likely_character']
+        if 'desk_score' in analysis:
+            record['desk_score'] = analysis['desk_score']
+            record['character_score'] = analysis['character_score']
+    return records
+
+def detect_desk_features(histogram, cell_data, content_mask):
     """檢測辦公桌特徵"""
     
     # 辦公桌通常有：
@@ -119,9 +162,9 @@ def detect_desk_features(rgb_content, cell_data, content_mask):
     # 3. 木色或金屬色
     # 4. 規則的幾何形狀
     
-    # 顏色特徵檢測
-    wood_colors = detect_wood_colors(rgb_content)
-    metal_colors = detect_metal_colors(rgb_content) 
+    # 顏色特徵檢測 (規則見 color_classifier)
+    wood_colors = label_fraction(histogram, DESK_WOOD)
+    metal_colors = label_fraction(histogram, DESK_METAL)
     
     # 結構特徵檢測 (簡化版)
     structure_score = detect_geometric_structure(cell_data, content_mask)
@@ -133,59 +176,30 @@ def detect_desk_features(rgb_content, cell_data, content_mask):
 
 def detect_wood_colors(rgb_content):
     """檢測木色"""
-    wood_conditions = (
-        (rgb_content[:, 0] > 80) &   # R > 80
-        (rgb_content[:, 1] > 40) &   # G > 40
-        (rgb_content[:, 2] < 80) &   # B < 80 
-        (rgb_content[:, 0] > rgb_content[:, 2])  # 偏棕色
-    )
-    return np.sum(wood_conditions) / len(rgb_content)
+    return label_fraction(label_histogram(classify_pixels(rgb_content)), DESK_WOOD)
 
 def detect_metal_colors(rgb_content):
     """檢測金屬/灰色"""
-    metal_conditions = (
-        (np.abs(rgb_content[:, 0] - rgb_content[:, 1]) < 25) &
-        (np.abs(rgb_content[:, 1] - rgb_content[:, 2]) < 25) &
-        (rgb_content[:, 0] > 60) & (rgb_content[:, 0] < 180)
-    )
-    return np.sum(metal_conditions) / len(rgb_content)
+    return label_fraction(label_histogram(classify_pixels(rgb_content)), DESK_METAL)
 
 def detect_geometric_structure(cell_data, content_mask):
     """檢測幾何結構 (簡化版)"""
     
-    # 檢測水平線條密度
+    # 檢測水平線條密度: 中間區域中 60% 以上有內容的列數
     h, w = content_mask.shape
-    horizontal_lines = 0
-    
-    for y in range(h//4, 3*h//4):  # 中間區域
-        line_density = np.sum(content_mask[y, :]) / w
-        if line_density > 0.6:  # 60%以上有內容
-            horizontal_lines += 1
+    line_density = np.count_nonzero(content_mask[h//4:3*h//4], axis=1) / w
+    horizontal_lines = int(np.count_nonzero(line_density > 0.6))
     
     structure_score = min(horizontal_lines / (h//2), 1.0)
     return structure_score
 
+def character_feature_score(histogram):
+    """由旗標直方圖計算人物特徵比例 (膚色或衣服色彩)"""
+    return label_fraction(histogram, SKIN | CLOTHING)
+
 def detect_character_features(rgb_content):
     """檢測人物特徵"""
-    
-    # 膚色檢測
-    skin_conditions = (
-        (rgb_content[:, 0] > 95) &
-        (rgb_content[:, 1] > 40) &  
-        (rgb_content[:, 2] > 20) &
-        (rgb_content[:, 0] > rgb_content[:, 1]) &
-        (rgb_content[:, 0] > rgb_content[:, 2])
-    )
-    
-    # 衣服色彩檢測
-    clothing_conditions = (
-        (rgb_content[:, 2] > rgb_content[:, 0] + 20) |  # 藍色系
-        ((rgb_content[:, 0] > 180) & (rgb_content[:, 1] > 180) & (rgb_content[:, 2] > 180)) |  # 白色
-        ((rgb_content[:, 0] < 60) & (rgb_content[:, 1] < 60) & (rgb_content[:, 2] < 60))  # 黑色
-    )
-    
-    character_pixels = np.sum(skin_conditions | clothing_conditions)
-    return character_pixels / len(rgb_content)
+    return character_feature_score(label_histogram(classify_pixels(rgb_content)))
 
 def summarize_desk_analysis(desk_analysis):
     """總結辦公桌分析結果"""
@@ -248,13 +262,29 @@ def main():
     
     print("🔍 開始驗證每個框架的辦公桌內容...")
     
-    result = verify_desk_in_all_frames()
+    output_path = "../static/assets/data/desk_verification.json"
+    npz_path = records_path(output_path)
+    # 欄式 .npz 一定輸出，JSON 摘要可用 --no-json 略過
+    write_json = '--no-json' not in sys.argv
+    outputs = [npz_path, output_path] if write_json else [npz_path]
+    inputs = ["../static/assets/tilesets/npc-in.png", __file__]
+    manifest = load_manifest()
+    if all(is_up_to_date(manifest, path, inputs) for path in outputs):
+        print(f"⏭️ 輸入未變更，略過: {', '.join(outputs)}")
+        return
+    
+    result = verify_desk_in_all_frames(npz_path=npz_path)
     
     if result:
         # 保存詳細分析結果
-        with open("../static/assets/data/desk_verification.json", "w", encoding="utf-8") as f:
-            json.dump(result, f, indent=2, ensure_ascii=False)
-        print(f"\n💾 詳細驗證結果已保存")
+        if write_json:
+            with stage('json_dump'), open(output_path, "w", encoding="utf-8") as f:
+                json.dump(result, f, indent=2, ensure_ascii=False)
+        for path in outputs:
+            record_output(manifest, path, inputs)
+        save_manifest(manifest)
+        print(f"\n💾 詳細驗證結果已保存: {', '.join(outputs)}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with profiled_run('verify_desk_content'):
+        main()
\ No newline at end of file
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+可行走網格與距離場匯出
+將背景的地板遮罩縮減成 tile 網格，輸出位元壓縮 + 遊程編碼的可行走網格、
+到障礙物的距離場，以及每張桌子 / NPC 的流場 (每格朝目標前進的方向)，
+讓遊戲端移動 NPC 時不需要在執行期做路徑搜尋
+"""
+
+import base64
+import json
+import os
+import sys
+
+import numpy as np
+
+from analyze_office_layout import compute_floor_mask
+from build_manifest import is_up_to_date, load_manifest, record_output, save_manifest
+from npc_placement import CHARACTERS_FILE, GAME_CONFIG_FILE, OUTPUT_FILE as PLACEMENTS_FILE
+from pixel_cache import load_pixels
+from stage_timer import profiled_run
+from summed_area import block_sums
+
+BACKGROUND_DIR = "../static/assets"
+OUTPUT_FILE = "../static/assets/data/walkability.json"
+
+TILE_SIZE = 16
+# tile 內地板像素比例達到此值才算可行走
+WALKABLE_RATIO = 0.6
+
+# 流場方向代碼 0-7 對應的 (dx, dy)，依順時針排列，從正東開始
+DIRECTIONS = [(1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1)]
+NO_FLOW = 255
+# 距離場以 uint8 儲存，超過的距離一律記為此值
+MAX_DISTANCE = 254
+
+
+def walkable_grid(floor_mask, tile_size=TILE_SIZE, min_ratio=WALKABLE_RATIO):
+    """由地板遮罩建立 (rows, cols) 布林 tile 網格，右側/下方不足一個 tile 的邊緣不計入"""
+    counts = block_sums(floor_mask, tile_size)
+    return counts >= min_ratio * tile_size * tile_size
+
+
+def _shift(grid, dx, dy, fill=False):
+    """將網格平移 (dx, dy)，結果的 [y, x] 為原本的 [y - dy, x - dx]"""
+    rows, cols = grid.shape
+    shifted = np.full_like(grid, fill)
+    shifted[max(dy, 0):rows + min(dy, 0), max(dx, 0):cols + min(dx, 0)] = \
+        grid[max(-dy, 0):rows + min(-dy, 0), max(-dx, 0):cols + min(-dx, 0)]
+    return shifted
+
+
+def _step_allowed(passable, dx, dy):
+    """從 [y - dy, x - dx] 走到 [y, x] 是否允許: 斜向移動不可切過障礙物的角"""
+    if dx and dy:
+        return _shift(passable, dx, 0) & _shift(passable, 0, dy)
+    return np.ones_like(passable)
+
+
+def bfs_distance(passable, sources):
+    """8 方向的多源廣度優先搜尋，回傳每格到最近來源的步數 (int32，無法到達為 -1)
+
+    每一步以陣列平移一次擴展整個前緣，不需要逐格的 Python 佇列
+    """
+    distance = np.full(passable.shape, -1, dtype=np.int32)
+    frontier = sources & passable
+    distance[frontier] = 0
+    allowed = [(dx, dy, _step_allowed(passable, dx, dy)) for dx, dy in DIRECTIONS]
+
+    step = 0
+    while frontier.any():
+        step += 1
+        grown = np.zeros_like(frontier)
+        for dx, dy, ok in allowed:
+            grown |= _shift(frontier, dx, dy) & ok
+        frontier = grown & passable & (distance < 0)
+        distance[frontier] = step
+
+    return distance
+
+
+def obstacle_distance(walkable):
+    """每個可行走 tile 到最近障礙物 (含地圖邊界外) 的 8 方向步數，障礙物本身為 0"""
+    padded = np.pad(walkable, 1, constant_values=False)
+    distance = bfs_distance(np.ones_like(padded), ~padded)
+    return distance[1:-1, 1:-1]
+
+
+def flow_field(walkable, target):
+    """朝 target (col, row) 前進的流場，每格為 DIRECTIONS 的方向代碼
+
+    目標本身與無法到達的格子為 NO_FLOW
+    """
+    sources = np.zeros_like(walkable)
+    sources[target[1], target[0]] = True
+    distance = bfs_distance(walkable, sources)
+
+    unreachable = np.iinfo(np.int32).max
+    remaining = np.where(distance >= 0, distance, unreachable)
+
+    # 每個方向的鄰格距離: 鄰格 = [y + dy, x + dx]，相當於把距離場平移 (-dx, -dy)
+    neighbour = np.stack([
+        np.where(_step_allowed(walkable, -dx, -dy),
+                 _shift(remaining, -dx, -dy, fill=unreachable), unreachable)
+        for dx, dy in DIRECTIONS
+    ])
+    codes = np.argmin(neighbour, axis=0).astype(np.uint8)
+
+    moves = np.take_along_axis(neighbour, codes[None].astype(np.intp), axis=0)[0] < remaining
+    return np.where((distance > 0) & moves, codes, NO_FLOW).astype(np.uint8)
+
+
+def run_length_encode(bits):
+    """一維布林陣列的遊程編碼，回傳 {'start': 第一段的值, 'runs': [各段長度]}"""
+    bits = np.asarray(bits, dtype=bool).ravel()
+    if bits.size == 0:
+        return {'start': 0, 'runs': []}
+    edges = np.flatnonzero(bits[1:] != bits[:-1]) + 1
+    runs = np.diff(np.concatenate([[0], edges, [bits.size]]))
+    return {'start': int(bits[0]), 'runs': runs.tolist()}
+
+
+def run_length_decode(encoded):
+    """run_length_encode 的反向操作"""
+    runs = np.asarray(encoded['runs'], dtype=np.int64)
+    values = (np.arange(len(runs)) + encoded['start']) % 2
+    return np.repeat(values.astype(bool), runs)
+
+
+def _b64(array):
+    return base64.b64encode(np.ascontiguousarray(array).tobytes()).decode('ascii')
+
+
+def nearest_walkable_tile(walkable, x, y, tile_size=TILE_SIZE):
+    """像素座標所在 tile；該 tile 不可行走時改用最近的可行走 tile，沒有任何可行走 tile 時回傳 None"""
+    rows, cols = np.nonzero(walkable)
+    if len(rows) == 0:
+        return None
+
+    col = min(int(x) // tile_size, walkable.shape[1] - 1)
+    row = min(int(y) // tile_size, walkable.shape[0] - 1)
+    nearest = np.argmin((cols - col) ** 2 + (rows - row) ** 2)
+    return int(cols[nearest]), int(rows[nearest])
+
+
+def load_flow_targets(characters_file=CHARACTERS_FILE, placements_file=PLACEMENTS_FILE):
+    """流場目標: characters.json 中站立/坐著的 NPC 位置 (即桌子)，以及自動擺放結果中的位置"""
+    targets = {}
+
+    if os.path.exists(characters_file):
+        with open(characters_file, 'r', encoding='utf-8') as f:
+            for npc in json.load(f).get('standingNpcs', []):
+                targets[npc['characterId']] = (npc['x'], npc['y'])
+
+    if os.path.exists(placements_file):
+        with open(placements_file, 'r', encoding='utf-8') as f:
+            for npc in json.load(f).get('placements', []):
+                targets.setdefault(npc['id'], (npc['x'], npc['y']))
+
+    return [{'id': target_id, 'x': x, 'y': y} for target_id, (x, y) in targets.items()]
+
+
+def export_walkability(floor_mask, targets, tile_size=TILE_SIZE):
+    """建立可行走網格、距離場與各目標流場的匯出資料
+
+    walkable 以 np.packbits (列優先、高位元在前) 與遊程編碼兩種形式輸出，
+    距離場與流場皆為列優先的 uint8 陣列並以 base64 編碼
+    """
+    walkable = walkable_grid(floor_mask, tile_size)
+    rows, cols = walkable.shape
+
+    distance = np.minimum(obstacle_distance(walkable), MAX_DISTANCE).astype(np.uint8)
+
+    flow_fields = []
+    for target in targets:
+        tile = nearest_walkable_tile(walkable, target['x'], target['y'], tile_size)
+        if tile is None:
+            continue
+        flow_fields.append({
+            'id': target['id'],
+            'x': target['x'],
+            'y': target['y'],
+            'tile': list(tile),
+            'data': _b64(flow_field(walkable, tile)),
+        })
+
+    return {
+        'tileSize': tile_size,
+        'grid': [cols, rows],
+        'walkable': {
+            'bits': _b64(np.packbits(walkable.ravel())),
+            'rle': run_length_encode(walkable),
+            'count': int(walkable.sum()),
+        },
+        'distance': {'maxValue': MAX_DISTANCE, 'data': _b64(distance)},
+        'directions': DIRECTIONS,
+        'noFlow': NO_FLOW,
+        'flowFields': flow_fields,
+    }
+
+
+def main():
+    """主函數"""
+    print("🗺️ 開始匯出可行走網格...")
+
+    with open(GAME_CONFIG_FILE, 'r', encoding='utf-8') as f:
+        background_file = json.load(f)['assets']['background']['file']
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    background = args[0] if args else os.path.join(BACKGROUND_DIR, background_file)
+
+    inputs = [background, CHARACTERS_FILE, PLACEMENTS_FILE, __file__]
+    params = {'tile_size': TILE_SIZE, 'walkable_ratio': WALKABLE_RATIO}
+    manifest = load_manifest()
+    if is_up_to_date(manifest, OUTPUT_FILE, inputs, params):
+        print(f"⏭️ 輸入未變更，略過: {OUTPUT_FILE}")
+        return
+
+    pixels = load_pixels(background, mode=None)
+    floor_mask = compute_floor_mask(pixels)['mask']
+    targets = load_flow_targets()
+
+    result = {
+        'background': os.path.basename(background),
+        'size': [int(pixels.shape[1]), int(pixels.shape[0])],
+        **export_walkability(floor_mask, targets),
+    }
+    cols, rows = result['grid']
+    print(f"  網格: {cols}x{rows} tiles ({TILE_SIZE}px)，可行走 {result['walkable']['count']} 格")
+    print(f"  流場: {len(result['flowFields'])} 個目標")
+
+    with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, separators=(',', ':'))
+    record_output(manifest, OUTPUT_FILE, inputs, params)
+    save_manifest(manifest)
+
+    print(f"💾 可行走資料已保存到: {OUTPUT_FILE} ({os.path.getsize(OUTPUT_FILE) / 1024:.0f} KB)")
+
+
+if __name__ == "__main__":
+    with profiled_run('walkability'):
+        main()